@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+小红书图文生成器 - Card Analysis
+Measures every rendered card with NumPy: ink coverage, the largest empty
+band, the bounding box of the content and whether it runs past the content
+bottom. Flags clipped, near-empty and gapped cards across a whole output tree.
+
+    python analyze.py output/                     # report on every card under output/
+    python analyze.py output/ -o analysis.json    # also write the per-card measures
+    python analyze.py output/ --fail-on clipped,sparse   # exit 1 if any card is flagged so
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("❌ analyze.py needs NumPy: pip install numpy")
+from PIL import Image
+
+import generate
+
+CARD_RE = re.compile(r'^(\d+)_.*\.(jpg|png|webp|avif)$')  # card files, not sheet/strip previews
+INK_THRESHOLD = 48        # a channel this far from the background counts as ink
+CLIP_BAND = 4             # rows just above the footer divider; text descenders stop short of them
+DIVIDER_OFFSET = generate.PADDING + 35 + 10   # divider line, from the card's bottom edge
+SPARSE_COVERAGE = 0.015   # less ink than this in the content area: mostly empty card
+GAP_LIMIT = 200           # px of empty rows between content; paragraph spacing stays near 100
+FLAGS = ['clipped', 'sparse', 'gap']
+
+def load_card(path, scale=2):
+    """(RGB array, scale) of a card image, decoded at 1/`scale` of its size.
+
+    JPEGs are scaled down while decoding (DCT scaling: 1, 2, 4 or 8), which
+    is both faster and a box filter; other formats are decoded in full and
+    subsampled.
+    """
+    img = Image.open(path)
+    width = img.width
+    if scale > 1 and img.format == 'JPEG':
+        img.draft('RGB', (width // scale, img.height // scale))
+    pixels = np.asarray(img.convert('RGB'))
+    # round, not floor: draft() rounds sizes up (1242 px at 1/4 is 311 px)
+    step = scale // max(1, round(width / pixels.shape[1]))
+    if step > 1:
+        pixels = pixels[::step, ::step]
+    return pixels, round(width / pixels.shape[1])
+
+def _ink(block, bg):
+    """Pixels of `block` away from the background color, in uint8 throughout"""
+    diff = np.maximum(block, bg) - np.minimum(block, bg)
+    return (diff[..., 0] > INK_THRESHOLD) | (diff[..., 1] > INK_THRESHOLD) | (diff[..., 2] > INK_THRESHOLD)
+
+def measure(pixels, scale=1):
+    """Measures of one card from its RGB array (rows x cols x 3, uint8).
+
+    `pixels` may be the card scaled down by `scale` (see load_card); all
+    results are in full-size card pixels. The content area runs from below
+    the title (found by its accent underline) to the layout's CONTENT_BOTTOM
+    (max_y). 'empty_band' is the tallest run of empty rows in it, 'gap' the
+    tallest one with content both above and below. 'overflow' is how far
+    ink reaches below max_y, and 'clipped' means it runs into the footer
+    divider - descenders of the last line may pass max_y, but stop short.
+    """
+    h, w = pixels.shape[:2]
+    height, width = h * scale, w * scale
+    corners = pixels[[0, 0, -1, -1], [0, -1, 0, -1]]
+    bg = np.median(corners, axis=0).astype(np.uint8)
+    pad = generate.PADDING
+
+    # The title's accent underline sits below its last line
+    title_lines = None
+    for n in range(1, generate.TITLE_MAX_LINES + 1):
+        y = (pad + 80 + n * generate.TITLE_LINE_HEIGHT + 20 + 2) // scale
+        if _ink(pixels[y, (pad + 4) // scale:(pad + 76) // scale], bg).all():
+            title_lines = n
+            break
+    top = (pad + 80 + (title_lines or 1) * generate.TITLE_LINE_HEIGHT + 20 + 45) // scale
+    max_y = (height - (generate.CARD_SIZE - generate.CONTENT_BOTTOM)) // scale
+    divider = (height - DIVIDER_OFFSET) // scale
+    left = pad // scale
+
+    window = _ink(pixels[top:divider, left:(width - pad) // scale], bg)
+    rows = window.any(axis=1)
+    content_rows = rows[:max_y - top]
+    result = {
+        'size': [width, height],
+        'title_lines': title_lines,
+        'coverage': round(float(window[:max_y - top].mean()), 5),
+        'bbox': None,
+        'empty_band': None,
+        'gap': 0,
+        'overflow': 0,
+        'clipped': bool(rows[(divider - top) - max(1, CLIP_BAND // scale):].any()),
+    }
+
+    ys = np.flatnonzero(rows)
+    if ys.size:
+        xs = np.flatnonzero(window.any(axis=0))
+        result['bbox'] = [int(left + xs[0]) * scale, int(top + ys[0]) * scale,
+                          int(left + xs[-1] + 1) * scale, int(top + ys[-1] + 1) * scale]
+        result['overflow'] = max(0, int(top + ys[-1] + 1 - max_y) * scale)
+
+    # Runs of empty rows: edges of the padded empty mask pair up as (start, end)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], ~content_rows, [0])).astype(np.int8)))
+    if edges.size:
+        starts, ends = edges[::2], edges[1::2]
+        k = int(np.argmax(ends - starts))
+        result['empty_band'] = [int(top + starts[k]) * scale, int(ends[k] - starts[k]) * scale]
+        inner = (starts > 0) & (ends < content_rows.size)
+        if inner.any():
+            result['gap'] = int((ends - starts)[inner].max()) * scale
+    result['content_height'] = int(max_y - top) * scale
+    return result
+
+def flags(m):
+    """Names of the FLAGS that apply to one card's measures"""
+    found = []
+    if m['clipped']:
+        found.append('clipped')
+    if m['coverage'] < SPARSE_COVERAGE:
+        found.append('sparse')
+    if m['gap'] > GAP_LIMIT:
+        found.append('gap')
+    return found
+
+def analyze_file(path, scale=2):
+    pixels, got = load_card(path, scale)
+    result = measure(pixels, got)
+    result['flags'] = flags(result)
+    return result
+
+def find_cards(root):
+    """Card images under `root` (a post's output folder or a batch output tree)"""
+    cards = []
+    for folder, _, files in os.walk(root):
+        for name in files:
+            match = CARD_RE.match(name)
+            if match:
+                cards.append((os.path.join(folder, name), int(match.group(1))))
+    cards.sort(key=lambda c: (os.path.dirname(c[0]), c[1]))
+    return [path for path, _ in cards]
+
+def _analyze_chunk(paths, scale):
+    return [analyze_file(path, scale) for path in paths]
+
+def analyze(paths, scale=2, workers=None):
+    """Measures of every card in `paths`, in order, across a process pool"""
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, min(64, len(paths) // (workers * 4)))
+    chunks = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+    if workers == 1 or len(chunks) == 1:
+        return _analyze_chunk(paths, scale)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [r for results in pool.map(_analyze_chunk, chunks, [scale] * len(chunks)) for r in results]
+
+def _describe(m, flag):
+    if flag == 'clipped':
+        return f"clipped: content runs {m['overflow']} px below max_y into the footer"
+    if flag == 'sparse':
+        y, band = m['empty_band']
+        return f"sparse: {m['coverage']:.1%} ink, {band} px empty from y={y}"
+    return f"gap: {m['gap']} px of empty rows between content"
+
+def report(root, paths, results):
+    """Print flagged cards and a per-post summary"""
+    posts = {}
+    for path, m in zip(paths, results):
+        posts.setdefault(os.path.relpath(os.path.dirname(path), root), []).append((path, m))
+    for post, cards in posts.items():
+        flagged = [(path, m) for path, m in cards if m['flags']]
+        coverage = statistics.mean(m['coverage'] for _, m in cards)
+        print(f"{'⚠️ ' if flagged else '✅'} {post}: {len(cards)} cards, {coverage:.1%} ink"
+              f"{f', {len(flagged)} flagged' if flagged else ''}")
+        for path, m in flagged:
+            for flag in m['flags']:
+                print(f"     {os.path.basename(path)} - {_describe(m, flag)}")
+
+    coverages = sorted(m['coverage'] for m in results)
+    quantiles = statistics.quantiles(coverages, n=10) if len(coverages) > 1 else coverages * 9
+    print(f"{'─' * 40}")
+    print(f"📊 Ink coverage p10 {quantiles[0]:.1%}  p50 {statistics.median(coverages):.1%}  "
+          f"p90 {quantiles[-1]:.1%}")
+    counts = {flag: sum(flag in m['flags'] for m in results) for flag in FLAGS}
+    print("🚩 " + '  '.join(f"{flag} {n}" for flag, n in counts.items()))
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure rendered cards and flag layout problems.")
+    parser.add_argument('root', nargs='?', default='output',
+                        help="output folder of a post, or of a batch run (default: output)")
+    parser.add_argument('-o', '--output', metavar='FILE', help="write the per-card measures as JSON")
+    parser.add_argument('--scale', type=int, choices=[1, 2, 4], default=2,
+                        help="measure at 1/SCALE size: 2 is ~3x faster and accurate to 2 px (default: 2)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    parser.add_argument('--fail-on', default='clipped', metavar='FLAGS',
+                        help=f"comma-separated flags that fail the run with exit 1, or 'none' "
+                             f"(from: {', '.join(FLAGS)}; default: clipped)")
+    args = parser.parse_args()
+
+    fail_on = [] if args.fail_on == 'none' else args.fail_on.split(',')
+    unknown = [flag for flag in fail_on if flag not in FLAGS]
+    if unknown:
+        print(f"❌ Unknown flags: {', '.join(unknown)}")
+        sys.exit(2)
+    paths = find_cards(args.root)
+    if not paths:
+        print(f"❌ No cards under {args.root}")
+        sys.exit(2)
+
+    started = time.perf_counter()
+    results = analyze(paths, args.scale, args.workers)
+    elapsed = time.perf_counter() - started
+    for path, m in zip(paths, results):
+        m['file'] = os.path.relpath(path, args.root)
+    counts = report(args.root, paths, results)
+    print(f"⏱️  {len(paths)} cards in {elapsed:.2f} s ({elapsed / len(paths) * 1000:.1f} ms per card)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'root': args.root, 'scale': args.scale, 'cards': results}, f,
+                      ensure_ascii=False, indent=1)
+        print(f"💾 Measures → {args.output}")
+
+    failed = sum(counts[flag] for flag in fail_on)
+    if failed:
+        print(f"\n❌ {failed} cards flagged {'/'.join(fail_on)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+小红书图文生成器 - Benchmarks
+Times parse / wrap / layout / draw / encode for synthetic and real posts.
+
+    python benchmark.py                          # run, write benchmark-results.json
+    python benchmark.py -o baseline.json         # store a baseline
+    python benchmark.py --compare baseline.json  # flag regressions against it
+    python benchmark.py --only startup           # just the CLI startup timings
+    python benchmark.py --no-memory              # skip the per-stage peak RSS runs
+"""
+
+import sys
+import os
+import glob
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+import PIL
+from PIL import Image
+
+import generate
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+BLOG_GLOB = os.path.join(SCRIPT_DIR, '..', 'blog', '20*', '*', 'index.html')
+STAGES = ['parse', 'wrap', 'layout', 'draw', 'encode']
+STARTUP_STAGES = ['import', 'help', 'noop']
+DEFAULT_THRESHOLD = 0.10   # flag stages that got >10% slower
+MIN_DELTA_MS = 1.0         # ...and by more than this, to ignore timer noise
+MIN_DELTA_KB = 1024        # same for peak RSS growth
+
+LOREM = ("Open source is the way. Performance is becoming critically important at every "
+         "layer, from applications and agent providers to API and model providers. ")
+CJK = ("开源是正确的道路。性能在每一层都变得至关重要，从应用和智能体提供商到接口和模型提供商。"
+       "（括号）「引号」、顿号，逗号；分号！")
+
+def _section(title, paragraphs, bullets=0, images=()):
+    parts = [f"<h2>{title}</h2>"]
+    parts += [f"<p>{p}</p>" for p in paragraphs]
+    if bullets:
+        parts.append('<ul>' + ''.join(f"<li>{LOREM[:80]} {i}</li>" for i in range(bullets)) + '</ul>')
+    parts += [f'<img src="{src}">' for src in images]
+    return '\n'.join(parts)
+
+def _page(sections):
+    return ('<html><body><h1 class="post-title">Benchmark</h1><hr>\n'
+            + '\n'.join(sections) + '\n</body></html>')
+
+def write_synthetic_fixtures(root):
+    """Write the synthetic posts under `root`; returns {name: html path}"""
+    assets = os.path.join(root, 'assets', 'bench')
+    Path(assets).mkdir(parents=True, exist_ok=True)
+    images = []
+    for i, size in enumerate([(2400, 1350), (1600, 1600), (900, 1800), (3000, 1000)]):
+        img = Image.linear_gradient('L').resize(size).convert('RGB')
+        name = f"img{i}.{'jpg' if i % 2 else 'png'}"
+        img.save(os.path.join(assets, name))
+        images.append(f"/assets/bench/{name}")
+
+    pages = {
+        'short': _page([_section(f"Section {i}", [LOREM * 2], bullets=2) for i in range(3)]),
+        'long': _page([_section(f"Section {i}", [LOREM * 6] * 8, bullets=6) for i in range(10)]),
+        'cjk': _page([_section(f"第{i}节 中文标题", [CJK * 6] * 6, bullets=3) for i in range(20)]),
+        'images': _page([_section(f"Figure {i}", [LOREM], images=images[i % 4:] + images[:i % 4])
+                          for i in range(12)]),
+    }
+    fixtures = {}
+    for name, html in pages.items():
+        post_dir = os.path.join(root, 'blog', name)
+        Path(post_dir).mkdir(parents=True, exist_ok=True)
+        path = os.path.join(post_dir, 'index.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        fixtures[f"synthetic/{name}"] = path
+    return fixtures
+
+def blog_fixtures():
+    """Every real post in the repo's blog/ folder"""
+    return {f"blog/{os.path.basename(os.path.dirname(p))}": p
+            for p in sorted(glob.glob(BLOG_GLOB))}
+
+def _measure(fn, repeat):
+    """Warm once, then time `repeat` runs"""
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+    }
+
+def stage_functions(html_file):
+    """({stage: fn}, their outputs) for one post. Each stage works on what
+    the stages before it last produced, so run them in STAGES order."""
+    body_font = generate.get_font(generate.BODY_FONT_SIZE)
+    width = generate.CONTENT_WIDTH - generate.BULLET_INDENT
+    out = {}
+
+    def parse():
+        out['sections'] = generate.parse_html(html_file)
+
+    def wrap():
+        for s in out['sections']:
+            for t, c in s['content_items']:
+                if t == 'text':
+                    generate.wrap_text(c, body_font, width)
+
+    def layout():
+        out['cards'] = generate.layout_cards(out['sections'])
+
+    def draw():
+        cards = out['cards']
+        out['images'] = [generate.render_card(card, i, len(cards)) for i, card in enumerate(cards)]
+
+    def encode():
+        for card, img in zip(out['cards'], out['images']):
+            generate.encode_card(img, generate.card_format(card))
+
+    return {'parse': parse, 'wrap': wrap, 'layout': layout, 'draw': draw, 'encode': encode}, out
+
+def _peak_rss_kb():
+    """Peak resident set size of this process so far (None where unsupported).
+
+    Linux's VmHWM belongs to the address space exec() created; ru_maxrss
+    there would also count the parent's pages that were mapped at fork.
+    """
+    try:
+        with open('/proc/self/status', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KB elsewhere
+
+def measure_peak_rss(html_file):
+    """{stage: peak RSS in KB} for one post, each from a fresh process that
+    runs the pipeline up to and including that stage once. Unlike
+    tracemalloc this counts Pillow's image buffers and other C allocations;
+    the step from one stage to the next is what that stage adds."""
+    peaks = {}
+    for stage in STAGES:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--peak-rss', stage, html_file],
+                              cwd=SCRIPT_DIR, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"peak RSS run of {stage} failed: {proc.stderr}")
+        peaks[stage] = json.loads(proc.stdout.splitlines()[-1])
+    return peaks
+
+def _run_peak_rss(stage, html_file):
+    """Child side of measure_peak_rss(): print the peak RSS as JSON"""
+    stages, _ = stage_functions(html_file)
+    for name in STAGES[:STAGES.index(stage) + 1]:
+        stages[name]()
+    print(json.dumps(_peak_rss_kb()))
+
+def bench_fixture(html_file, repeat, memory=True):
+    """Per-stage timings (and peak RSS) for one post"""
+    stages, out = stage_functions(html_file)
+    result = {'stages': {}}
+    for stage in STAGES:
+        result['stages'][stage] = _measure(stages[stage], repeat)
+    result['cards'] = len(out['cards'])
+    if memory:
+        for stage, peak in measure_peak_rss(html_file).items():
+            result['stages'][stage]['peak_rss_kb'] = peak
+    return result
+
+def _run_cli(args, importtime=False):
+    """Wall time in ms of `python generate.py ARGS`, and its -X importtime report"""
+    cmd = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [
+        os.path.join(SCRIPT_DIR, 'generate.py')] + args
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=SCRIPT_DIR, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(args)} failed: {proc.stdout}{proc.stderr}")
+    return elapsed, proc.stderr
+
+def _import_times(report):
+    """{top-level module: cumulative ms} from a -X importtime report"""
+    times = {}
+    for line in report.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):  # nested imports are indented
+            times[name.strip()] = int(cumulative) / 1000
+    return times
+
+def _timings(samples):
+    return {'min_ms': round(min(samples), 3), 'median_ms': round(statistics.median(samples), 3)}
+
+def bench_startup(html_file, output_dir, repeat):
+    """Cold CLI runs: importing generate, --help, and a no-op rebuild of `html_file`"""
+    imports = []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import generate'],
+                              cwd=SCRIPT_DIR, capture_output=True, text=True)
+        imports.append(_import_times(proc.stderr)['generate'])
+
+    _run_cli([html_file, output_dir])  # render once so later runs are no-ops
+    help_runs = [_run_cli(['--help'])[0] for _ in range(repeat)]
+    noop_runs = [_run_cli([html_file, output_dir])[0] for _ in range(repeat)]
+    _, report = _run_cli([html_file, output_dir], importtime=True)
+    heaviest = sorted(_import_times(report).items(), key=lambda kv: -kv[1])[:5]
+    return {
+        'stages': {'import': _timings(imports), 'help': _timings(help_runs), 'noop': _timings(noop_runs)},
+        'noop_imports_ms': {name: round(ms, 2) for name, ms in heaviest},
+    }
+
+def run(fixtures, repeat, memory=True):
+    results = {}
+    for name, path in fixtures.items():
+        result = bench_fixture(path, repeat, memory)
+        results[name] = result
+        timings = '  '.join(f"{stage} {result['stages'][stage]['min_ms']:8.2f}" for stage in STAGES)
+        print(f"⏱️  {name:<32} {result['cards']:>3} cards  {timings}  ms")
+        peaks = [result['stages'][stage].get('peak_rss_kb') for stage in STAGES]
+        if any(peaks):
+            print(f"   {'peak RSS':<32} {'':>9}  " + '  '.join(
+                f"{stage} {peak / 1024:8.1f}" for stage, peak in zip(STAGES, peaks)) + "  MB")
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'font': generate.resolve_font(),
+            'repeat': repeat,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+# Compared fields: (key, noise floor, format, unit)
+COMPARED = [('min_ms', MIN_DELTA_MS, '.2f', 'ms'), ('peak_rss_kb', MIN_DELTA_KB, ',.0f', 'KB')]
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """Print per-stage time and peak RSS changes; returns the list of regressions"""
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        for stage, timing in result['stages'].items():
+            for key, min_delta, fmt, unit in COMPARED:
+                old = base['stages'].get(stage, {}).get(key)
+                new = timing.get(key)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                label = f"{name} {stage}{' peak RSS' if key == 'peak_rss_kb' else ''}"
+                if change > threshold and new - old > min_delta:
+                    regressions.append((name, stage, key, old, new))
+                    print(f"❌ {label}: {old:{fmt}} → {new:{fmt}} {unit} ({change:+.0%})")
+                elif change < -threshold and old - new > min_delta:
+                    print(f"🚀 {label}: {old:{fmt}} → {new:{fmt}} {unit} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the card generator stages.")
+    parser.add_argument('-o', '--output', default='benchmark-results.json',
+                        help="write results JSON here (default: benchmark-results.json)")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="compare against a stored results JSON and exit 1 on regressions")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"relative slowdown counted as a regression (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument('-n', '--repeat', type=int, default=5, help="timed runs per stage (default: 5)")
+    parser.add_argument('--only', metavar='TEXT',
+                        help="only fixtures whose name contains TEXT ('startup': only the startup timings)")
+    parser.add_argument('--no-blog', action='store_true', help="skip the real blog/ posts")
+    parser.add_argument('--no-startup', action='store_true',
+                        help="skip the cold-start CLI timings (import, --help, no-op rebuild)")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the per-stage peak RSS runs (one process per stage and fixture)")
+    parser.add_argument('--peak-rss', nargs=2, metavar=('STAGE', 'HTML'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.peak_rss:
+        _run_peak_rss(*args.peak_rss)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fixtures = write_synthetic_fixtures(tmp)
+        if not args.no_blog:
+            fixtures.update(blog_fixtures())
+        startup_post = fixtures['synthetic/short']
+        if args.only:
+            fixtures = {k: v for k, v in fixtures.items() if args.only in k}
+
+        print(f"📊 {len(fixtures)} fixtures, {args.repeat} runs per stage (min shown)")
+        print(f"{'─' * 40}")
+        current = run(fixtures, args.repeat, memory=not args.no_memory)
+        if not args.no_startup and (not args.only or args.only == 'startup'):
+            result = bench_startup(startup_post, os.path.join(tmp, 'startup-output'), args.repeat)
+            current['results']['startup'] = result
+            timings = '  '.join(f"{stage} {result['stages'][stage]['min_ms']:8.2f}" for stage in STARTUP_STAGES)
+            print(f"⏱️  {'startup':<32} {'':>9}  {timings}  ms")
+            print("   no-op run imports: " + ', '.join(f"{name} {ms:.1f}"
+                                                     for name, ms in result['noop_imports_ms'].items()))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(current, f, ensure_ascii=False, indent=1)
+    print(f"{'─' * 40}")
+    print(f"💾 Results → {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regressions against {args.compare}")
+            sys.exit(1)
+        print(f"\n✨ No regressions against {args.compare}")
+
+if __name__ == '__main__':
+    main()
@@ -1,617 +1,3058 @@
-#!/usr/bin/env python3
-"""
-小红书图文生成器 - Xiaohongshu Card Generator
-专业简洁风格 - Professional & Clean Style
-"""
-
-import sys
-import os
-import re
-from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
-from bs4 import BeautifulSoup
-import urllib.request
-import hashlib
-
-# Configuration
-CARD_SIZE = 1080
-PADDING = 70
-TITLE_FONT_SIZE = 52
-BODY_FONT_SIZE = 26
-LABEL_FONT_SIZE = 22
-LINE_SPACING = 1.7
-WATERMARK_TEXT = "pengandy.com"
-
-# Professional color schemes - 专业简洁配色
-COLOR_SCHEMES = [
-    {
-        'name': 'minimal_white',
-        'bg': (255, 255, 255),           # 纯白
-        'title': (26, 26, 26),           # 深黑
-        'body': (80, 80, 80),            # 中灰
-        'accent': (255, 107, 107),       # 活力红
-        'tag_bg': (255, 245, 245),       # 浅红背景
-    },
-    {
-        'name': 'soft_blue',
-        'bg': (250, 252, 255),           # 浅蓝白
-        'title': (30, 58, 138),          # 深蓝
-        'body': (71, 85, 105),           # 蓝灰
-        'accent': (59, 130, 246),        # 亮蓝
-        'tag_bg': (239, 246, 255),       # 浅蓝背景
-    },
-    {
-        'name': 'warm_cream',
-        'bg': (255, 251, 245),           # 米白
-        'title': (120, 53, 15),          # 棕色
-        'body': (87, 83, 78),            # 暖灰
-        'accent': (234, 88, 12),         # 橙色
-        'tag_bg': (255, 247, 237),       # 浅橙背景
-    },
-    {
-        'name': 'fresh_mint',
-        'bg': (247, 254, 250),           # 薄荷白
-        'title': (6, 78, 59),            # 深绿
-        'body': (75, 85, 99),            # 冷灰
-        'accent': (16, 185, 129),        # 翠绿
-        'tag_bg': (236, 253, 245),       # 浅绿背景
-    },
-]
-
-def download_image(url, output_dir):
-    """Download image from URL and save to temp folder"""
-    try:
-        # Create temp folder for downloaded images
-        temp_dir = os.path.join(output_dir, '.temp_images')
-        Path(temp_dir).mkdir(parents=True, exist_ok=True)
-
-        # Generate filename from URL hash
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        ext = url.split('.')[-1].split('?')[0]  # Get extension, remove query params
-        if ext not in ['jpg', 'jpeg', 'png', 'gif', 'webp']:
-            ext = 'jpg'
-        filename = f"{url_hash}.{ext}"
-        filepath = os.path.join(temp_dir, filename)
-
-        # Download if not already cached
-        if not os.path.exists(filepath):
-            urllib.request.urlretrieve(url, filepath)
-
-        return filepath
-    except Exception as e:
-        print(f"⚠️  Could not download image from {url}: {e}")
-        return None
-
-def parse_html(html_file, output_dir='output'):
-    """Extract H2/H3 headings and their content"""
-    with open(html_file, 'r', encoding='utf-8') as f:
-        html = f.read()
-
-    soup = BeautifulSoup(html, 'html.parser')
-    cards = []
-    html_dir = os.path.dirname(os.path.abspath(html_file))
-
-    # Find the project root (where assets folder would be)
-    # Assume blog posts are in blog/YEAR/POST/ structure
-    base_path = html_dir
-    while base_path and not os.path.exists(os.path.join(base_path, 'assets')):
-        parent = os.path.dirname(base_path)
-        if parent == base_path:  # Reached filesystem root
-            break
-        base_path = parent
-
-    headings = soup.find_all(['h2', 'h3'])
-    processed_elements = set()  # Track which elements we've already processed
-
-    # Extract intro/preface content before first heading (前言)
-    intro_content = []
-    if headings:
-        first_heading = headings[0]
-
-        # Method 1: Check markdown-content div for quotes/intro (like bdrk1yo)
-        markdown_div = soup.find('div', id='markdown-content')
-        if markdown_div:
-            for p in markdown_div.find_all('p', recursive=False):
-                text = p.get_text().strip()
-                if text and len(text) > 50:
-                    intro_content.append(('text', text))
-                    processed_elements.add(id(p))
-
-        # Method 2: Find content between <hr> and first H2 (like serverless10yo)
-        for elem in first_heading.find_previous_siblings():
-            if elem.name == 'p':
-                text = elem.get_text().strip()
-                # Skip empty, very short, or metadata-like content
-                # Check it doesn't look like navigation/tags (has '·' or lots of links)
-                link_ratio = len(elem.find_all('a')) / max(1, len(text.split()))
-                if text and len(text) > 80 and '·' not in text and link_ratio < 0.3:
-                    intro_content.insert(0, ('text', text))
-                    processed_elements.add(id(elem))
-            elif elem.name == 'hr':
-                # Stop at horizontal rule (usually marks end of header)
-                break
-
-    # Create introduction card if there's substantial intro content
-    if intro_content:
-        # Get blog title from h1.post-title
-        blog_title_elem = soup.find('h1', class_='post-title')
-        blog_title = blog_title_elem.get_text().strip() if blog_title_elem else "Introduction"
-
-        cards.append({
-            'title': blog_title,
-            'content_items': intro_content[:3]  # Limit to first 3 intro paragraphs
-        })
-
-    for idx, heading in enumerate(headings):
-        title = heading.get_text().strip()
-        content_items = []  # Store items in order with type info
-
-        # First, check for content BEFORE the heading (previous siblings)
-        # Skip this for the first heading to avoid including general blog intro
-        prev_siblings = []
-        if idx > 0:  # Only process previous siblings for non-first headings
-            for sibling in heading.find_previous_siblings():
-                if sibling.name in ['h2', 'h3']:
-                    break
-                prev_siblings.insert(0, sibling)  # Insert at start to maintain order
-
-        # Process previous siblings (content before heading)
-        for sibling in prev_siblings:
-            if id(sibling) in processed_elements:
-                continue
-            processed_elements.add(id(sibling))
-
-            if sibling.name == 'p':
-                text = sibling.get_text().strip()
-                if text:
-                    content_items.append(('text', text))
-            elif sibling.name == 'li':
-                text = sibling.get_text().strip()
-                if text:
-                    content_items.append(('text', '• ' + text))
-            elif sibling.name == 'img':
-                img_src = sibling.get('src')
-                if img_src:
-                    img_path = None
-                    if img_src.startswith('http'):
-                        img_path = download_image(img_src, output_dir)
-                    else:
-                        img_path = os.path.join(base_path, img_src.lstrip('/'))
-                        if not os.path.exists(img_path):
-                            img_path = None
-                    if img_path:
-                        content_items.append(('image', img_path))
-
-            # Check for images inside elements
-            img_tags = sibling.find_all('img') if hasattr(sibling, 'find_all') else []
-            for img_tag in img_tags:
-                img_src = img_tag.get('src')
-                if img_src:
-                    img_path = None
-                    if img_src.startswith('http'):
-                        img_path = download_image(img_src, output_dir)
-                    else:
-                        img_path = os.path.join(base_path, img_src.lstrip('/'))
-                        if not os.path.exists(img_path):
-                            img_path = None
-                    if img_path:
-                        content_items.append(('image', img_path))
-
-        # Then process content AFTER the heading (next siblings)
-        for sibling in heading.find_next_siblings():
-            if sibling.name in ['h2', 'h3']:
-                break
-            if id(sibling) in processed_elements:
-                continue
-            processed_elements.add(id(sibling))
-
-            if sibling.name == 'p':
-                text = sibling.get_text().strip()
-                if text:
-                    content_items.append(('text', text))
-            elif sibling.name == 'li':
-                text = sibling.get_text().strip()
-                if text:
-                    content_items.append(('text', '• ' + text))
-            elif sibling.name in ['ul', 'ol']:
-                for li in sibling.find_all('li'):
-                    text = li.get_text().strip()
-                    if text:
-                        content_items.append(('text', '• ' + text))
-            elif sibling.name == 'table':
-                # Extract content from tables (including lists in table cells)
-                for cell in sibling.find_all(['td', 'th']):
-                    # Get paragraphs in cells
-                    for p in cell.find_all('p'):
-                        text = p.get_text().strip()
-                        if text:
-                            content_items.append(('text', text))
-                    # Get list items in cells
-                    for li in cell.find_all('li'):
-                        text = li.get_text().strip()
-                        if text:
-                            content_items.append(('text', '• ' + text))
-            elif sibling.name == 'img':
-                img_src = sibling.get('src')
-                if img_src:
-                    img_path = None
-                    if img_src.startswith('http'):
-                        img_path = download_image(img_src, output_dir)
-                    else:
-                        img_path = os.path.join(base_path, img_src.lstrip('/'))
-                        if not os.path.exists(img_path):
-                            img_path = None
-                    if img_path:
-                        content_items.append(('image', img_path))
-
-            # Check for images inside elements
-            img_tags = sibling.find_all('img') if hasattr(sibling, 'find_all') else []
-            for img_tag in img_tags:
-                img_src = img_tag.get('src')
-                if img_src:
-                    img_path = None
-                    if img_src.startswith('http'):
-                        img_path = download_image(img_src, output_dir)
-                    else:
-                        img_path = os.path.join(base_path, img_src.lstrip('/'))
-                        if not os.path.exists(img_path):
-                            img_path = None
-                    if img_path:
-                        content_items.append(('image', img_path))
-
-        if content_items:
-            # Smart limiting: if there are images, check if they'll overflow
-            has_images = any(item_type == 'image' for item_type, _ in content_items)
-            if has_images:
-                # Find first image position
-                first_img_pos = next(i for i, (t, _) in enumerate(content_items) if t == 'image')
-
-                # Estimate if image will fit on same card with text
-                # More realistic estimate: each text item averages 200px with spacing, image = 380px (with spacing)
-                text_before_img = content_items[:first_img_pos]
-                num_text_items = sum(1 for t, _ in text_before_img if t == 'text')
-
-                # Calculate more accurate text height based on actual char counts
-                total_text_chars = sum(len(c) for t, c in text_before_img if t == 'text')
-                estimated_text_height = (total_text_chars // 50) * 45 + num_text_items * 20  # 45px per line + 20px spacing
-                estimated_img_height = 380  # Image + spacing
-                title_and_padding = 250  # Title, decorative line, spacing
-                total_estimated_height = title_and_padding + estimated_text_height + estimated_img_height
-
-                # Available space before watermark: CARD_SIZE(1080) - PADDING(70) - bottom_margin(105) = 905
-                max_card_height = 880  # Be more conservative
-
-                # If content would overflow, split into separate cards
-                if total_estimated_height > max_card_height and num_text_items >= 2:
-                    # Card 1: Text only (keep first 2-3 text items)
-                    text_items = [item for item in content_items[:first_img_pos] if item[0] == 'text'][:3]
-                    cards.append({
-                        'title': title,
-                        'content_items': text_items
-                    })
-
-                    # Card 2: Image + remaining content
-                    image_and_after = [content_items[first_img_pos]] + content_items[first_img_pos+1:first_img_pos+3]
-                    cards.append({
-                        'title': f"{title} (cont.)",
-                        'content_items': image_and_after
-                    })
-                else:
-                    # Fits on one card - limit text before image
-                    if first_img_pos > 2:
-                        final_items = content_items[:2] + [content_items[first_img_pos]]
-                    else:
-                        final_items = content_items[:min(first_img_pos + 2, 6)]
-
-                    # Truncate very long text items
-                    truncated_items = []
-                    for item_type, content in final_items:
-                        if item_type == 'text' and len(content) > 180:
-                            truncated_items.append((item_type, content[:180] + '...'))
-                        else:
-                            truncated_items.append((item_type, content))
-
-                    cards.append({
-                        'title': title,
-                        'content_items': truncated_items
-                    })
-            else:
-                # No images: can fit more text
-                final_items = content_items[:12]
-                cards.append({
-                    'title': title,
-                    'content_items': final_items
-                })
-
-    return cards
-
-def wrap_text(text, font, max_width, draw):
-    """Wrap text to fit within max_width"""
-    lines = []
-    paragraphs = text.split('\n')
-
-    for paragraph in paragraphs:
-        if not paragraph.strip():
-            continue
-
-        words = paragraph.split()
-        current_line = []
-
-        for word in words:
-            test_line = ' '.join(current_line + [word])
-            try:
-                bbox = draw.textbbox((0, 0), test_line, font=font)
-                line_width = bbox[2] - bbox[0]
-            except:
-                line_width = len(test_line) * 15
-
-            if line_width <= max_width:
-                current_line.append(word)
-            else:
-                if current_line:
-                    lines.append(' '.join(current_line))
-                    current_line = [word]
-                else:
-                    lines.append(word)
-
-        if current_line:
-            lines.append(' '.join(current_line))
-
-    return lines
-
-def generate_card_image(card, output_path, card_index, total_cards):
-    """Generate professional Xiaohongshu-style card"""
-
-    # Choose color scheme
-    scheme = COLOR_SCHEMES[card_index % len(COLOR_SCHEMES)]
-
-    # Create base image
-    img = Image.new('RGB', (CARD_SIZE, CARD_SIZE), scheme['bg'])
-    draw = ImageDraw.Draw(img)
-
-    # Load fonts
-    title_font = None
-    body_font = None
-
-    font_paths = [
-        '/System/Library/Fonts/PingFang.ttc',
-        '/System/Library/Fonts/STHeiti Medium.ttc',
-        '/System/Library/Fonts/Supplemental/Arial Unicode.ttf',
-    ]
-
-    for font_path in font_paths:
-        if os.path.exists(font_path):
-            try:
-                title_font = ImageFont.truetype(font_path, TITLE_FONT_SIZE)
-                body_font = ImageFont.truetype(font_path, BODY_FONT_SIZE)
-                label_font = ImageFont.truetype(font_path, LABEL_FONT_SIZE)
-                break
-            except:
-                continue
-
-    if not title_font:
-        title_font = ImageFont.load_default()
-        body_font = ImageFont.load_default()
-        label_font = ImageFont.load_default()
-
-    # Add card number badge (top right)
-    badge_text = f"{card_index + 1}/{total_cards}"
-    try:
-        bbox = draw.textbbox((0, 0), badge_text, font=label_font)
-        badge_width = bbox[2] - bbox[0] + 30
-        badge_height = bbox[3] - bbox[1] + 20
-    except:
-        badge_width = len(badge_text) * 15 + 30
-        badge_height = 40
-
-    badge_x = CARD_SIZE - PADDING - badge_width
-    badge_y = PADDING - 10
-
-    # Badge background
-    draw.rounded_rectangle(
-        [(badge_x, badge_y), (badge_x + badge_width, badge_y + badge_height)],
-        radius=20,
-        fill=scheme['accent']
-    )
-
-    # Badge text
-    text_x = badge_x + 15
-    text_y = badge_y + 10
-    draw.text((text_x, text_y), badge_text, fill=(255, 255, 255), font=label_font)
-
-    # Start content
-    y_position = PADDING + 80
-
-    # Draw title with proper line wrapping
-    content_width = CARD_SIZE - (2 * PADDING)
-    title_lines = wrap_text(card['title'], title_font, content_width, draw)
-
-    for line in title_lines[:2]:  # Max 2 lines for title
-        draw.text(
-            (PADDING, y_position),
-            line,
-            fill=scheme['title'],
-            font=title_font
-        )
-        y_position += int(TITLE_FONT_SIZE * 1.2)
-
-    # Decorative underline
-    y_position += 20
-    draw.rectangle(
-        [(PADDING, y_position), (PADDING + 80, y_position + 5)],
-        fill=scheme['accent']
-    )
-
-    y_position += 45
-
-    # Draw content items in their original order
-    content_items = card.get('content_items', [])
-    img_max_width = CARD_SIZE - (2 * PADDING)
-
-    # Calculate watermark line position
-    watermark_line_y = CARD_SIZE - PADDING - 45
-
-    # Detect if this is an image-focused card (single image or minimal text)
-    num_images = sum(1 for t, _ in content_items if t == 'image')
-    num_text = sum(1 for t, _ in content_items if t == 'text')
-    total_text_chars = sum(len(c) for t, c in content_items if t == 'text')
-
-    # Calculate available space for image dynamically
-    if num_images >= 1 and (num_text == 0 or total_text_chars < 100):
-        # Image-focused card: calculate max height based on available space
-        # Leave margin for spacing above watermark line
-        available_height = watermark_line_y - y_position - 40  # 40px margin before watermark
-        img_max_height = min(680, available_height)  # Cap at 680px but don't overflow
-    else:
-        # Mixed content card: use smaller size to leave room for text
-        img_max_height = 350
-
-    max_y = watermark_line_y - 30  # Stop content 30px before watermark line
-
-    for item_type, item_content in content_items:
-        if y_position >= max_y:
-            break
-
-        if item_type == 'image':
-            # Render image
-            try:
-                content_img = Image.open(item_content)
-
-                # Resize while maintaining aspect ratio
-                img_ratio = content_img.width / content_img.height
-                if img_ratio > 1:  # Landscape
-                    new_width = min(img_max_width, content_img.width)
-                    new_height = int(new_width / img_ratio)
-                else:  # Portrait or square
-                    new_height = min(img_max_height, content_img.height)
-                    new_width = int(new_height * img_ratio)
-
-                # Ensure it fits
-                if new_height > img_max_height:
-                    new_height = img_max_height
-                    new_width = int(new_height * img_ratio)
-                if new_width > img_max_width:
-                    new_width = img_max_width
-                    new_height = int(new_width / img_ratio)
-
-                content_img = content_img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-
-                # Center horizontally
-                img_x = (CARD_SIZE - new_width) // 2
-                img.paste(content_img, (img_x, y_position))
-
-                y_position += new_height + 30
-            except Exception as e:
-                print(f"⚠️  Could not load image: {e}")
-
-        elif item_type == 'text':
-            # Render text
-            if y_position >= max_y:
-                break
-
-            # Handle bullet points
-            if item_content.strip().startswith('•'):
-                bullet_size = 8
-                bullet_x = PADDING + 5
-                bullet_y = y_position + 12
-                draw.ellipse(
-                    [(bullet_x, bullet_y), (bullet_x + bullet_size, bullet_y + bullet_size)],
-                    fill=scheme['accent']
-                )
-                content_x = PADDING + 28
-                text_content = item_content.strip()[1:].strip()
-            else:
-                content_x = PADDING
-                text_content = item_content
-
-            # Wrap and draw text
-            body_lines = wrap_text(text_content, body_font, content_width - 28, draw)
-
-            for line in body_lines:
-                if y_position >= max_y:
-                    break
-
-                draw.text(
-                    (content_x, y_position),
-                    line,
-                    fill=scheme['body'],
-                    font=body_font
-                )
-                y_position += int(BODY_FONT_SIZE * LINE_SPACING)
-
-            y_position += 20  # Space between items
-
-    # Bottom section
-    bottom_y = CARD_SIZE - PADDING - 35
-
-    # Subtle divider line
-    draw.line(
-        [(PADDING, bottom_y - 10), (CARD_SIZE - PADDING, bottom_y - 10)],
-        fill=scheme['accent'],
-        width=2
-    )
-
-    # Watermark
-    draw.text(
-        (PADDING, bottom_y + 5),
-        WATERMARK_TEXT,
-        fill=(150, 150, 150),
-        font=label_font
-    )
-
-    # Small decorative accent (bottom right)
-    accent_x = CARD_SIZE - PADDING - 15
-    accent_y = bottom_y
-    draw.rectangle(
-        [(accent_x, accent_y), (accent_x + 15, accent_y + 30)],
-        fill=scheme['accent']
-    )
-
-    # Save
-    img.save(output_path, 'JPEG', quality=95)
-    print(f"✅ {card_index + 1}/{total_cards} - {scheme['name']}")
-
-def sanitize_filename(text):
-    """Clean filename"""
-    text = re.sub(r'[^\w\s-]', '', text)
-    text = re.sub(r'[-\s]+', '_', text)
-    return text[:50]
-
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python generate.py <html_file_path> [output_dir]")
-        print("\nExample:")
-        print("  python generate.py ../blog/2025/llm/index.html")
-        sys.exit(1)
-
-    html_file = sys.argv[1]
-    output_dir = sys.argv[2] if len(sys.argv) > 2 else 'output'
-
-    if not os.path.exists(html_file):
-        print(f"❌ File not found: {html_file}")
-        sys.exit(1)
-
-    Path(output_dir).mkdir(parents=True, exist_ok=True)
-
-    print(f"📖 Parsing: {html_file}")
-    cards = parse_html(html_file, output_dir)
-    print(f"📊 Found {len(cards)} cards\n")
-
-    if not cards:
-        print("❌ No H2/H3 headings found")
-        sys.exit(1)
-
-    print(f"🎨 Generating professional cards...")
-    print(f"{'─' * 40}")
-
-    for i, card in enumerate(cards):
-        filename = f"{i+1}_{sanitize_filename(card['title'])}.jpg"
-        output_path = os.path.join(output_dir, filename)
-        generate_card_image(card, output_path, i, len(cards))
-
-    print(f"{'─' * 40}")
-    print(f"\n✨ Done! {len(cards)} cards → {output_dir}/")
-    print(f"📂 open {output_dir}")
-
-if __name__ == '__main__':
-    main()
+#!/usr/bin/env python3
+"""
+小红书图文生成器 - Xiaohongshu Card Generator
+专业简洁风格 - Professional & Clean Style
+"""
+
+import sys
+import os
+import re
+import io
+import glob
+import json
+import argparse
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+from pathlib import Path
+import hashlib
+import time
+import importlib.util
+import contextlib
+import atexit
+import select
+import struct
+
+# PIL, BeautifulSoup, http.client, the executors and subprocess are imported
+# inside the functions that use them: --help, usage errors and up-to-date
+# posts never pay for loading them.
+
+# Configuration
+CARD_SIZE = 1080
+PADDING = 70
+TITLE_FONT_SIZE = 52
+BODY_FONT_SIZE = 26
+LABEL_FONT_SIZE = 22
+LINE_SPACING = 1.7
+WATERMARK_TEXT = "pengandy.com"
+MANIFEST_NAME = '.manifest.json'
+MANIFEST_VERSION = 2
+
+# Canvas sizes for --size, as (width, height). Type sizes and margins stay
+# the same on every canvas; a larger one just holds more per card.
+CARD_SIZES = {
+    'square': (CARD_SIZE, CARD_SIZE),
+    'portrait': (1080, 1440),   # 3:4, favored by the Xiaohongshu feed
+    'story': (1242, 1660),
+}
+MIN_CARD_SIDE = 640
+MAX_CARD_SIDE = 4096
+
+# BeautifulSoup backend: lxml is much faster on long posts when installed
+HTML_PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+STREAM_PARSER = 'stream'  # incremental extractor, no tree (see SectionStream)
+
+# Remote images: shared, content-addressed download cache
+IMAGE_CACHE_DIR = os.environ.get('XHS_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+    'xiaohongshu-generator', 'images',
+)
+IMAGE_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp']
+IMAGE_REVALIDATE_AFTER = 24 * 3600  # seconds before a cached URL is re-checked
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 15
+FETCH_RETRIES = 2
+USER_AGENT = 'xiaohongshu-generator'
+
+# Font search order: (path or glob, face index). CJK-capable fonts first;
+# Noto CJK .ttc face 2 is Simplified Chinese.
+FONT_PATHS = [
+    ('/System/Library/Fonts/PingFang.ttc', 0),
+    ('/System/Library/Fonts/STHeiti Medium.ttc', 0),
+    ('/System/Library/Fonts/Supplemental/Arial Unicode.ttf', 0),
+    ('/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc', 2),
+    ('/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc', 2),
+    ('/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc', 2),
+    ('/usr/share/fonts/**/NotoSansCJK*-Regular.ttc', 2),
+    ('/usr/share/fonts/**/NotoSansSC-Regular.*', 0),
+    ('/usr/share/fonts/**/wqy-microhei.ttc', 0),
+    ('/usr/local/share/fonts/**/NotoSansCJK*-Regular.ttc', 2),
+    ('~/.local/share/fonts/**/NotoSansCJK*-Regular.ttc', 2),
+    ('~/.fonts/**/NotoSansCJK*-Regular.ttc', 2),
+]
+# Last resort before Pillow's built-in bitmap font (no CJK glyphs)
+FALLBACK_FONT_PATHS = [
+    ('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 0),
+    ('/usr/share/fonts/dejavu/DejaVuSans.ttf', 0),
+]
+
+# Professional color schemes - 专业简洁配色
+COLOR_SCHEMES = [
+    {
+        'name': 'minimal_white',
+        'bg': (255, 255, 255),           # 纯白
+        'title': (26, 26, 26),           # 深黑
+        'body': (80, 80, 80),            # 中灰
+        'accent': (255, 107, 107),       # 活力红
+        'tag_bg': (255, 245, 245),       # 浅红背景
+    },
+    {
+        'name': 'soft_blue',
+        'bg': (250, 252, 255),           # 浅蓝白
+        'title': (30, 58, 138),          # 深蓝
+        'body': (71, 85, 105),           # 蓝灰
+        'accent': (59, 130, 246),        # 亮蓝
+        'tag_bg': (239, 246, 255),       # 浅蓝背景
+    },
+    {
+        'name': 'warm_cream',
+        'bg': (255, 251, 245),           # 米白
+        'title': (120, 53, 15),          # 棕色
+        'body': (87, 83, 78),            # 暖灰
+        'accent': (234, 88, 12),         # 橙色
+        'tag_bg': (255, 247, 237),       # 浅橙背景
+    },
+    {
+        'name': 'fresh_mint',
+        'bg': (247, 254, 250),           # 薄荷白
+        'title': (6, 78, 59),            # 深绿
+        'body': (75, 85, 99),            # 冷灰
+        'accent': (16, 185, 129),        # 翠绿
+        'tag_bg': (236, 253, 245),       # 浅绿背景
+    },
+]
+
+# Profiling: named timers and counters, enabled by --profile. While off,
+# profile_stage() returns a shared no-op context and counters are skipped.
+PROFILE_STAGES = ['parse_html', 'read', 'soup', 'traverse', 'fetch', 'layout',
+                  'draw', 'decode', 'resize', 'encode']
+_profiler = None
+_NO_PROFILE = contextlib.nullcontext()
+
+class Profiler:
+    """Per-stage wall time, call counts, counters and Chrome trace events"""
+
+    def __init__(self):
+        self.stats = {}      # stage -> [calls, total ns]
+        self.counters = {}
+        self.events = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter_ns() - start
+            stat = self.stats.setdefault(name, [0, 0])
+            stat[0] += 1
+            stat[1] += duration
+            self.events.append({
+                'name': name, 'ph': 'X', 'ts': start / 1000, 'dur': duration / 1000,
+                'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args,
+            })
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def drain(self):
+        """Hand over everything recorded so far (used by pool workers)"""
+        data = (self.stats, self.counters, self.events)
+        self.stats, self.counters, self.events = {}, {}, []
+        return data
+
+    def merge(self, data):
+        stats, counters, events = data
+        for name, (calls, total) in stats.items():
+            stat = self.stats.setdefault(name, [0, 0])
+            stat[0] += calls
+            stat[1] += total
+        for name, n in counters.items():
+            self.count(name, n)
+        self.events.extend(events)
+
+    def report(self, wall_seconds):
+        """Print the per-stage breakdown, counters and slowest posts"""
+        print(f"\n⏱️  Profile ({wall_seconds * 1000:.0f} ms wall, stage times summed over workers)")
+        print(f"{'stage':<14}{'calls':>8}{'total ms':>12}{'mean ms':>10}")
+        names = [n for n in PROFILE_STAGES if n in self.stats]
+        names += sorted(n for n in self.stats if n not in PROFILE_STAGES)
+        for name in names:
+            calls, total = self.stats[name]
+            print(f"{name:<14}{calls:>8}{total / 1e6:>12.1f}{total / 1e6 / calls:>10.2f}")
+        if self.counters:
+            print("counters: " + ', '.join(f"{k}={v}" for k, v in sorted(self.counters.items())))
+
+        per_post = {}
+        for event in self.events:
+            post = event['args'].get('post')
+            if post and event['name'] in ('parse_html', 'layout', 'draw', 'encode'):
+                per_post[post] = per_post.get(post, 0) + event['dur'] / 1000
+        if self.stats.get('parse_html', [0])[0] > 1:
+            slowest = sorted(per_post.items(), key=lambda kv: -kv[1])[:5]
+            print("slowest posts: " + ', '.join(f"{post} {ms:.0f} ms" for post, ms in slowest))
+
+    def write_trace(self, path):
+        """Write a Chrome trace (chrome://tracing, Perfetto)"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+def enable_profiling():
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+def profile_stage(name, **args):
+    """Timer context for a named stage; free when profiling is off"""
+    if _profiler is None:
+        return _NO_PROFILE
+    return _profiler.stage(name, **args)
+
+def profile_count(name, n=1):
+    if _profiler is not None:
+        _profiler.count(name, n)
+
+def _drain_profile():
+    return _profiler.drain() if _profiler is not None else None
+
+# Font registry: one FreeTypeFont per (path, size, face index) per process.
+# Pool workers each build their own on first use; configure_font() is passed
+# to the pool as initializer so a user-chosen font reaches them too.
+_font_lock = threading.Lock()
+_font_cache = {}
+_font_choice = {'override': None, 'resolved': False, 'font': None}
+
+def configure_font(path=None, index=0):
+    """Use `path` (face `index`) instead of searching FONT_PATHS"""
+    with _font_lock:
+        _font_choice['override'] = (os.path.expanduser(path), index) if path else None
+        _font_choice['resolved'] = False
+        _font_choice['font'] = None
+
+def _fontconfig_match():
+    """Ask fontconfig for a Chinese-capable sans font, if fc-match exists"""
+    import shutil
+    import subprocess
+    if not shutil.which('fc-match'):
+        return None
+    try:
+        result = subprocess.run(
+            ['fc-match', '-f', '%{file}\t%{index}', 'sans-serif:lang=zh-cn'],
+            capture_output=True, text=True, timeout=5,
+        )
+        path, _, index = result.stdout.partition('\t')
+        if result.returncode == 0 and os.path.exists(path):
+            return path, int(index or 0)
+    except (OSError, ValueError, subprocess.SubprocessError):
+        pass
+    return None
+
+def _search_fonts(candidates):
+    """First (path, index) in `candidates` that exists; globs allowed"""
+    for pattern, index in candidates:
+        pattern = os.path.expanduser(pattern)
+        if any(c in pattern for c in '*?['):
+            matches = sorted(glob.glob(pattern, recursive=True))
+            if matches:
+                return matches[0], index
+        elif os.path.exists(pattern):
+            return pattern, index
+    return None
+
+def resolve_font():
+    """(path, face index) of the font cards are drawn with, or None"""
+    with _font_lock:
+        if not _font_choice['resolved']:
+            override = _font_choice['override'] or (
+                (os.path.expanduser(os.environ['XHS_FONT']), int(os.environ.get('XHS_FONT_INDEX', 0)))
+                if os.environ.get('XHS_FONT') else None
+            )
+            _font_choice['font'] = (override
+                                    or _search_fonts(FONT_PATHS)
+                                    or _fontconfig_match()
+                                    or _search_fonts(FALLBACK_FONT_PATHS))
+            _font_choice['resolved'] = True
+        return _font_choice['font']
+
+def load_font(size, path=None, index=0):
+    """Cached ImageFont for (path, size, index); loads each face once"""
+    key = (path, size, index)
+    font = _font_cache.get(key)
+    if font is None:
+        from PIL import ImageFont
+        with _font_lock:
+            font = _font_cache.get(key)
+            if font is None:
+                if path:
+                    font = ImageFont.truetype(path, size, index=index)
+                else:
+                    font = ImageFont.load_default()
+                _font_cache[key] = font
+    return font
+
+def get_font(size):
+    """Card font at `size`, falling back to Pillow's default font"""
+    font = resolve_font()
+    if font:
+        try:
+            return load_font(size, *font)
+        except OSError as e:
+            print(f"⚠️  Could not load font {font[0]}: {e}")
+            with _font_lock:
+                _font_choice['font'] = None
+    return load_font(size)
+
+# Read once at import: os.umask() can only be read by setting it, which
+# would race with files created on the encoder threads
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+def _atomic_write(path, data):
+    """Write bytes to `path` via a temp file, so readers never see a partial file"""
+    import tempfile
+    Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o666 & ~_UMASK)  # mkstemp makes it 0600; give it open()'s mode
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+_http_local = threading.local()
+
+def _connection(scheme, host):
+    """Keep-alive connection to `host`, one per fetch thread"""
+    import http.client
+    conns = _http_local.__dict__.setdefault('conns', {})
+    conn = conns.get((scheme, host))
+    if conn is None:
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(host, timeout=FETCH_TIMEOUT)
+        else:
+            conn = http.client.HTTPConnection(host, timeout=FETCH_TIMEOUT)
+        conns[(scheme, host)] = conn
+    return conn
+
+def _http_get(url, headers):
+    """GET `url` over a pooled connection, following redirects"""
+    import http.client
+    import urllib.parse
+    for _ in range(5):
+        parts = urllib.parse.urlsplit(url)
+        path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        conn = _connection(parts.scheme, parts.netloc)
+        try:
+            conn.request('GET', path, headers={'User-Agent': USER_AGENT, **headers})
+            resp = conn.getresponse()
+            body = resp.read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            _http_local.conns.pop((parts.scheme, parts.netloc), None)
+            raise
+        location = resp.getheader('Location')
+        if resp.status in (301, 302, 303, 307, 308) and location:
+            url = urllib.parse.urljoin(url, location)
+            continue
+        return resp.status, resp, body
+    raise OSError("too many redirects")
+
+def _image_extension(url, content_type):
+    """File extension for a downloaded image"""
+    ext = url.split('.')[-1].split('?')[0].lower()  # Get extension, remove query params
+    if ext in IMAGE_EXTENSIONS:
+        return ext
+    subtype = (content_type or '').split(';')[0].split('/')[-1].strip().lower()
+    return subtype if subtype in IMAGE_EXTENSIONS else 'jpg'
+
+def _url_entry_path(url, cache_dir=None):
+    """Cache record of `url`: its blob name, validators and last check time"""
+    url_hash = hashlib.md5(url.encode()).hexdigest()
+    return os.path.join(cache_dir or IMAGE_CACHE_DIR, 'urls', f"{url_hash}.json")
+
+def fetch_image(url, cache_dir=None):
+    """Return a local path for `url`, downloading it into the shared cache.
+
+    Bodies are stored content-addressed under `blobs/` and written
+    atomically; `urls/` maps each URL to its blob plus ETag/Last-Modified
+    so stale entries are revalidated with a conditional request.
+    """
+    import http.client
+    cache_dir = cache_dir or IMAGE_CACHE_DIR
+    entry_path = _url_entry_path(url, cache_dir)
+    try:
+        with open(entry_path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        blob_path = os.path.join(cache_dir, 'blobs', entry['blob'])
+        if not os.path.exists(blob_path):
+            entry = None
+    except (OSError, ValueError, KeyError):
+        entry = None
+
+    if entry and time.time() - entry.get('checked', 0) < IMAGE_REVALIDATE_AFTER:
+        return blob_path
+
+    headers = {}
+    if entry and entry.get('etag'):
+        headers['If-None-Match'] = entry['etag']
+    if entry and entry.get('last_modified'):
+        headers['If-Modified-Since'] = entry['last_modified']
+
+    error = None
+    for attempt in range(FETCH_RETRIES + 1):
+        if attempt:
+            time.sleep(0.5 * 2 ** (attempt - 1))
+        try:
+            status, resp, body = _http_get(url, headers)
+        except (OSError, http.client.HTTPException) as e:
+            error = e
+            continue
+        if status == 304 and entry:
+            entry['checked'] = time.time()
+            _atomic_write(entry_path, json.dumps(entry).encode('utf-8'))
+            return blob_path
+        if status == 200:
+            break
+        error = OSError(f"HTTP {status}")
+        if status < 500:
+            break
+    else:
+        status = None
+
+    if status != 200:
+        if entry:
+            return blob_path  # offline or origin error: keep the cached copy
+        raise error
+
+    ext = _image_extension(url, resp.getheader('Content-Type'))
+    blob = f"{hashlib.sha256(body).hexdigest()}.{ext}"
+    blob_path = os.path.join(cache_dir, 'blobs', blob)
+    if not os.path.exists(blob_path):
+        _atomic_write(blob_path, body)
+    entry = {
+        'url': url,
+        'blob': blob,
+        'etag': resp.getheader('ETag'),
+        'last_modified': resp.getheader('Last-Modified'),
+        'checked': time.time(),
+    }
+    _atomic_write(entry_path, json.dumps(entry).encode('utf-8'))
+    return blob_path
+
+def fetch_images(urls, cache_dir=None, workers=FETCH_WORKERS):
+    """Fetch many URLs concurrently; returns {url: local path or None}"""
+    urls = list(dict.fromkeys(urls))
+    paths = {}
+    if not urls:
+        return paths
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    profile_count('fetch_urls', len(urls))
+    with profile_stage('fetch'), ThreadPoolExecutor(max_workers=min(workers, len(urls))) as pool:
+        futures = {pool.submit(fetch_image, url, cache_dir): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                paths[url] = future.result()
+            except Exception as e:
+                print(f"⚠️  Could not download image from {url}: {e}")
+                paths[url] = None
+    return paths
+
+def resolve_image_src(img_src, base_path):
+    """Local path for an <img> src, the URL itself if remote, or None"""
+    if not img_src:
+        return None
+    if img_src.startswith('http'):
+        return img_src
+    if base_path is None:
+        return None
+    img_path = os.path.join(base_path, img_src.lstrip('/'))
+    return img_path if os.path.exists(img_path) else None
+
+def _drop_remote_images(cards):
+    for card in cards:
+        card['content_items'] = [(t, c) for t, c in card['content_items']
+                                 if not (t == 'image' and c.startswith('http'))]
+    return cards
+
+def _fetch_remote_images(cards, cache_dir=None):
+    """Replace remote image URLs in cards with cached local paths"""
+    urls = [c for card in cards for t, c in card['content_items']
+            if t == 'image' and c.startswith('http')]
+    paths = fetch_images(urls, cache_dir)
+    for card in cards:
+        card['content_items'] = [
+            (t, paths[c] if t == 'image' and c in paths else c)
+            for t, c in card['content_items']
+            if not (t == 'image' and c in paths and paths[c] is None)
+        ]
+    return [card for card in cards if card['content_items']]
+
+def _element_items(elem):
+    """Typed content items of one element: text, bullet, cell or image"""
+    name = elem.name
+    if name == 'p':
+        yield 'text', elem.get_text().strip()
+    elif name == 'li':
+        yield 'bullet', elem.get_text().strip()
+    elif name in ['ul', 'ol']:
+        for li in elem.find_all('li'):
+            yield 'bullet', li.get_text().strip()
+    elif name == 'table':
+        # Extract content from tables (including lists in table cells)
+        for cell in elem.find_all(['td', 'th']):
+            for p in cell.find_all('p'):
+                yield 'cell', p.get_text().strip()
+            for li in cell.find_all('li'):
+                yield 'bullet', li.get_text().strip()
+    elif name == 'img':
+        yield 'image', elem.get('src')
+
+    # Images inside elements
+    for img_tag in elem.find_all('img'):
+        yield 'image', img_tag.get('src')
+
+def iter_sections(headings, skip=None):
+    """Walk each heading's parent once, yielding sections and their content.
+
+    Yields ('section', title) at every heading, followed by its typed items
+    (see _element_items). A heading owns the siblings after it up to the
+    next H2/H3 sibling; the first heading of a container (other than the
+    document's first heading) also owns the siblings before it. Elements
+    for which `skip(elem)` is true are left out.
+    """
+    from bs4 import Tag
+    containers = {}  # id(parent) -> (children, position of each child, heading positions)
+
+    for n, heading in enumerate(headings):
+        parent = heading.parent
+        if id(parent) not in containers:
+            children = [c for c in parent.children if isinstance(c, Tag)]
+            positions = {id(c): i for i, c in enumerate(children)}
+            heading_positions = [i for i, c in enumerate(children) if c.name in ['h2', 'h3']]
+            containers[id(parent)] = (children, positions, heading_positions)
+        children, positions, heading_positions = containers[id(parent)]
+
+        pos = positions[id(heading)]
+        k = bisect_right(heading_positions, pos) - 1
+        end = heading_positions[k + 1] if k + 1 < len(heading_positions) else len(children)
+        start = pos + 1
+        if k == 0 and n > 0:
+            start = 0  # content before the container's first heading
+
+        yield 'section', heading.get_text().strip()
+        for elem in children[start:pos] + children[pos + 1:end]:
+            if skip and skip(elem):
+                continue
+            yield from _element_items(elem)
+
+def parse_html(html_file, output_dir=None, *, cache_dir=None, parser=None, remote_urls=None):
+    """Extract H2/H3 headings and their content
+
+    Returns one section per heading with all of its content; use
+    layout_cards() to split sections into cards that fit. Remote images are
+    fetched concurrently once extraction is done (see fetch_images) into
+    the shared cache at `cache_dir` (default: IMAGE_CACHE_DIR); pass a list
+    as `remote_urls` to collect their URLs. `output_dir`, where older
+    versions downloaded images, is still accepted positionally and unused.
+    `parser` picks the BeautifulSoup backend (default: HTML_PARSER), or
+    STREAM_PARSER for the incremental extractor (see stream_sections).
+    """
+    with profile_stage('parse_html', post=post_name(html_file)):
+        if parser == STREAM_PARSER:
+            base_path = find_base_path(os.path.dirname(os.path.abspath(html_file)))
+            with profile_stage('traverse'):
+                cards = list(_stream_file(html_file, base_path))
+            return _finish_cards(cards, cache_dir, remote_urls=remote_urls)
+        with profile_stage('read'):
+            with open(html_file, 'r', encoding='utf-8') as f:
+                html = f.read()
+        base_path = find_base_path(os.path.dirname(os.path.abspath(html_file)))
+        return parse_html_string(html, base_path, cache_dir, parser, remote_urls=remote_urls)
+
+def find_base_path(html_dir):
+    """Find the project root (where assets folder would be)"""
+    # Assume blog posts are in blog/YEAR/POST/ structure
+    base_path = html_dir
+    while base_path and not os.path.exists(os.path.join(base_path, 'assets')):
+        parent = os.path.dirname(base_path)
+        if parent == base_path:  # Reached filesystem root
+            break
+        base_path = parent
+    return base_path
+
+def parse_html_string(html, base_path=None, cache_dir=None, parser=None, fetch_remote=True,
+                      remote_urls=None):
+    """parse_html() for HTML held in memory (str or bytes).
+
+    Local image srcs resolve against `base_path` (skipped when None). With
+    fetch_remote=False remote images are left out instead of downloaded.
+    """
+    if parser == STREAM_PARSER:
+        if isinstance(html, bytes):
+            html = html.decode('utf-8', errors='replace')
+        with profile_stage('traverse'):
+            stream = SectionStream(base_path)
+            cards = stream.feed(html) + stream.close()
+            if stream.nested:
+                cards += stream.fallback(html)
+        return _finish_cards(cards, cache_dir, fetch_remote, remote_urls)
+    return _finish_cards(_tree_cards(html, base_path, parser), cache_dir, fetch_remote, remote_urls)
+
+def _tree_cards(html, base_path=None, parser=None):
+    """parse_html_string()'s extraction with BeautifulSoup; sections may be empty"""
+    from bs4 import BeautifulSoup
+    with profile_stage('soup'):
+        soup = BeautifulSoup(html, parser or HTML_PARSER)
+    cards = []
+
+    headings = soup.find_all(['h2', 'h3'])
+    markdown_div = soup.find('div', id='markdown-content')
+
+    def is_intro_paragraph(elem):
+        """Method 1 intro paragraphs: long direct <p> children of markdown-content"""
+        return (elem.name == 'p' and elem.parent is markdown_div
+                and len(elem.get_text().strip()) > 50)
+
+    # Extract intro/preface content before first heading (前言)
+    intro_content = []
+    if headings:
+        first_heading = headings[0]
+
+        # Method 2: Find content between <hr> and first H2 (like serverless10yo)
+        for elem in first_heading.parent.children:
+            if elem is first_heading:
+                break
+            if elem.name == 'p':
+                text = elem.get_text().strip()
+                # Skip empty, very short, or metadata-like content
+                # Check it doesn't look like navigation/tags (has '·' or lots of links)
+                link_ratio = len(elem.find_all('a')) / max(1, len(text.split()))
+                if text and len(text) > 80 and '·' not in text and link_ratio < 0.3:
+                    intro_content.append(('text', text))
+            elif elem.name == 'hr':
+                # Horizontal rule (usually marks end of header): restart after it
+                intro_content = []
+
+        # Method 1: Check markdown-content div for quotes/intro (like bdrk1yo)
+        if markdown_div:
+            for p in markdown_div.find_all('p', recursive=False):
+                if is_intro_paragraph(p):
+                    intro_content.append(('text', p.get_text().strip()))
+
+    # Create introduction card if there's substantial intro content
+    if intro_content:
+        # Get blog title from h1.post-title
+        blog_title_elem = soup.find('h1', class_='post-title')
+        blog_title = blog_title_elem.get_text().strip() if blog_title_elem else "Introduction"
+
+        cards.append({
+            'title': blog_title,
+            'content_items': intro_content[:3]  # Limit to first 3 intro paragraphs
+        })
+
+    skip = is_intro_paragraph if headings and markdown_div else None
+    with profile_stage('traverse'):
+        for item_type, value in iter_sections(headings, skip):
+            if item_type == 'section':
+                cards.append({'title': value, 'content_items': []})
+            elif item_type == 'image':
+                img_path = resolve_image_src(value, base_path)
+                if img_path:
+                    cards[-1]['content_items'].append(('image', img_path))
+            elif value:
+                text = '• ' + value if item_type == 'bullet' else value
+                cards[-1]['content_items'].append(('text', text))
+    return cards
+
+def _finish_cards(cards, cache_dir=None, fetch_remote=True, remote_urls=None):
+    """Drop empty sections, then fetch (or drop) their remote images"""
+    cards = [card for card in cards if card['content_items']]
+    if not fetch_remote:
+        return [card for card in _drop_remote_images(cards) if card['content_items']]
+    if remote_urls is not None:
+        remote_urls.extend(c for card in cards for t, c in card['content_items']
+                           if t == 'image' and c.startswith('http'))
+    return _fetch_remote_images(cards, cache_dir)
+
+# Streaming extraction: the file is fed to html.parser in chunks and every
+# section is handed out once its heading's container moves past it, so a
+# long archive never exists as a tree. Open elements nest the way
+# BeautifulSoup's html.parser builder nests them (an end tag closes up to
+# its most recent match, void elements close at once), and each closed
+# element is reduced to its _element_items(), which is all iter_sections()
+# and the intro rules ever look at.
+STREAM_CHUNK_SIZE = 64 * 1024
+STREAM_PRERENDER_CARDS = 32   # card bodies drawn while the file is still being parsed
+VOID_ELEMENTS = {'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed', 'frame',
+                 'hr', 'image', 'img', 'input', 'isindex', 'keygen', 'link', 'menuitem', 'meta',
+                 'nextid', 'param', 'source', 'spacer', 'track', 'wbr'}
+HIDDEN_TEXT_ELEMENTS = {'script', 'style', 'template', 'rt', 'rp'}  # left out of get_text()
+PRESERVE_SPACE_ELEMENTS = {'pre', 'textarea'}
+# A heading opened inside one of these (or never closed) is "nested": the
+# stream then defers to the tree parse (see SectionStream.fallback)
+HEADING_NESTING_ELEMENTS = {'h2', 'h3', 'li', 'ul', 'ol', 'table'}
+ASCII_SPACES = ' \n\t\x0c\r'
+
+class _Element:
+    """An open element, reduced to what its items and sections need"""
+    __slots__ = ('name', 'src', 'text', 'record', 'links', 'lis', 'ps', 'cells', 'imgs',
+                 'section', 'before', 'current', 'headings')
+
+    def __init__(self, name):
+        self.name = name
+        self.src = self.text = self.record = self.links = None
+        self.lis = self.ps = self.cells = self.section = self.current = None
+        self.imgs = []      # srcs of every <img> inside
+        self.before = []    # closed children seen before the first heading child
+        self.headings = 0   # heading children closed so far
+
+class SectionStream:
+    """Incremental version of parse_html_string()'s extraction.
+
+    feed() takes the next chunk of HTML and returns the cards that are
+    complete so far (title and content items, remote images still URLs);
+    close() returns the rest. Cards come out in the same order and with the
+    same content as with parser='html.parser'. The intro card has to come
+    first, so sections are held back until it is settled: at the first
+    heading when that already gives three intro paragraphs, otherwise once
+    div#markdown-content closes.
+
+    Headings nested in a heading, list or table, or left unclosed, are not
+    worth mirroring the tree's splits for: once one is seen `nested` is set
+    and nothing more is handed out, and fallback() gives the rest of the
+    cards from the tree parse.
+    """
+
+    def __init__(self, base_path=None):
+        from html.parser import HTMLParser
+        self.base_path = base_path
+        self._parser = HTMLParser(convert_charrefs=True)
+        self._parser.handle_starttag = self._start
+        self._parser.handle_startendtag = self._startend
+        self._parser.handle_endtag = self._end
+        self._parser.handle_data = self._data
+        self._parser.unknown_decl = self._decl
+        self._parser.handle_comment = self._parser.handle_decl = self._parser.handle_pi = self._skip
+        self._root = _Element(None)
+        self._stack = [self._root]
+        self._closed_voids = []
+        self._data_parts = []       # text since the last tag
+        self._text = []             # open elements collecting get_text()
+        self._hidden = 0            # open script/style/template/rt/rp elements
+        self._preserve = 0          # open pre/textarea elements
+        self._sections = []         # headings in document order, not yet handed out
+        self._count = 0             # headings seen
+        self._markdown = None       # the first div#markdown-content
+        self._markdown_closed = False
+        self._title = None          # h1.post-title text
+        self._title_elem = None
+        self._intro = None          # Method 2 paragraphs, once the first heading closes
+        self._intro_extra = []      # Method 1 paragraphs
+        self._intro_done = False
+        self._ended = False
+        self._ready = []
+        self._handed_out = 0        # cards returned by feed() and close()
+        self.nested = False
+
+    def feed(self, html):
+        self._parser.feed(html)
+        return self._take()
+
+    def close(self):
+        self._parser.close()
+        self._end_data()
+        if any(elem.section is not None for elem in self._stack):
+            self.nested = True  # unclosed heading
+        while len(self._stack) > 1:
+            self._pop()
+        if self._root.current:
+            self._root.current['done'] = True
+        self._ended = True
+        return self._take()
+
+    def _take(self):
+        self._flush()
+        ready, self._ready = self._ready, []
+        self._handed_out += len(ready)
+        return ready
+
+    def fallback(self, html):
+        """Cards held back after nesting was seen, from html.parser's tree of
+        the whole document `html`. The ones handed out before are already
+        final (their containers had closed), so they are skipped."""
+        cards = _tree_cards(html, self.base_path, 'html.parser')
+        return [card for card in cards if card['content_items']][self._handed_out:]
+
+    # html.parser callbacks
+
+    def _start(self, name, attrs):
+        self._open(name, attrs)
+        if name in VOID_ELEMENTS:
+            self._pop()
+            self._closed_voids.append(name)  # a later </name> only cancels this
+
+    def _startend(self, name, attrs):
+        self._open(name, attrs)
+        self._pop()
+
+    def _end(self, name):
+        if name in self._closed_voids:
+            self._closed_voids.remove(name)
+            return
+        self._end_data()
+        for i in range(len(self._stack) - 1, 0, -1):
+            if self._stack[i].name == name:
+                while len(self._stack) > i:
+                    self._pop()
+                return
+
+    def _data(self, data):
+        self._data_parts.append(data)
+
+    def _end_data(self, cdata=False):
+        """Add the text since the last tag to the open elements, as a soup string"""
+        if not self._data_parts:
+            return
+        data = ''.join(self._data_parts)
+        self._data_parts = []
+        if not self._preserve and not data.strip(ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+        if cdata or not self._hidden:  # CDATA never takes a hidden container's string class
+            for elem in self._text:
+                elem.text.append(data)
+
+    def _decl(self, data):
+        self._end_data()
+        if data.upper().startswith('CDATA['):
+            self._data(data[len('CDATA['):])
+            self._end_data(cdata=True)
+
+    def _skip(self, data):
+        self._end_data()
+
+    # Element bookkeeping
+
+    def _open(self, name, attrs):
+        self._end_data()
+        attrs = {k: v or '' for k, v in attrs}
+        elem = _Element(name)
+        if name == 'img':
+            elem.src = attrs.get('src')
+            for outer in self._stack:
+                outer.imgs.append(elem.src)
+        elif name == 'a':
+            for outer in self._text:
+                if outer.links is not None:
+                    outer.links += 1
+        elif name in ('li', 'p'):
+            elem.record = ['']
+            for outer in self._stack:
+                found = outer.lis if name == 'li' else outer.ps
+                if found is not None:
+                    found.append(elem.record)
+            if name == 'p':
+                elem.links = 0
+        elif name in ('ul', 'ol'):
+            elem.lis = []
+        elif name in ('td', 'th'):
+            elem.lis, elem.ps = [], []
+            for outer in self._stack:
+                if outer.cells is not None:
+                    outer.cells.append((elem.ps, elem.lis))
+        elif name == 'table':
+            elem.cells = []
+        elif name in ('h2', 'h3'):
+            if any(outer.name in HEADING_NESTING_ELEMENTS for outer in self._stack):
+                self.nested = True
+            elem.section = {'n': self._count, 'title': '', 'items': [], 'done': False}
+            self._count += 1
+            self._sections.append(elem.section)
+        elif name == 'h1' and self._title_elem is None and 'post-title' in attrs.get('class', '').split():
+            self._title_elem = elem
+        elif name == 'div' and self._markdown is None and attrs.get('id') == 'markdown-content':
+            self._markdown = elem
+
+        if name in ('p', 'li', 'h2', 'h3') or elem is self._title_elem:
+            elem.text = []
+            self._text.append(elem)
+        if name in HIDDEN_TEXT_ELEMENTS:
+            self._hidden += 1
+        elif name in PRESERVE_SPACE_ELEMENTS:
+            self._preserve += 1
+        self._stack.append(elem)
+
+    def _pop(self):
+        elem = self._stack.pop()
+        parent = self._stack[-1]
+        text = ''
+        if elem.text is not None:
+            self._text.pop()
+            text = ''.join(elem.text).strip()
+            if elem.record:
+                elem.record[0] = ''.join(elem.text)
+        if elem.name in HIDDEN_TEXT_ELEMENTS:
+            self._hidden -= 1
+        elif elem.name in PRESERVE_SPACE_ELEMENTS:
+            self._preserve -= 1
+        if elem is self._title_elem:
+            self._title = text
+        if elem is self._markdown:
+            self._markdown_closed = True
+        if elem.current:
+            elem.current['done'] = True
+
+        if elem.section is not None:
+            elem.section['title'] = text
+            self._add_heading(parent, elem.section)
+            return
+        skip = elem.name == 'p' and parent is self._markdown and len(text) > 50
+        if skip:
+            self._intro_extra.append(('text', text))
+        items = self._items(elem, text)
+        if parent.current:
+            if not skip:
+                parent.current['items'].extend(items)
+        else:
+            parent.before.append((elem.name, items, text, elem.links, skip))
+
+    def _items(self, elem, text):
+        """_element_items() of a closed element"""
+        name = elem.name
+        items = []
+        if name == 'p':
+            items.append(('text', text))
+        elif name == 'li':
+            items.append(('bullet', text))
+        elif name in ('ul', 'ol'):
+            items.extend(('bullet', li[0].strip()) for li in elem.lis)
+        elif name == 'table':
+            for ps, lis in elem.cells:
+                items.extend(('cell', p[0].strip()) for p in ps)
+                items.extend(('bullet', li[0].strip()) for li in lis)
+        elif name == 'img':
+            items.append(('image', elem.src))
+        items.extend(('image', src) for src in elem.imgs)
+        return items
+
+    def _add_heading(self, parent, section):
+        if parent.current:
+            parent.current['done'] = True
+        if not parent.headings:
+            if section['n'] == 0:
+                self._intro = self._intro_paragraphs(parent.before)
+            else:  # content before the container's first heading
+                for name, items, text, links, skip in parent.before:
+                    if not skip:
+                        section['items'].extend(items)
+            parent.before = None
+        parent.headings += 1
+        parent.current = section
+
+    def _intro_paragraphs(self, before):
+        """Method 2 of parse_html_string(): long paragraphs after the last <hr>"""
+        intro = []
+        for name, items, text, links, skip in before:
+            if name == 'p':
+                link_ratio = links / max(1, len(text.split()))
+                if text and len(text) > 80 and '·' not in text and link_ratio < 0.3:
+                    intro.append(('text', text))
+            elif name == 'hr':
+                intro = []
+        return intro
+
+    def _flush(self):
+        if self.nested:
+            return
+        if not self._intro_done:
+            if self._intro is None and not self._ended:
+                return
+            intro = (self._intro or []) + self._intro_extra
+            if len(intro) < 3 and not (self._markdown_closed or self._ended):
+                return
+            if intro and self._title is None and not self._ended:
+                return
+            if intro and self._intro is not None:
+                title = self._title if self._title is not None else "Introduction"
+                self._ready.append({'title': title, 'content_items': intro[:3]})
+            self._intro_done = True
+
+        while self._sections and self._sections[0]['done']:
+            section = self._sections.pop(0)
+            content = []
+            for item_type, value in section['items']:
+                if item_type == 'image':
+                    img_path = resolve_image_src(value, self.base_path)
+                    if img_path:
+                        content.append(('image', img_path))
+                elif value:
+                    content.append(('text', '• ' + value if item_type == 'bullet' else value))
+            if content:
+                self._ready.append({'title': section['title'], 'content_items': content})
+
+def _stream_file(html_file, base_path=None, chunk_size=STREAM_CHUNK_SIZE):
+    """SectionStream over a file read in chunks; yields cards as they complete"""
+    stream = SectionStream(base_path)
+    with open(html_file, 'r', encoding='utf-8') as f:
+        for chunk in iter(lambda: f.read(chunk_size), ''):
+            yield from stream.feed(chunk)
+    yield from stream.close()
+    if stream.nested:
+        with open(html_file, 'r', encoding='utf-8') as f:
+            yield from stream.fallback(f.read())
+
+def stream_sections(html_file, cache_dir=None, fetch_remote=True, remote_urls=None):
+    """parse_html() that yields each section as soon as it has been read.
+
+    Memory stays bounded by the extracted text rather than the page's tree,
+    and the caller can lay out and draw early sections while the rest of a
+    long file is still being parsed. Remote images are fetched per section.
+    """
+    base_path = find_base_path(os.path.dirname(os.path.abspath(html_file)))
+    for card in _stream_file(html_file, base_path):
+        yield from _finish_cards([card], cache_dir, fetch_remote, remote_urls)
+
+# Line breaking: text is split into tokens (words, space runs, single CJK
+# characters), token advances are cached per font, and each line end is
+# found with a binary search over the prefix sums of those advances.
+CJK_CHARS = ('\u1100-\u11ff\u2e80-\u9fff\ua960-\ua97f\uac00-\ud7ff'
+             '\uf900-\ufaff\ufe30-\ufe4f\uff00-\uffef\U00020000-\U0002fa1f')
+# Kinsoku shori: characters that may not start / end a line
+NO_LINE_START = set('、。，．・：；？！ーゝゞ々）］｝」』】〕〉》〗〙〛’”»›'
+                    'ぁぃぅぇぉっゃゅょゎァィゥェォッャュョヮヵヶ%),.:;?!]}')
+NO_LINE_END = set('（［｛「『【〔〈《〖〘〚‘“«‹([{')
+ADVANCE_CACHE_LIMIT = 50000
+_advance_cache = {}  # font key -> {token: advance width}
+_line_regexes = []  # [CJK_CHAR, TOKEN_RE] once compiled
+
+def _regexes():
+    """CJK_CHAR and TOKEN_RE, compiled on first use (the big classes take a while)"""
+    if not _line_regexes:
+        _line_regexes[:] = [re.compile(f"[{CJK_CHARS}]"),
+                            re.compile(f"[{CJK_CHARS}]|\\s+|[^\\s{CJK_CHARS}]+")]
+    return _line_regexes
+
+def _font_key(font):
+    """Hashable identity of a font for the advance cache"""
+    path = getattr(font, 'path', None)
+    if isinstance(path, str):
+        return (path, getattr(font, 'size', None), getattr(font, 'index', 0))
+    return id(font)
+
+def text_advance(text, font):
+    """Cached advance width of `text` (one token or glyph) in `font`"""
+    cache = _advance_cache.setdefault(_font_key(font), {})
+    width = cache.get(text)
+    if _profiler is not None:
+        _profiler.count('measure')
+    if width is None:
+        if _profiler is not None:
+            _profiler.count('measure_miss')
+        if len(cache) >= ADVANCE_CACHE_LIMIT:
+            cache.clear()
+        try:
+            width = font.getlength(text)
+        except Exception:
+            width = len(text) * 15
+        cache[text] = width
+    return width
+
+def _split_long_token(token, font, max_width):
+    """Split a token wider than max_width into pieces at character level"""
+    widths = [text_advance(ch, font) for ch in token]
+    prefix = list(accumulate(widths, initial=0))
+    pieces = []
+    i = 0
+    while i < len(token):
+        j = max(i + 1, bisect_right(prefix, prefix[i] + max_width) - 1)
+        pieces.append(token[i:j])
+        i = j
+    return pieces
+
+def _tokenize(paragraph, font, max_width):
+    """Tokens of a paragraph, with over-long words pre-split"""
+    tokens = []
+    for token in _regexes()[1].findall(paragraph):
+        if not token.isspace() and len(token) > 1 and text_advance(token, font) > max_width:
+            tokens.extend(_split_long_token(token, font, max_width))
+        else:
+            tokens.append(token)
+    return tokens
+
+def _can_break_before(tokens, k):
+    """Whether a line may end between tokens[k-1] and tokens[k]"""
+    prev, cur = tokens[k - 1], tokens[k]
+    if cur.isspace() or prev.isspace():
+        return not cur.isspace()
+    if cur[0] in NO_LINE_START or prev[-1] in NO_LINE_END:
+        return False
+    # Between two words only a space is a break opportunity
+    cjk_char = _regexes()[0]
+    return bool(cjk_char.match(cur) or cjk_char.match(prev))
+
+def break_lines(text, font, max_width):
+    """Break text into lines no wider than max_width.
+
+    Returns a list of (line, measured_width). Latin text breaks at spaces,
+    CJK text between any two characters, honouring kinsoku rules for
+    punctuation. Words wider than a whole line are split by character.
+    """
+    lines = []
+    for paragraph in text.split('\n'):
+        if not paragraph.strip():
+            continue
+
+        tokens = _tokenize(paragraph.strip(), font, max_width)
+        widths = [text_advance(t, font) for t in tokens]
+        prefix = list(accumulate(widths, initial=0))
+        n = len(tokens)
+        i = 0
+        while i < n:
+            # Furthest end j with prefix[j] - prefix[i] <= max_width
+            j = bisect_right(prefix, prefix[i] + max_width, i + 1) - 1
+            if j >= n:
+                end = n
+            else:
+                end = j if j > i else i + 1
+                if j > i and tokens[j].isspace():
+                    end = j  # the space itself hangs past the margin
+                else:
+                    k = end
+                    while k > i + 1 and not _can_break_before(tokens, k):
+                        k -= 1
+                    if _can_break_before(tokens, k):
+                        end = k  # otherwise no legal break: force one at j
+
+            stop = end
+            while stop > i and tokens[stop - 1].isspace():
+                stop -= 1
+            if stop > i:
+                lines.append((''.join(tokens[i:stop]), prefix[stop] - prefix[i]))
+
+            i = end
+            while i < n and tokens[i].isspace():
+                i += 1
+
+    return lines
+
+def wrap_text(text, font, max_width, draw=None):
+    """Wrap text to fit within max_width"""
+    return [line for line, _ in break_lines(text, font, max_width)]
+
+# Card geometry used by the layout pass (and drawn by generate_card_image).
+# CONTENT_WIDTH and CONTENT_BOTTOM are for a square card; other canvas sizes
+# keep the same margins from their own edges (see layout_cards).
+TITLE_MAX_LINES = 2
+TITLE_LINE_HEIGHT = int(TITLE_FONT_SIZE * 1.2)
+BODY_LINE_HEIGHT = int(BODY_FONT_SIZE * LINE_SPACING)
+CONTENT_WIDTH = CARD_SIZE - (2 * PADDING)
+BULLET_INDENT = 28
+ITEM_SPACING = 20
+IMAGE_SPACING = 30
+IMAGE_MAX_HEIGHT = 350           # images next to text
+IMAGE_FOCUS_MAX_HEIGHT = 680     # sections that are mostly image
+IMAGE_FOCUS_TEXT_CHARS = 100
+IMAGE_FOCUS_MIN_SHARE = 0.5      # a focus image shrinks to fit at most down to this share of its max height
+IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # resized images kept per process
+IMAGE_SOURCE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # decoded sources, at most the above
+CONTENT_BOTTOM = CARD_SIZE - PADDING - 35 - 10 - 10  # just above the divider line
+
+# Decoded images: resized variants keyed by (path, mtime, size) in one LRU,
+# and the decoded sources they were resized from in a second, much smaller
+# one, so full-resolution pixels can't take over the budget of every worker
+# process. Both are bounded by total pixel bytes and shared by every card
+# (and card size) in this process.
+_image_lock = threading.Lock()
+_image_cache = OrderedDict()
+_image_cache_bytes = [0]
+_source_cache = OrderedDict()
+_source_cache_bytes = [0]
+
+def _image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+def _image_lru(sources):
+    """(cache, [total bytes], byte limit) of the resized or the source LRU"""
+    if sources:
+        return (_source_cache, _source_cache_bytes,
+                min(IMAGE_SOURCE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_BYTES))
+    return _image_cache, _image_cache_bytes, IMAGE_CACHE_MAX_BYTES
+
+def _cached_image(key, sources=False):
+    cache, _, _ = _image_lru(sources)
+    with _image_lock:
+        image = cache.get(key)
+        if image is not None:
+            cache.move_to_end(key)
+        return image
+
+def _cache_image(key, image, sources=False):
+    cache, total, limit = _image_lru(sources)
+    nbytes = _image_nbytes(image)
+    if nbytes > limit:
+        return image
+    with _image_lock:
+        if key not in cache:
+            cache[key] = image
+            total[0] += nbytes
+        while total[0] > limit:
+            _, evicted = cache.popitem(last=False)
+            total[0] -= _image_nbytes(evicted)
+    return image
+
+def _decode_scaled(path, mtime, size):
+    """Decode `path` straight to `size`, converted for pasting onto a card.
+
+    The decoded source is cached as well (in the small source LRU), keyed
+    by its decoded size: other card sizes or layouts that need the image at
+    the same DCT scale only resize it again.
+    """
+    from PIL import Image
+    with Image.open(path) as im:
+        if im.format == 'JPEG':
+            im.draft('RGB', size)  # DCT downscale while decoding
+        key = (path, mtime, im.size)
+        source = _cached_image(key, sources=True)
+        if source is not None:
+            profile_count('image_source_hit')
+        else:
+            with profile_stage('decode'):
+                im.load()
+                if im.mode == 'P':
+                    im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+                elif im.mode in ('LA', 'PA') or (im.mode == 'L' and 'transparency' in im.info):
+                    im = im.convert('RGBA')
+                elif im.mode not in ('RGB', 'RGBA'):
+                    im = im.convert('RGB')
+            source = _cache_image(key, im, sources=True)
+    with profile_stage('resize'):
+        # reducing_gap lets Pillow reduce() by an integer factor before LANCZOS
+        return source.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+def load_image(path, size):
+    """RGB or RGBA image of `path` resized to `size`, from the LRU cache"""
+    mtime = os.stat(path).st_mtime_ns
+    key = (path, mtime, tuple(size))
+    image = _cached_image(key)
+    if image is not None:
+        profile_count('image_cache_hit')
+        return image
+    profile_count('image_cache_miss')
+    return _cache_image(key, _decode_scaled(path, mtime, size))
+
+def prefetch_images(card):
+    """Decoded images of a card's image blocks, in order; an exception where one failed"""
+    images = []
+    for block in card['blocks']:
+        if block['type'] == 'image':
+            try:
+                images.append(load_image(block['path'], (block['width'], block['height'])))
+            except Exception as e:
+                images.append(e)
+    return images
+
+def configure_memory(image_cache=None, max_images=None):
+    """Set the resized-image cache size in bytes (which also caps the source
+    cache), and the images in flight in write_cards"""
+    global IMAGE_CACHE_MAX_BYTES, PIPELINE_MAX_IMAGES
+    if image_cache is not None:
+        IMAGE_CACHE_MAX_BYTES = image_cache
+    if max_images is not None:
+        PIPELINE_MAX_IMAGES = max_images
+
+def _layout_title(title, title_font, content_width=CONTENT_WIDTH):
+    """Title lines (at most TITLE_MAX_LINES) and the y where content starts"""
+    lines = wrap_text(title, title_font, content_width)
+    if len(lines) > TITLE_MAX_LINES:
+        lines = lines[:TITLE_MAX_LINES]
+        lines[-1] = lines[-1].rstrip() + '…'
+    content_top = PADDING + 80 + len(lines) * TITLE_LINE_HEIGHT + 20 + 45
+    return lines, content_top
+
+def _image_box(path, max_width, max_height):
+    """Scaled (width, height) of an image, preserving aspect ratio"""
+    from PIL import Image
+    with Image.open(path) as im:
+        width, height = im.size
+    ratio = width / height
+    if ratio > 1:  # Landscape
+        new_width = min(max_width, width)
+        new_height = int(new_width / ratio)
+    else:  # Portrait or square
+        new_height = min(max_height, height)
+        new_width = int(new_height * ratio)
+    if new_height > max_height:
+        new_height = max_height
+        new_width = int(new_height * ratio)
+    if new_width > max_width:
+        new_width = max_width
+        new_height = int(new_width / ratio)
+    return max(1, new_width), max(1, new_height)
+
+def _start_page(pages, title, title_font, size):
+    """Append an empty card to `pages`; returns it and its content top y"""
+    title_lines, content_top = _layout_title(title, title_font, size[0] - 2 * PADDING)
+    pages.append({'title': title, 'title_lines': title_lines, 'size': list(size),
+                  'content_items': [], 'blocks': []})
+    return pages[-1], content_top
+
+def layout_cards(sections, size=None):
+    """Measure sections with the real fonts and split them into cards.
+
+    Each section becomes as many cards as its content needs; continuation
+    cards get a "(cont.)" title. Text items may be split between cards line
+    by line. Every returned card carries its canvas size, its title lines
+    and the absolute position of each text and image block, so rendering is
+    a plain draw. `size` is the (width, height) canvas (default: square
+    CARD_SIZE); the extra height of a taller one goes to content and to
+    image-focused sections.
+    """
+    with profile_stage('layout'):
+        return _layout_sections(sections, tuple(size or CARD_SIZES['square']))
+
+def _layout_sections(sections, size):
+    title_font = get_font(TITLE_FONT_SIZE)
+    body_font = get_font(BODY_FONT_SIZE)
+    width, height = size
+    content_width = width - 2 * PADDING
+    content_bottom = height - (CARD_SIZE - CONTENT_BOTTOM)
+    focus_max_height = IMAGE_FOCUS_MAX_HEIGHT + height - CARD_SIZE
+    pages = []
+
+    for section in sections:
+        items = section.get('content_items', [])
+        text_chars = sum(len(c) for t, c in items if t == 'text')
+        image_focused = text_chars < IMAGE_FOCUS_TEXT_CHARS
+        cont_title = f"{section['title']} (cont.)"
+        page, y = _start_page(pages, section['title'], title_font, size)
+
+        for item_type, content in items:
+            if item_type == 'image':
+                try:
+                    img_width, img_height = _image_box(content, content_width,
+                                                       focus_max_height if image_focused else IMAGE_MAX_HEIGHT)
+                except Exception as e:
+                    print(f"⚠️  Could not load image: {e}")
+                    continue
+                if image_focused:
+                    # Shrink to the room left on this page, but not to a sliver: a
+                    # new page gives the image its full height instead
+                    room = content_bottom - y - 40
+                    if room < min(img_height, int(focus_max_height * IMAGE_FOCUS_MIN_SHARE)) and page['blocks']:
+                        page, y = _start_page(pages, cont_title, title_font, size)
+                        room = content_bottom - y - 40
+                    if room < img_height:
+                        img_width, img_height = _image_box(content, content_width, room)
+                elif y + img_height > content_bottom and page['blocks']:
+                    page, y = _start_page(pages, cont_title, title_font, size)
+                page['blocks'].append({'type': 'image', 'path': content,
+                                       'x': (width - img_width) // 2, 'y': y,
+                                       'width': img_width, 'height': img_height})
+                page['content_items'].append((item_type, content))
+                y += img_height + IMAGE_SPACING
+
+            elif item_type == 'text':
+                bullet = content.strip().startswith('•')
+                if bullet:
+                    text_content = content.strip()[1:].strip()
+                    x = PADDING + BULLET_INDENT
+                else:
+                    text_content = content
+                    x = PADDING
+                lines = wrap_text(text_content, body_font, content_width - BULLET_INDENT)
+
+                while lines:
+                    fit = max(0, (content_bottom - y - BODY_FONT_SIZE) // BODY_LINE_HEIGHT + 1)
+                    if fit == 0 or (fit < len(lines) and fit < 2 and page['blocks']):
+                        page, y = _start_page(pages, cont_title, title_font, size)
+                        continue
+                    chunk, lines = lines[:fit], lines[fit:]
+                    page['blocks'].append({'type': 'text', 'x': x, 'y': y,
+                                           'lines': chunk, 'bullet': bullet})
+                    page['content_items'].append((item_type, content))
+                    y += len(chunk) * BODY_LINE_HEIGHT
+                    bullet = False  # continuation lines carry no bullet
+                y += ITEM_SPACING
+
+        if not page['blocks']:
+            pages.pop()
+
+    return pages
+
+# Rasterized text runs: an alpha mask per (font, text), kept in an LRU bounded
+# by mask bytes. Badges ("1/12" recurs in every 12-card post) and titles
+# (repeated on "(cont.)" cards) are composited with one paste instead of
+# being rasterized again. Color is applied at paste time, so one mask serves
+# every scheme; the result is pixel-identical to draw.text. Body lines rarely
+# repeat, so they are drawn directly: a miss costs more than draw.text.
+TEXT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_text_lock = threading.Lock()
+_text_cache = OrderedDict()
+_text_cache_bytes = [0]
+
+def text_mask(text, font):
+    """(L mask, (dx, dy) offset from the text origin) of `text`, or None if it draws nothing"""
+    key = (_font_key(font), text)
+    with _text_lock:
+        entry = _text_cache.get(key)
+        if entry is not None:
+            _text_cache.move_to_end(key)
+            profile_count('text_cache_hit')
+            return entry[0]
+
+    profile_count('text_cache_miss')
+    from PIL import Image, ImageDraw
+    left, top, right, bottom = font.getbbox(text)
+    if right <= left or bottom <= top:
+        mask, nbytes = None, 0
+    else:
+        image = Image.new('L', (right - left, bottom - top), 0)
+        ImageDraw.Draw(image).text((-left, -top), text, fill=255, font=font)
+        mask, nbytes = (image, (left, top)), image.width * image.height
+
+    with _text_lock:
+        if key not in _text_cache:
+            _text_cache[key] = (mask, nbytes)
+            _text_cache_bytes[0] += nbytes
+        while _text_cache_bytes[0] > TEXT_CACHE_MAX_BYTES:
+            _, (_, evicted) = _text_cache.popitem(last=False)
+            _text_cache_bytes[0] -= evicted
+    return mask
+
+def draw_text(img, xy, text, font, fill):
+    """draw.text(xy, text, fill, font) through the text-run cache"""
+    entry = text_mask(text, font)
+    if entry is not None:
+        mask, (dx, dy) = entry
+        img.paste(fill, (xy[0] + dx, xy[1] + dy), mask)
+
+# Static card chrome per color scheme, rendered once per process
+_template_lock = threading.Lock()
+_template_cache = {}
+
+def card_template(scheme_index, underline_y, size=None):
+    """Background, title underline, divider, watermark and accent of a scheme.
+
+    Cards copy this and draw only the badge, title and content on top.
+    The underline position depends on the number of title lines, so there
+    is one template per (scheme, underline_y, canvas size, font).
+    """
+    width, height = size or CARD_SIZES['square']
+    key = (scheme_index, underline_y, width, height, resolve_font())
+    with _template_lock:
+        img = _template_cache.get(key)
+        if img is not None:
+            return img
+
+    from PIL import Image, ImageDraw
+    scheme = COLOR_SCHEMES[scheme_index]
+    label_font = get_font(LABEL_FONT_SIZE)
+    img = Image.new('RGB', (width, height), scheme['bg'])
+    draw = ImageDraw.Draw(img)
+
+    # Decorative underline below the title
+    draw.rectangle(
+        [(PADDING, underline_y), (PADDING + 80, underline_y + 5)],
+        fill=scheme['accent']
+    )
+
+    # Bottom section
+    bottom_y = height - PADDING - 35
+
+    # Subtle divider line
+    draw.line(
+        [(PADDING, bottom_y - 10), (width - PADDING, bottom_y - 10)],
+        fill=scheme['accent'],
+        width=2
+    )
+
+    # Watermark
+    draw.text(
+        (PADDING, bottom_y + 5),
+        WATERMARK_TEXT,
+        fill=(150, 150, 150),
+        font=label_font
+    )
+
+    # Small decorative accent (bottom right)
+    accent_x = width - PADDING - 15
+    accent_y = bottom_y
+    draw.rectangle(
+        [(accent_x, accent_y), (accent_x + 15, accent_y + 30)],
+        fill=scheme['accent']
+    )
+
+    with _template_lock:
+        return _template_cache.setdefault(key, img)
+
+def render_card(card, card_index, total_cards, images=None):
+    """Draw a laid-out card and return it as an RGB image"""
+    img = render_card_body(card, card_index, images)
+    draw_badge(img, card_index, total_cards)
+    return img
+
+def draw_badge(img, card_index, total_cards):
+    """Draw the "3/12" card number badge (top right) onto a card body"""
+    from PIL import ImageDraw
+    scheme = COLOR_SCHEMES[card_index % len(COLOR_SCHEMES)]
+    label_font = get_font(LABEL_FONT_SIZE)
+    draw = ImageDraw.Draw(img)
+
+    badge_text = f"{card_index + 1}/{total_cards}"
+    try:
+        bbox = draw.textbbox((0, 0), badge_text, font=label_font)
+        badge_width = bbox[2] - bbox[0] + 30
+        badge_height = bbox[3] - bbox[1] + 20
+    except:
+        badge_width = len(badge_text) * 15 + 30
+        badge_height = 40
+
+    badge_x = img.width - PADDING - badge_width
+    badge_y = PADDING - 10
+
+    # Badge background
+    draw.rounded_rectangle(
+        [(badge_x, badge_y), (badge_x + badge_width, badge_y + badge_height)],
+        radius=20,
+        fill=scheme['accent']
+    )
+
+    # Badge text
+    text_x = badge_x + 15
+    text_y = badge_y + 10
+    draw_text(img, (text_x, text_y), badge_text, label_font, (255, 255, 255))
+
+def render_card_body(card, card_index, images=None):
+    """Everything but the badge: chrome, title and content blocks.
+
+    The badge sits clear of the title, so a body can be reused when only the
+    card's number or the post's card count changes. `images` are the card's
+    images decoded ahead (see prefetch_images); by default they are loaded
+    here.
+    """
+
+    from PIL import ImageDraw
+
+    # Choose color scheme
+    scheme = COLOR_SCHEMES[card_index % len(COLOR_SCHEMES)]
+
+    # Load fonts (cached per process)
+    title_font = get_font(TITLE_FONT_SIZE)
+    body_font = get_font(BODY_FONT_SIZE)
+
+    # Start from the scheme's pre-rendered chrome
+    underline_y = PADDING + 80 + len(card['title_lines']) * TITLE_LINE_HEIGHT + 20
+    img = card_template(card_index % len(COLOR_SCHEMES), underline_y, card['size']).copy()
+    draw = ImageDraw.Draw(img)
+
+    # Title
+    y_position = PADDING + 80
+    for line in card['title_lines']:
+        draw_text(img, (PADDING, y_position), line, title_font, scheme['title'])
+        y_position += TITLE_LINE_HEIGHT
+
+    # Content boxes from the layout pass
+    images = iter(images) if images is not None else None
+    for block in card['blocks']:
+        if block['type'] == 'image':
+            try:
+                if images is None:
+                    content_img = load_image(block['path'], (block['width'], block['height']))
+                else:
+                    content_img = next(images)
+                    if isinstance(content_img, Exception):
+                        raise content_img
+                mask = content_img if content_img.mode == 'RGBA' else None
+                img.paste(content_img, (block['x'], block['y']), mask)
+            except Exception as e:
+                print(f"⚠️  Could not load image: {e}")
+
+        elif block['type'] == 'text':
+            if block['bullet']:
+                bullet_size = 8
+                bullet_x = PADDING + 5
+                bullet_y = block['y'] + 12
+                draw.ellipse(
+                    [(bullet_x, bullet_y), (bullet_x + bullet_size, bullet_y + bullet_size)],
+                    fill=scheme['accent']
+                )
+
+            line_y = block['y']
+            for line in block['lines']:
+                draw.text(
+                    (block['x'], line_y),
+                    line,
+                    fill=scheme['body'],
+                    font=body_font
+                )
+                line_y += BODY_LINE_HEIGHT
+
+    return img
+
+# Output encoders. ENCODER_DEFAULTS keeps the classic JPEG quality 95 output;
+# 'auto' writes PNG for text-only cards (flat colors) and JPEG otherwise.
+ENCODER_DEFAULTS = {
+    'format': 'jpeg',
+    'quality': None,        # None: QUALITY_DEFAULTS[format]
+    'optimize': False,
+    'progressive': False,
+    'subsampling': None,    # JPEG chroma subsampling, e.g. '4:4:4'; None: Pillow default
+    'max_bytes': None,      # lossy formats: lower quality until the file fits
+}
+QUALITY_DEFAULTS = {'jpeg': 95, 'webp': 90, 'avif': 75}
+MIN_QUALITY = 40
+FORMAT_EXTENSIONS = {'jpeg': 'jpg', 'png': 'png', 'webp': 'webp', 'avif': 'avif'}
+ENCODE_THREADS = 2
+
+# write_cards runs decode -> draw -> encode as stages with bounded hand-offs:
+# a slow stage blocks the one before it instead of letting pixels pile up.
+PIPELINE_MAX_IMAGES = 16                      # decoded images waiting to be drawn
+PIPELINE_ENCODE_QUEUE = 2 * ENCODE_THREADS    # drawn cards waiting for (or in) an encoder
+# run_batch keeps parse jobs to one per worker, render jobs to two per worker,
+# and stops parsing posts while this many laid-out cards wait for a worker.
+BATCH_BACKLOG = 512
+
+def encoder_options(**options):
+    """ENCODER_DEFAULTS updated with the non-None `options`"""
+    encoder = dict(ENCODER_DEFAULTS)
+    encoder.update({k: v for k, v in options.items() if v is not None})
+    return encoder
+
+def card_format(card, encoder=None):
+    """Concrete output format of a card: jpeg, png, webp or avif"""
+    fmt = (encoder or ENCODER_DEFAULTS)['format']
+    if fmt == 'auto':
+        has_images = any(b['type'] == 'image' for b in card.get('blocks', []))
+        return 'jpeg' if has_images else 'png'
+    return fmt
+
+def _encode(img, fmt, quality, encoder):
+    buf = io.BytesIO()
+    if fmt == 'jpeg':
+        params = {'quality': quality}
+        if encoder['optimize']:
+            params['optimize'] = True
+        if encoder['progressive']:
+            params['progressive'] = True
+        if encoder['subsampling']:
+            params['subsampling'] = encoder['subsampling']
+        img.save(buf, 'JPEG', **params)
+    elif fmt == 'webp':
+        img.save(buf, 'WEBP', quality=quality, method=6 if encoder['optimize'] else 4)
+    elif fmt == 'avif':
+        img.save(buf, 'AVIF', quality=quality)
+    else:
+        img.save(buf, 'PNG', optimize=encoder['optimize'])
+    return buf.getvalue()
+
+def encode_card(img, fmt='jpeg', encoder=None):
+    """Encode a rendered card; returns the file bytes.
+
+    With encoder['max_bytes'] set, lossy formats binary-search the highest
+    quality (down to MIN_QUALITY, or the requested quality if lower) whose
+    output fits the budget. If none does, the smaller of the lowest-quality
+    and the unbudgeted encode is returned.
+    """
+    encoder = encoder or ENCODER_DEFAULTS
+    if fmt == 'png':
+        return _encode(img, fmt, None, encoder)
+
+    quality = encoder['quality'] or QUALITY_DEFAULTS[fmt]
+    data = _encode(img, fmt, quality, encoder)
+    budget = encoder['max_bytes']
+    if not budget or len(data) <= budget:
+        return data
+
+    best = None
+    floor = min(quality, MIN_QUALITY)
+    low, high = floor, quality - 1
+    while low <= high:
+        mid = (low + high) // 2
+        candidate = _encode(img, fmt, mid, encoder)
+        if len(candidate) <= budget:
+            best, low = candidate, mid + 1
+        else:
+            high = mid - 1
+    if best is None:
+        best = _encode(img, fmt, floor, encoder) if floor < quality else data
+        best = min(best, data, key=len)  # a lower quality is not always smaller
+        print(f"⚠️  {len(best)} bytes at quality {floor} is still over the {budget} byte budget")
+    return best
+
+def save_card(img, output_path, fmt='jpeg', encoder=None, post=None):
+    """Encode and atomically write a card image"""
+    with profile_stage('encode', post=post):
+        data = encode_card(img, fmt, encoder)
+    _atomic_write(output_path, data)
+    return len(data)
+
+def generate_card_image(card, output_path, card_index, total_cards, verbose=True, manifest=None,
+                        encoder=None, encode_pool=None, bodies=None, keep_bodies=True, on_image=None,
+                        images=None):
+    """Generate professional Xiaohongshu-style card
+
+    `card` is a page from layout_cards(); a raw section is laid out first and
+    only its first page is drawn.
+
+    With a `manifest` (see load_manifest) the card is skipped when its input
+    hash is unchanged and the output still exists; returns None in that case.
+
+    `encoder` holds output options (see ENCODER_DEFAULTS). With an
+    `encode_pool` (a thread pool), encoding and writing run there so the
+    caller can draw the next card meanwhile; the manifest entry is recorded
+    once the file is written, so wait for the pool before saving it.
+
+    `bodies` (a dict, see watch_post) keeps drawn card bodies by body_digest;
+    a card whose body is already there only gets its badge redrawn. With
+    keep_bodies=False bodies are taken out of it once used, and new ones
+    are not added (see stream_post).
+
+    `on_image(card_index, img)` is called once the card is drawn, before it
+    is encoded (see ContactSheet). Cards the manifest has as current are
+    then still drawn for it, but not written again. `images` are the card's
+    images decoded ahead (see prefetch_images).
+    """
+
+    if 'blocks' not in card:
+        card = layout_cards([card])[0]
+
+    unchanged = False
+    if manifest is not None:
+        digest = card_digest(card, card_index, total_cards, encoder)
+        unchanged = is_up_to_date(manifest, output_path, digest)
+        if unchanged and on_image is None:
+            if verbose:
+                print(f"⏭️  {card_index + 1}/{total_cards} - unchanged")
+            return None
+
+    post = post_name(output_path)
+    badge_only = False
+    with profile_stage('draw', post=post):
+        if bodies is None:
+            img = render_card(card, card_index, total_cards, images)
+        else:
+            key = body_digest(card, card_index)
+            body = bodies.get(key) if keep_bodies else bodies.pop(key, None)
+            badge_only = body is not None
+            if body is None:
+                body = render_card_body(card, card_index, images)
+                if keep_bodies:
+                    bodies[key] = body
+            img = body.copy() if keep_bodies else body
+            draw_badge(img, card_index, total_cards)
+    if on_image is not None:
+        on_image(card_index, img)
+        if unchanged:
+            if verbose:
+                print(f"⏭️  {card_index + 1}/{total_cards} - unchanged (preview only)")
+            return None
+    scheme = COLOR_SCHEMES[card_index % len(COLOR_SCHEMES)]
+
+    # Save
+    fmt = card_format(card, encoder)
+
+    def saved(future):
+        if future.exception():
+            print(f"❌ {card_index + 1}/{total_cards} - could not write {output_path}: {future.exception()}")
+        elif manifest is not None:
+            manifest[os.path.basename(output_path)] = digest
+
+    if encode_pool is not None:
+        encode_pool.submit(save_card, img, output_path, fmt, encoder, post).add_done_callback(saved)
+    else:
+        save_card(img, output_path, fmt, encoder, post)
+        if manifest is not None:
+            manifest[os.path.basename(output_path)] = digest
+    if verbose:
+        print(f"✅ {card_index + 1}/{total_cards} - {scheme['name']}{' (badge only)' if badge_only else ''}")
+    return scheme['name']
+
+# Previews: every card of a post downscaled into one grid contact sheet or
+# one vertical strip. Each card is pasted in right after it is drawn, so
+# nothing is decoded back from disk and no full-size copy is kept around.
+THUMB_WIDTH = 360           # px per card in previews (1080 / 3: a cheap reduce())
+PREVIEW_COLUMNS = {'sheet': 3, 'strip': 1}
+PREVIEW_GAP = 12
+PREVIEW_BACKGROUND = (236, 236, 236)
+PREVIEW_MAX_SIDE = {'jpeg': 65500, 'webp': 16383, 'avif': 16384}  # larger ones are written as PNG
+
+def thumbnail(img, width):
+    """`img` scaled to `width`, keeping its aspect ratio"""
+    from PIL import Image
+    if img.width == width:
+        return img
+    factor = img.width // width
+    if factor > 1 and img.width == width * factor and img.height % factor == 0:
+        return img.reduce(factor)
+    height = max(1, round(img.height * width / img.width))
+    return img.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+class ContactSheet:
+    """One canvas holding thumbnails of all `count` cards of a post"""
+
+    def __init__(self, count, columns=3, width=THUMB_WIDTH, card_size=(CARD_SIZE, CARD_SIZE)):
+        from PIL import Image
+        self.columns = max(1, min(columns, count))
+        self.cell = (width, max(1, round(card_size[1] * width / card_size[0])))
+        rows = -(-count // self.columns)
+        self.canvas = Image.new('RGB', (PREVIEW_GAP + self.columns * (self.cell[0] + PREVIEW_GAP),
+                                        PREVIEW_GAP + rows * (self.cell[1] + PREVIEW_GAP)),
+                                PREVIEW_BACKGROUND)
+
+    def add(self, index, img):
+        """Paste card `index`; `img` may be full size or already a thumbnail"""
+        row, col = divmod(index, self.columns)
+        self.canvas.paste(thumbnail(img, self.cell[0]), (PREVIEW_GAP + col * (self.cell[0] + PREVIEW_GAP),
+                                                         PREVIEW_GAP + row * (self.cell[1] + PREVIEW_GAP)))
+
+def preview_format(kind, count, width, encoder=None, card_size=None):
+    """Format of a preview: the card format, or PNG when the canvas is too large for it"""
+    fmt = (encoder or ENCODER_DEFAULTS)['format']
+    if fmt == 'auto':
+        fmt = 'jpeg'
+    card_width, card_height = card_size or CARD_SIZES['square']
+    columns = max(1, min(PREVIEW_COLUMNS[kind], count))
+    side = PREVIEW_GAP + -(-count // columns) * (round(card_height * width / card_width) + PREVIEW_GAP)
+    return fmt if side <= PREVIEW_MAX_SIDE.get(fmt, side) else 'png'
+
+def preview_digest(kind, width, card_digests):
+    return _digest([kind, width, PREVIEW_COLUMNS[kind], PREVIEW_GAP, PREVIEW_BACKGROUND, card_digests])
+
+def plan_previews(previews, cards, output_dir, manifest, encoder=None):
+    """{filename: (digest, format, ContactSheet or None if current)}
+
+    `previews` maps 'sheet' and/or 'strip' to a thumbnail width. Only stale
+    previews get a canvas; the cards then have to be drawn to fill it.
+    """
+    if not previews or not cards:
+        return {}
+    digests = [card_digest(card, i, len(cards), encoder) for i, card in enumerate(cards)]
+    card_size = cards[0]['size']
+    plan = {}
+    for kind, width in previews.items():
+        fmt = preview_format(kind, len(cards), width, encoder, card_size)
+        name = f"{kind}.{FORMAT_EXTENSIONS[fmt]}"
+        digest = preview_digest(kind, width, digests)
+        current = is_up_to_date(manifest, os.path.join(output_dir, name), digest)
+        plan[name] = (digest, fmt, None if current else ContactSheet(len(cards), PREVIEW_COLUMNS[kind],
+                                                                     width, card_size))
+    return plan
+
+def stale_sheets(plan):
+    return [sheet for _, _, sheet in plan.values() if sheet is not None]
+
+def save_previews(plan, output_dir, manifest, encoder=None):
+    """Write the stale sheets of a plan_previews() plan and record them in the manifest"""
+    # A size cap is for single cards on the platform, not for an overview
+    encoder = {**(encoder or ENCODER_DEFAULTS), 'max_bytes': None}
+    for name, (digest, fmt, sheet) in plan.items():
+        if sheet is None:
+            continue
+        size = save_card(sheet.canvas, os.path.join(output_dir, name), fmt, encoder)
+        manifest[name] = digest
+        print(f"🖼️  {os.path.basename(os.path.normpath(output_dir))}/{name}: "
+              f"{sheet.canvas.width}×{sheet.canvas.height}, {size // 1024} KB")
+
+def render_post(html, base_path=None, encoder=None, parser=None, fetch_remote=False,
+                cache_dir=None, size=None):
+    """Render a post held in memory; yields one dict per card, lazily.
+
+    `html` is the page as str or bytes. Nothing is written to disk: each
+    card is drawn and encoded only when the iterator reaches it, so memory
+    stays flat however many cards a post yields. Local images are read from
+    `base_path`; remote ones are skipped unless fetch_remote=True, which
+    downloads them through the shared cache in `cache_dir`. `size` is the
+    card canvas, (width, height) as in CARD_SIZES; square by default.
+
+    Each dict has 'data' (encoded bytes), 'format', 'mime_type', 'filename',
+    'index', 'total', 'title', 'scheme', 'size', 'title_lines' and 'blocks'
+    (the layout boxes of text and images).
+    """
+    sections = parse_html_string(html, base_path, cache_dir, parser, fetch_remote)
+    cards = layout_cards(sections, size)
+    for i, card in enumerate(cards):
+        with profile_stage('draw'):
+            img = render_card(card, i, len(cards))
+        fmt = card_format(card, encoder)
+        with profile_stage('encode'):
+            data = encode_card(img, fmt, encoder)
+        yield {
+            'data': data,
+            'format': fmt,
+            'mime_type': f"image/{fmt}",
+            'filename': card_filename(card, i, encoder),
+            'index': i,
+            'total': len(cards),
+            'title': card['title'],
+            'scheme': COLOR_SCHEMES[i % len(COLOR_SCHEMES)]['name'],
+            'size': img.size,
+            'title_lines': card['title_lines'],
+            'blocks': card['blocks'],
+        }
+
+def file_signature(path):
+    """(path, mtime, size) of a file, or None if it is missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [path, st.st_mtime_ns, st.st_size]
+
+def _content_inputs(card):
+    """Everything a card's content depends on, wherever it sits in a post"""
+    font = resolve_font()
+    return {
+        'card': card,
+        'font': [file_signature(font[0]), font[1]] if font else None,
+        'images': [file_signature(c) for t, c in card.get('content_items', []) if t == 'image'],
+        'layout': [CARD_SIZE, PADDING, TITLE_FONT_SIZE, BODY_FONT_SIZE,
+                   LABEL_FONT_SIZE, LINE_SPACING, WATERMARK_TEXT],
+    }
+
+def _render_inputs(card, card_index):
+    """Everything a card body's pixels depend on, badge aside"""
+    return dict(_content_inputs(card), scheme=COLOR_SCHEMES[card_index % len(COLOR_SCHEMES)])
+
+def _digest(payload):
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def card_digest(card, card_index, total_cards, encoder=None):
+    """Hash of everything that determines how a card renders"""
+    payload = _render_inputs(card, card_index)
+    payload.update({
+        'encoder': encoder or ENCODER_DEFAULTS,
+        'version': MANIFEST_VERSION,
+        'badge': [card_index, total_cards],
+    })
+    return _digest(payload)
+
+def body_digest(card, card_index):
+    """Hash of a card's body (see render_card_body): card_digest minus badge and encoder"""
+    return _digest(_render_inputs(card, card_index))
+
+def content_digest(card):
+    """Hash of a card's content alone: the same card in any post, at any position"""
+    return _digest(_content_inputs(card))
+
+def is_up_to_date(manifest, output_path, digest):
+    """True if the output exists and was rendered from the same inputs"""
+    return manifest.get(os.path.basename(output_path)) == digest and os.path.exists(output_path)
+
+def load_manifest(output_dir, force=False):
+    """Read {filename: input hash} from the output folder's manifest
+
+    With `force` the hashes are dropped: every card counts as out of date,
+    but the files the last run wrote are still known, so save_manifest can
+    delete the ones no longer produced.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('version') != MANIFEST_VERSION:
+        return {}
+    cards = data.get('cards', {})
+    return dict.fromkeys(cards) if force else cards
+
+def save_manifest(output_dir, manifest, filenames, post=None):
+    """Write the manifest for `filenames` and delete outputs no longer produced
+
+    `post` (see parse_post) lets the next run skip an unchanged post
+    without parsing it.
+    """
+    keep = set(filenames)
+    for name in list(manifest):
+        if name not in keep:
+            try:
+                os.remove(os.path.join(output_dir, name))
+                print(f"🗑️  Removed stale {name}")
+            except FileNotFoundError:
+                pass
+    cards = {name: manifest[name] for name in filenames if manifest.get(name)}
+    data = {'version': MANIFEST_VERSION, 'cards': cards}
+    if post and len(cards) == len(filenames):
+        data['post'] = post
+    _atomic_write(os.path.join(output_dir, MANIFEST_NAME),
+                  json.dumps(data, ensure_ascii=False, indent=1).encode('utf-8'))
+
+# Whole-post fast path: a digest of the HTML file, every image it references
+# and the render settings. When it matches the manifest and the cards exist,
+# the post is skipped before BeautifulSoup or PIL are loaded.
+IMG_SRC_RE = re.compile(r'''<img\b[^>]*?\ssrc\s*=\s*["']?([^"'\s>]+)''', re.IGNORECASE)
+
+def _local_images(html_file):
+    """Local paths of every <img> in the file, existing or not, found without parsing"""
+    with open(html_file, 'r', encoding='utf-8', errors='replace') as f:
+        srcs = set(IMG_SRC_RE.findall(f.read()))
+    base_path = find_base_path(os.path.dirname(os.path.abspath(html_file)))
+    return sorted({os.path.join(base_path, src.lstrip('/')) for src in srcs if not src.startswith('http')})
+
+def _remote_fresh(urls, cache_dir=None):
+    """True if every URL is cached and not yet due for revalidation"""
+    for url in urls:
+        try:
+            with open(_url_entry_path(url, cache_dir), 'r', encoding='utf-8') as f:
+                checked = json.load(f).get('checked', 0)
+        except (OSError, ValueError, AttributeError):
+            return False
+        if time.time() - checked >= IMAGE_REVALIDATE_AFTER:
+            return False
+    return True
+
+def post_digest(source, images, urls, encoder=None, parser=None, cache_dir=None):
+    """Hash of a post's source file signature, its images and the render settings"""
+    font = resolve_font()
+    return _digest({
+        'source': source,
+        'images': [file_signature(p) for p in images],
+        'remote': [file_signature(_url_entry_path(u, cache_dir)) for u in urls],
+        'font': [file_signature(font[0]), font[1]] if font else None,
+        'encoder': encoder or ENCODER_DEFAULTS,
+        'parser': parser or HTML_PARSER,
+        'version': MANIFEST_VERSION,
+        'layout': [CARD_SIZE, PADDING, TITLE_FONT_SIZE, BODY_FONT_SIZE,
+                   LABEL_FONT_SIZE, LINE_SPACING, WATERMARK_TEXT],
+    })
+
+def parse_post(html_file, cache_dir=None, parser=None, encoder=None):
+    """parse_html() plus the post's manifest record (see save_manifest)"""
+    source = file_signature(os.path.abspath(html_file))  # before reading, in case it is saved meanwhile
+    urls = []
+    sections = parse_html(html_file, cache_dir=cache_dir, parser=parser, remote_urls=urls)
+    return sections, _post_record(html_file, source, urls, encoder, parser, cache_dir)
+
+def _post_record(html_file, source, urls, encoder=None, parser=None, cache_dir=None):
+    urls = sorted(set(urls))
+    images = _local_images(html_file)
+    return {'digest': post_digest(source, images, urls, encoder, parser, cache_dir),
+            'images': images, 'urls': urls}
+
+def _sized_digest(digest, size=None):
+    return _digest([digest, list(size or CARD_SIZES['square'])])
+
+def sized_record(record, size=None):
+    """A post record (see parse_post) for the cards of one canvas size.
+
+    A post is parsed once for all sizes; each size's output folder records
+    the post digest combined with its size.
+    """
+    return dict(record, digest=_sized_digest(record['digest'], size))
+
+def stream_post(html_file, cache_dir=None, encoder=None, prerender=STREAM_PRERENDER_CARDS, size=None):
+    """parse_post() with the streaming extractor, drawing while it parses.
+
+    Each section is laid out as soon as it is read, and the bodies of the
+    first `prerender` cards are drawn on background threads meanwhile (the
+    badge needs the final card count, so it is added by write_cards).
+    Cards are laid out for the canvas `size` (see layout_cards).
+    Returns (sections, cards, record, bodies).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    source = file_signature(os.path.abspath(html_file))
+    urls, sections, cards, futures = [], [], [], {}
+    with ThreadPoolExecutor(max_workers=ENCODE_THREADS) as pool:
+        with profile_stage('parse_html', post=post_name(html_file)):
+            for section in stream_sections(html_file, cache_dir, remote_urls=urls):
+                sections.append(section)
+                for card in layout_cards([section], size):
+                    if len(futures) < prerender:
+                        futures[body_digest(card, len(cards))] = pool.submit(
+                            render_card_body, card, len(cards))
+                    cards.append(card)
+        bodies = {key: future.result() for key, future in futures.items()}
+    return sections, cards, _post_record(html_file, source, urls, encoder, STREAM_PARSER,
+                                         cache_dir), bodies
+
+def post_up_to_date(html_file, output_dir, encoder=None, parser=None, cache_dir=None, previews=None,
+                    size=None):
+    """Number of cards if `output_dir` holds current output for the post, else None
+
+    The output must be for the canvas `size` (see sized_record), and the
+    previews in the manifest exactly the requested `previews` (see
+    write_cards), drawn from the cards it lists.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        post = data['post']
+        cards = data['cards']
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if data.get('version') != MANIFEST_VERSION:
+        return None
+    if not _remote_fresh(post['urls'], cache_dir):
+        return None
+    source = file_signature(os.path.abspath(html_file))
+    digest = post_digest(source, post['images'], post['urls'], encoder, parser, cache_dir)
+    if _sized_digest(digest, size) != post['digest']:
+        return None
+    if not all(os.path.exists(os.path.join(output_dir, name)) for name in cards):
+        return None
+    card_digests = [d for name, d in cards.items() if name.split('.')[0] not in PREVIEW_COLUMNS]
+    expected = {}
+    for kind, width in (previews or {}).items():
+        fmt = preview_format(kind, len(card_digests), width, encoder, size)
+        expected[f"{kind}.{FORMAT_EXTENSIONS[fmt]}"] = preview_digest(kind, width, card_digests)
+    if {name: d for name, d in cards.items() if name.split('.')[0] in PREVIEW_COLUMNS} != expected:
+        return None
+    return len(card_digests)
+
+def sanitize_filename(text):
+    """Clean filename"""
+    text = re.sub(r'[^\w\s-]', '', text)
+    text = re.sub(r'[-\s]+', '_', text)
+    return text[:50]
+
+def card_filename(card, index, encoder=None):
+    """Output filename for the card at position `index`"""
+    ext = FORMAT_EXTENSIONS[card_format(card, encoder)]
+    return f"{index+1}_{sanitize_filename(card['title'])}.{ext}"
+
+def expand_inputs(patterns):
+    """Expand glob patterns into a sorted, de-duplicated list of HTML files"""
+    files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True))
+        if not matches and os.path.exists(pattern):
+            matches = [pattern]
+        for match in matches:
+            if match not in files:
+                files.append(match)
+    return files
+
+def post_name(path):
+    """Name of the post a file belongs to: its directory's name"""
+    return os.path.basename(os.path.dirname(os.path.abspath(path)))
+
+def _output_name(html_file, root=None):
+    """A post's output folder name: its directory's name (or its path below
+    `root`, with '-' for separators), plus the file's stem unless it is
+    index.html"""
+    path = os.path.abspath(html_file)
+    folder = os.path.dirname(path)
+    name = os.path.relpath(folder, root) if root else '.'
+    name = os.path.basename(folder) if name == '.' else name.replace(os.sep, '-')
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return name if stem == 'index' else f"{name}-{stem}"
+
+def post_output_dirs(html_files, output_root):
+    """{html file: its own output folder under `output_root`} for a batch.
+
+    blog/2025/llm/index.html gets llm/ and posts/a.html gets posts-a/.
+    Posts whose names clash are named by their path below the clashing
+    posts' common directory instead (2024-llm/, 2025-llm/). Raises
+    ValueError if two posts would still share a folder.
+    """
+    groups = {}
+    for html_file in html_files:
+        groups.setdefault(_output_name(html_file), []).append(html_file)
+    names = {}
+    for name, files in groups.items():
+        if len(files) == 1:
+            names[files[0]] = name
+            continue
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(f)) for f in files])
+        names.update((f, _output_name(f, root)) for f in files)
+    owners = {}
+    for html_file, name in names.items():
+        if name in owners:
+            raise ValueError(f"{owners[name]} and {html_file} would both write to {name}/")
+        owners[name] = html_file
+    return {html_file: os.path.join(output_root, name) for html_file, name in names.items()}
+
+def size_dirs(output_dir, sizes):
+    """{size name: output folder}: `output_dir` itself for one size, else a subfolder per size"""
+    if len(sizes) == 1:
+        return {name: output_dir for name in sizes}
+    return {name: os.path.join(output_dir, name) for name in sizes}
+
+# Site index (--batch --dedup): every card body (see render_card_body: the
+# content and its color scheme, without the badge) is stored once under
+# SITE_ASSETS_DIR as a lossless PNG named by its body digest. A card whose
+# body is stored only gets its own "3/12" badge drawn on a copy and is
+# encoded, so a boilerplate section is drawn once for every post whose copy
+# of it falls on the same color scheme. The index records every post's
+# cards by content digest, so the section is found in every post that uses
+# it.
+SITE_INDEX_NAME = '.site-index.json'
+SITE_INDEX_VERSION = 3
+SITE_ASSETS_DIR = '.cards'
+
+class BodyStore:
+    """Card bodies on disk, by body_digest: the `bodies` of generate_card_image()"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, key):
+        return os.path.join(self.folder, f"{key[:32]}.png")
+
+    def get(self, key):
+        from PIL import Image
+        try:
+            with Image.open(self.path(key)) as body:
+                body.load()
+        except FileNotFoundError:
+            return None
+        profile_count('stored_body_hit')
+        return body
+
+    def __setitem__(self, key, body):
+        buf = io.BytesIO()
+        body.save(buf, 'PNG', compress_level=1)
+        _atomic_write(self.path(key), buf.getvalue())
+
+def load_site_index(output_root):
+    """{'posts': {post folder: [[content digest, title, filename, stored body], ...]}, 'cards': ...}"""
+    try:
+        with open(os.path.join(output_root, SITE_INDEX_NAME), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {'posts': {}}
+    if data.get('version') != SITE_INDEX_VERSION:
+        return {'posts': {}}
+    return data
+
+def save_site_index(output_root, index, posts):
+    """Replace the entries of `posts` in the index, then drop unused stored cards.
+
+    Posts whose output folder is gone are dropped too. The index is also
+    written grouped by content digest ('cards': title, the post files, and
+    each stored body with the files drawn from it). A body is only listed
+    while it is in the store.
+    """
+    entries = {post: uses for post, uses in index['posts'].items()
+               if os.path.isdir(os.path.join(output_root, post))}
+    entries.update(posts)
+    assets_dir = os.path.join(output_root, SITE_ASSETS_DIR)
+    cards = {}
+    for post, uses in sorted(entries.items()):
+        for content, title, filename, asset in uses:
+            card = cards.setdefault(content, {'title': title, 'files': [], 'assets': {}})
+            card['files'].append(f"{post}/{filename}")
+            if asset and os.path.exists(os.path.join(assets_dir, asset)):
+                card['assets'].setdefault(asset, []).append(f"{post}/{filename}")
+    used = {asset for card in cards.values() for asset in card['assets']}
+    for name in os.listdir(assets_dir) if os.path.isdir(assets_dir) else []:
+        if name not in used and not name.startswith('.tmp-'):
+            os.remove(os.path.join(assets_dir, name))
+
+    data = {'version': SITE_INDEX_VERSION, 'posts': entries, 'cards': cards}
+    path = os.path.join(output_root, SITE_INDEX_NAME)
+    _atomic_write(path, json.dumps(data, ensure_ascii=False, indent=1).encode('utf-8'))
+    return data
+
+def print_site_index(output_root, query=None):
+    """List cards used by more than one post, or every card whose title or post matches `query`"""
+    index = load_site_index(output_root)
+    cards = index.get('cards', {})
+    if not cards:
+        print(f"❌ No site index in {output_root}/ (render with --batch --dedup first)")
+        return False
+    uses = sum(len(card['files']) for card in cards.values())
+    assets = {asset for card in cards.values() for asset in card['assets']}
+    stored = sum(os.path.getsize(os.path.join(output_root, SITE_ASSETS_DIR, a)) for a in assets
+                 if os.path.exists(os.path.join(output_root, SITE_ASSETS_DIR, a)))
+    print(f"📇 {uses} cards in {len(index['posts'])} posts: {len(cards)} distinct, "
+          f"{len(assets)} bodies stored ({stored / 1024 / 1024:.1f} MB)")
+    print(f"{'─' * 40}")
+    query = query.lower() if query else None
+    shown = 0
+    for content, card in sorted(cards.items(), key=lambda kv: kv[1]['title']):
+        files = card['files']
+        posts = sorted({os.path.dirname(f) for f in files})
+        if query is None and len(posts) < 2:
+            continue
+        if query is not None and query not in card['title'].lower() and not any(query in f.lower() for f in files):
+            continue
+        shown += 1
+        print(f"{'🔗' if len(posts) > 1 else '📄'} {card['title']} ({content[:12]}): "
+              f"{len(posts)} posts, {len(card['assets'])} bodies")
+        for asset, asset_files in card['assets'].items():
+            print(f"     {SITE_ASSETS_DIR}/{asset} ← {', '.join(asset_files)}")
+    if not shown:
+        print("No cards shared between posts" if query is None else f"No cards match {query!r}")
+    return True
+
+def _init_worker(font=None, profile=False, memory=None):
+    """Pool initializer: apply the font choice, profiling and memory limits in each worker"""
+    configure_font(*(font or ()))
+    configure_memory(*(memory or ()))
+    if profile:
+        enable_profiling()
+
+def _parse_job(html_file, output_dirs, sizes, cache_dir=None, parser=None, encoder=None):
+    """Worker: parse one post and lay it out for each card size (runs in a pool process)"""
+    for output_dir in output_dirs.values():
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+    sections, record = parse_post(html_file, cache_dir, parser, encoder)
+    layouts = {name: layout_cards(sections, size) for name, size in sizes.items()}
+    return layouts, record, _drain_profile()
+
+def _render_job(card, output_path, card_index, total_cards, encoder=None, thumb_widths=(), write=True,
+                store=None):
+    """Worker: render one card (runs in a pool process)
+
+    Also returns {width: thumbnail} for the previews; with write=False the
+    card is only drawn for those. With a BodyStore, a stored body is reused
+    and a newly drawn one is stored.
+    """
+    thumbs = {}
+
+    def keep(i, img):
+        for width in thumb_widths:
+            thumbs[width] = thumbnail(img, width)
+
+    scheme_name = None
+    if write:
+        scheme_name = generate_card_image(card, output_path, card_index, total_cards, verbose=False,
+                                          encoder=encoder, bodies=store, on_image=keep if thumb_widths else None)
+    else:
+        with profile_stage('draw', post=post_name(output_path)):
+            keep(card_index, render_card(card, card_index, total_cards))
+    return scheme_name, _drain_profile(), thumbs
+
+def run_batch(html_files, output_root='output', workers=None, force=False, font=None,
+              cache_dir=None, parser=None, encoder=None, previews=None, sizes=None, dedup=False,
+              memory=None):
+    """Parse and render many posts across a process pool.
+
+    Posts are parsed in parallel; as soon as a post is parsed, it is laid
+    out for each of the canvas `sizes` ({name: (width, height)}, see
+    size_dirs) and each card is submitted as an independent render job. Cards whose manifest
+    hash is unchanged are skipped; posts whose source is unchanged (see
+    post_up_to_date) are not even parsed. `font` is an optional (path,
+    index) pair configured in every worker. Results and errors are streamed
+    back into one progress report. `previews` is as for write_cards; the
+    workers send back thumbnails and each post's sheets are written once
+    its last card is in. With `dedup`, cards go through the site index (see
+    SITE_INDEX_NAME): a card whose body is stored only gets its badge drawn.
+    `memory` is an (image cache bytes, max images) pair for configure_memory
+    in the workers.
+
+    Work is pulled, not pushed: posts are parsed only while fewer than
+    BATCH_BACKLOG cards wait to render, and at most two render jobs per
+    worker are queued in the pool, so a large batch holds a bounded number
+    of parsed posts and finished thumbnails at any time.
+    Returns the number of failures.
+    """
+    sizes = sizes or {'square': CARD_SIZES['square']}
+    post_dirs = post_output_dirs(html_files, output_root)
+    done_cards = 0
+    rendered = 0
+    skipped = 0
+    total_cards = 0
+    errors = []
+    manifests = {}  # output_dir -> (manifest, filenames, post record)
+    sheets = {}     # output_dir -> [preview plan, render jobs left, failed]
+    site = load_site_index(output_root) if dedup else None
+    store = BodyStore(os.path.join(output_root, SITE_ASSETS_DIR)) if dedup else None
+    site_posts = {}  # post folder -> its index entries
+    waiting = {}     # stored body being drawn -> render jobs held back until it is there
+    reused = 0
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    workers = workers or os.cpu_count() or 1
+    posts = iter(html_files)
+    backlog = deque()  # (render job args, pending entry) waiting for a worker
+    running = {'parse': 0, 'render': 0}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(font, _profiler is not None, memory)) as pool:
+        pending = {}
+
+        def feed():
+            nonlocal total_cards, done_cards, skipped
+            while backlog and running['render'] < 2 * workers:
+                args, entry = backlog.popleft()
+                pending[pool.submit(_render_job, *args)] = entry
+                running['render'] += 1
+            while running['parse'] < workers and len(backlog) < BATCH_BACKLOG:
+                html_file = next(posts, None)
+                if html_file is None:
+                    return
+                output_dirs = size_dirs(post_dirs[html_file], sizes)
+                counts = [None if force else post_up_to_date(html_file, output_dirs[name], encoder, parser,
+                                                             cache_dir, previews, size)
+                          for name, size in sizes.items()]
+                if site is not None and any(os.path.relpath(d, output_root) not in site['posts']
+                                            for d in output_dirs.values()):
+                    counts = [None]  # not in the site index yet
+                if None not in counts:
+                    count = sum(counts)
+                    total_cards += count
+                    done_cards += count
+                    skipped += count
+                    print(f"⏭️  {post_name(html_file)}: up to date ({count} cards)")
+                    continue
+                future = pool.submit(_parse_job, html_file, output_dirs, sizes, cache_dir, parser, encoder)
+                pending[future] = ('parse', html_file, None, output_dirs)
+                running['parse'] += 1
+
+        feed()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                kind, html_file, output_dir, info = pending.pop(future)
+                running[kind] -= 1
+
+                if kind == 'parse':
+                    output_dirs = info
+                    try:
+                        layouts, record, profile = future.result()
+                        if profile:
+                            _profiler.merge(profile)
+                    except Exception as e:
+                        errors.append((html_file, None, e))
+                        print(f"❌ {post_name(html_file)}: could not parse {html_file}: {e}")
+                        continue
+                    for size_name, cards in layouts.items():
+                        output_dir = output_dirs[size_name]
+                        name = os.path.relpath(output_dir, output_root)
+                        if not cards:
+                            print(f"⚠️  {name}: no H2/H3 headings found")
+                            continue
+                        total_cards += len(cards)
+                        print(f"📖 {name}: {len(cards)} cards")
+                        manifest = load_manifest(output_dir, force)
+                        filenames = [card_filename(card, i, encoder) for i, card in enumerate(cards)]
+                        plan = plan_previews(previews, cards, output_dir, manifest, encoder)
+                        widths = sorted({sheet.cell[0] for sheet in stale_sheets(plan)})
+                        manifests[output_dir] = (manifest, filenames + list(plan),
+                                                 sized_record(record, sizes[size_name]))
+                        uses = site_posts[name] = []
+                        jobs = 0
+                        for i, card in enumerate(cards):
+                            output_path = os.path.join(output_dir, filenames[i])
+                            digest = card_digest(card, i, len(cards), encoder)
+                            write = not is_up_to_date(manifest, output_path, digest)
+                            body = None  # the stored body this job draws
+                            held = False
+                            if site is not None:
+                                asset = store.path(body_digest(card, i))
+                                if write:
+                                    if asset in waiting or os.path.exists(asset):
+                                        reused += 1
+                                        held = asset in waiting
+                                    else:
+                                        waiting[asset] = []
+                                        body = asset
+                                # A skipped card draws nothing: its body is only listed if stored
+                                stored = write or os.path.exists(asset)
+                                uses.append([content_digest(card), card['title'], filenames[i],
+                                             os.path.basename(asset) if stored else None])
+                            if not write:
+                                done_cards += 1
+                                skipped += 1
+                                if not widths:
+                                    continue
+                            job = ((card, output_path, i, len(cards), encoder, widths, write, store),
+                                   ('render', html_file, output_dir, (i, len(cards), digest, write, body)))
+                            (waiting[asset] if held else backlog).append(job)
+                            jobs += 1
+                        if widths:
+                            sheets[output_dir] = [plan, jobs, False]
+                else:
+                    name = os.path.relpath(output_dir, output_root)
+                    i, count, digest, write, body = info
+                    if write:
+                        done_cards += 1
+                    if body is not None:
+                        backlog.extend(waiting.pop(body))  # their body is stored now (or they draw it)
+                    try:
+                        scheme_name, profile, thumbs = future.result()
+                        if profile:
+                            _profiler.merge(profile)
+                        if write:
+                            rendered += 1
+                            manifest, filenames, _ = manifests[output_dir]
+                            manifest[filenames[i]] = digest
+                            print(f"✅ [{done_cards}/{total_cards}] {name} {i + 1}/{count} - {scheme_name}")
+                        if output_dir in sheets:
+                            for sheet in stale_sheets(sheets[output_dir][0]):
+                                sheet.add(i, thumbs[sheet.cell[0]])
+                    except Exception as e:
+                        errors.append((html_file, i, e))
+                        print(f"❌ [{done_cards}/{total_cards}] {name} {i + 1}/{count}: {e}")
+                        if output_dir in sheets:
+                            sheets[output_dir][2] = True
+                    if output_dir in sheets:
+                        sheets[output_dir][1] -= 1
+                        plan, left, failed = sheets[output_dir]
+                        if not left:
+                            del sheets[output_dir]
+                            if not failed:
+                                save_previews(plan, output_dir, manifests[output_dir][0], encoder)
+            feed()
+
+    for output_dir, (manifest, filenames, record) in manifests.items():
+        save_manifest(output_dir, manifest, filenames, record)
+    if site is not None:
+        site = save_site_index(output_root, site, site_posts)
+
+    print(f"{'─' * 40}")
+    print(f"\n✨ Done! {rendered}/{total_cards} cards from {len(html_files)} posts → {output_root}/")
+    if skipped:
+        print(f"⏭️  {skipped} unchanged cards skipped")
+    if reused:
+        print(f"🔗 {reused} cards drawn from a stored body (badge only)")
+    if site is not None:
+        shared = sum(1 for card in site['cards'].values()
+                     if len({os.path.dirname(f) for f in card['files']}) > 1)
+        print(f"📇 Site index: {len(site['cards'])} distinct cards, {shared} used by several posts "
+              f"(--index -o {output_root} to list them)")
+    if errors:
+        print(f"❌ {len(errors)} errors")
+    return len(errors)
+
+# Watch mode: one post stays loaded; each save re-extracts it, reuses the
+# layout of unchanged sections and re-renders only cards whose inputs changed.
+WATCH_DEBOUNCE = 0.3        # seconds of quiet after a save before rebuilding
+WATCH_POLL_INTERVAL = 0.5   # polling fallback when inotify is unavailable
+
+# inotify(7) event masks
+IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x80, 0x100, 0x200
+IN_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+IN_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+def _inotify_init():
+    """An inotify fd (non-blocking), or None where inotify is unavailable"""
+    if not sys.platform.startswith('linux'):
+        return None
+    import ctypes
+    import ctypes.util
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    return libc, fd
+
+class FileWatcher:
+    """Blocks until watched files change; inotify on Linux, mtime polling elsewhere.
+
+    Directories are watched rather than files, so editors that save by
+    writing a temp file and renaming it over the original are seen too.
+    """
+    def __init__(self, debounce=WATCH_DEBOUNCE, poll_interval=WATCH_POLL_INTERVAL, poll=False):
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.inotify = None if poll else _inotify_init()
+        self.dirs = {}  # watch descriptor -> directory
+
+    @property
+    def method(self):
+        return 'inotify' if self.inotify else 'polling'
+
+    @staticmethod
+    def snapshot(paths):
+        """{absolute path: file_signature} to pass to wait()"""
+        return {p: file_signature(p) for p in map(os.path.abspath, paths)}
+
+    def wait(self, before):
+        """Return the set of paths that changed since the `before` snapshot,
+        once saves have settled. Take the snapshot before reading the files,
+        so a save made while they were being used is not missed.
+        """
+        paths = list(before)
+        while True:
+            current = self.snapshot(paths)
+            if current != before:  # changed since the snapshot: just let it settle
+                self._settle(paths, current)
+                if self.inotify:
+                    self._watch_dirs(paths)
+                    self._read_events(paths)  # already seen
+            elif self.inotify:
+                self._wait_inotify(paths)
+            else:
+                self._wait_poll(paths, before)
+            changed = {p for p in paths if file_signature(p) != before[p]}
+            if changed:
+                return changed
+
+    def _watch_dirs(self, paths):
+        libc, fd = self.inotify
+        for d in {os.path.dirname(p) for p in paths} - set(self.dirs.values()):
+            wd = libc.inotify_add_watch(fd, os.fsencode(d), IN_WATCH_MASK)
+            if wd >= 0:
+                self.dirs[wd] = d
+
+    def _read_events(self, paths):
+        """True if any pending event concerns one of `paths`"""
+        _, fd = self.inotify
+        hit = False
+        while True:
+            try:
+                data = os.read(fd, 64 * 1024)
+            except BlockingIOError:
+                return hit
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = IN_EVENT.unpack_from(data, offset)
+                offset += IN_EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if os.path.join(self.dirs.get(wd, ''), os.fsdecode(name)) in paths:
+                    hit = True
+
+    def _wait_inotify(self, paths):
+        self._watch_dirs(paths)
+        _, fd = self.inotify
+        while True:
+            select.select([fd], [], [])
+            if self._read_events(paths):
+                break
+        # Debounce: wait until a full quiet period passes without events
+        while select.select([fd], [], [], self.debounce)[0]:
+            self._read_events(paths)
+
+    def _wait_poll(self, paths, before):
+        current = before
+        while current == before:
+            time.sleep(self.poll_interval)
+            current = self.snapshot(paths)
+        self._settle(paths, current)
+
+    def _settle(self, paths, current):
+        """Wait until a full quiet period passes without the files changing"""
+        while True:
+            time.sleep(self.debounce)
+            settled = self.snapshot(paths)
+            if settled == current:
+                return
+            current = settled
+
+class Budget:
+    """A counter that blocks acquire(n) while n more would pass `limit`.
+
+    One request larger than the whole limit still goes through once nothing
+    else is held, so it cannot deadlock.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, n=1):
+        with self.cond:
+            self.cond.wait_for(lambda: self.used == 0 or self.used + n <= self.limit)
+            self.used += n
+
+    def release(self, n=1):
+        with self.cond:
+            self.used -= n
+            self.cond.notify_all()
+
+class BoundedExecutor:
+    """An executor whose submit() blocks while `limit` tasks are queued or running"""
+    def __init__(self, pool, limit):
+        self.pool = pool
+        self.slots = Budget(limit)
+
+    def submit(self, fn, *args, **kwargs):
+        self.slots.acquire()
+        try:
+            future = self.pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+def write_cards(cards, output_dir, manifest, encoder=None, bodies=None, post=None, keep_bodies=True,
+                previews=None):
+    """Render `cards` into `output_dir`, skipping ones the manifest has as current
+
+    `previews` ({'sheet': width, 'strip': width}) also writes a contact
+    sheet and/or strip of all cards (see ContactSheet).
+
+    A decode thread loads each card's images ahead of drawing, holding at
+    most PIPELINE_MAX_IMAGES of them; drawing runs here; encoding and writing
+    run on ENCODE_THREADS threads, with at most PIPELINE_ENCODE_QUEUE cards
+    waiting. Memory stays flat however many cards and images there are.
+    """
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+    filenames = [card_filename(card, i, encoder) for i, card in enumerate(cards)]
+    plan = plan_previews(previews, cards, output_dir, manifest, encoder)
+    sheets = stale_sheets(plan)
+
+    def add_to_sheets(i, img):
+        for sheet in sheets:
+            sheet.add(i, img)
+
+    decoded = Budget(PIPELINE_MAX_IMAGES)
+    ready = queue.Queue(maxsize=PIPELINE_MAX_IMAGES)
+    stop = threading.Event()
+
+    def decode():
+        try:
+            for i, card in enumerate(cards):
+                if stop.is_set():
+                    return
+                count = sum(1 for b in card['blocks'] if b['type'] == 'image')
+                if count and not sheets and is_up_to_date(
+                        manifest, os.path.join(output_dir, filenames[i]), card_digest(card, i, len(cards), encoder)):
+                    count = 0  # skipped, nothing to draw
+                if count and bodies is not None and body_digest(card, i) in bodies:
+                    count = 0  # only the badge is drawn
+                images = None
+                if count:
+                    decoded.acquire(count)
+                    with profile_stage('prefetch', post=post_name(output_dir + os.sep)):
+                        images = prefetch_images(card)
+                ready.put((i, card, images))
+        finally:
+            ready.put(None)
+
+    decoder = threading.Thread(target=decode, name='decode', daemon=True)
+    with ThreadPoolExecutor(max_workers=ENCODE_THREADS) as pool:
+        encode_pool = BoundedExecutor(pool, PIPELINE_ENCODE_QUEUE)
+        decoder.start()
+        try:
+            while True:
+                item = ready.get()
+                if item is None:
+                    break
+                i, card, images = item
+                try:
+                    generate_card_image(card, os.path.join(output_dir, filenames[i]), i, len(cards),
+                                        manifest=manifest, encoder=encoder, encode_pool=encode_pool,
+                                        bodies=bodies, keep_bodies=keep_bodies,
+                                        on_image=add_to_sheets if sheets else None, images=images)
+                finally:
+                    if images:
+                        decoded.release(len(images))
+        finally:
+            stop.set()
+            while decoder.is_alive():  # unblock the decoder if drawing stopped early
+                try:
+                    item = ready.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item and item[2]:
+                    decoded.release(len(item[2]))
+    save_previews(plan, output_dir, manifest, encoder)
+    save_manifest(output_dir, manifest, filenames + list(plan), post)
+    return filenames
+
+def _section_key(section):
+    """Identity of a section's layout inputs, image files included"""
+    return _digest([section, [file_signature(c) for t, c in section['content_items'] if t == 'image']])
+
+def watch_post(html_file, output_dir, encoder=None, force=False, cache_dir=None, parser=None,
+               poll=False, previews=None, sizes=None):
+    """Render `html_file`, then re-render on every change until interrupted.
+
+    Sections whose HTML and images are unchanged keep their layout; cards
+    whose inputs are unchanged are skipped via the manifest; cards that only
+    moved (a new card count, or a shift that keeps their color scheme) get
+    just their badge redrawn over the cached body. Each save is parsed once
+    for all canvas `sizes` (see run_batch).
+    """
+    sizes = sizes or {'square': CARD_SIZES['square']}
+    output_dirs = size_dirs(output_dir, sizes)
+    watcher = FileWatcher(poll=poll)
+    manifests = {name: load_manifest(d, force) for name, d in output_dirs.items()}
+    layouts = {}   # (size name, section key) -> its cards
+    bodies = {}    # body digest -> drawn body, for the cards of the last build
+
+    def build():
+        """Render once; returns a FileWatcher snapshot of the post's files from before they were read"""
+        nonlocal layouts, bodies
+        started = time.perf_counter()
+        before = FileWatcher.snapshot([html_file])
+        sections, record = parse_post(html_file, cache_dir, parser, encoder)
+        images = {c for s in sections for t, c in s['content_items'] if t == 'image'}
+        before.update(FileWatcher.snapshot(p for p in images if os.path.exists(p)))
+        keys = [_section_key(section) for section in sections]
+        new_layouts, cards = {}, {}
+        for name, size in sizes.items():
+            cards[name] = []
+            for section, key in zip(sections, keys):
+                key = (name, key)
+                if key not in new_layouts:
+                    new_layouts[key] = layouts.get(key) or layout_cards([section], size)
+                cards[name].extend(new_layouts[key])
+        old_keys = {key for _, key in layouts}
+        changed = sum(1 for key in set(keys) if key not in old_keys)
+        removed = sum(1 for key in old_keys if key not in keys)
+        counts = ', '.join(f"{len(c)} {name}" if len(sizes) > 1 else str(len(c)) for name, c in cards.items())
+        print(f"📊 {len(sections)} sections ({changed} new or changed, {removed} gone) → {counts} cards")
+        live = set()
+        for name, size in sizes.items():
+            write_cards(cards[name], output_dirs[name], manifests[name], encoder, bodies,
+                        sized_record(record, size), previews=previews)
+            live.update(body_digest(card, i) for i, card in enumerate(cards[name]))
+        bodies = {k: v for k, v in bodies.items() if k in live}
+        layouts = new_layouts
+        print(f"✨ Rebuilt in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return before
+
+    files = build()
+    print(f"👀 Watching {len(files)} files ({watcher.method}); Ctrl-C to stop")
+    try:
+        while True:
+            changed = watcher.wait(files)
+            print(f"{'─' * 40}")
+            print(f"🔄 Changed: {', '.join(sorted(os.path.basename(p) for p in changed))}")
+            before = FileWatcher.snapshot(files)  # what to wait on if the rebuild fails
+            try:
+                files = build()
+            except Exception as e:
+                files = before
+                print(f"❌ Rebuild failed: {e}")
+    except KeyboardInterrupt:
+        print("\n👋 Stopped watching")
+
+def _parser_installed(name):
+    if name == STREAM_PARSER:
+        return True
+    from bs4.builder import builder_registry
+    return builder_registry.lookup(name) is not None
+
+def _can_write(fmt):
+    from PIL import features
+    return features.check(fmt)
+
+def parse_quality(text):
+    """'85' -> 85, for lossy quality 1-100"""
+    try:
+        quality = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {text}")
+    if not 1 <= quality <= 100:
+        raise argparse.ArgumentTypeError(f"must be 1-100: {text}")
+    return quality
+
+def parse_size(text):
+    """'300000', '300k' or '1.5m' -> bytes"""
+    text = text.strip().lower()
+    scale = {'k': 1024, 'm': 1024 * 1024}.get(text[-1:], 1)
+    try:
+        return int(float(text.rstrip('km')) * scale)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a size: {text}")
+
+def parse_card_sizes(text):
+    """'portrait,square' or '1080x1350' -> {name: (width, height)}"""
+    sizes = {}
+    for part in text.lower().split(','):
+        part = part.strip()
+        match = re.fullmatch(r'(\d+)x(\d+)', part)
+        if part in CARD_SIZES:
+            sizes[part] = CARD_SIZES[part]
+        elif match and all(MIN_CARD_SIDE <= int(n) <= MAX_CARD_SIDE for n in match.groups()):
+            sizes[part] = (int(match.group(1)), int(match.group(2)))
+        else:
+            raise argparse.ArgumentTypeError(f"not a card size: {part} (use {', '.join(CARD_SIZES)} or "
+                                             f"WIDTHxHEIGHT, {MIN_CARD_SIDE} to {MAX_CARD_SIDE} px)")
+    return sizes
+
+def _finish_profile(started, trace_path=None):
+    """Report the profile when the CLI exits"""
+    _profiler.report(time.perf_counter() - started)
+    if trace_path:
+        _profiler.write_trace(trace_path)
+        print(f"📈 Trace → {trace_path}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert blog posts into Xiaohongshu knowledge cards.",
+        epilog="Example:\n  python generate.py ../blog/2025/llm/index.html\n"
+               "  python generate.py --batch '../blog/20*/*/index.html' -o output -j 8",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('html_file', nargs='?', help="HTML file to convert")
+    parser.add_argument('output_dir', nargs='?', help="output folder (default: output)")
+    parser.add_argument('--batch', nargs='+', metavar='PATTERN',
+                        help="render many posts (files or globs) in parallel")
+    parser.add_argument('-o', '--output-dir', dest='output_root', metavar='DIR',
+                        help="output folder; in batch mode one subfolder per post")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes for batch mode (default: CPU count)")
+    parser.add_argument('--font', metavar='PATH',
+                        help="font file to draw with (default: search system fonts; env XHS_FONT)")
+    parser.add_argument('--font-index', type=int, default=0, metavar='N',
+                        help="face index inside a .ttc font collection (default: 0)")
+    parser.add_argument('--cache-dir', metavar='DIR', default=None,
+                        help=f"shared download cache for remote images (default: {IMAGE_CACHE_DIR})")
+    parser.add_argument('--parser', choices=['lxml', 'html.parser', 'html5lib', STREAM_PARSER], default=None,
+                        help=f"BeautifulSoup parser backend, or '{STREAM_PARSER}' to extract sections "
+                             f"incrementally and draw while parsing (default: {HTML_PARSER})")
+    parser.add_argument('--size', type=parse_card_sizes, default=None, metavar='SIZES',
+                        help="card canvas: " + ', '.join(f"{name} ({w}x{h})" for name, (w, h) in CARD_SIZES.items())
+                             + " or WIDTHxHEIGHT; several, comma-separated, are rendered from one parse "
+                               "into a subfolder each (default: square)")
+    parser.add_argument('--force', action='store_true',
+                        help="re-render every card, ignoring the output manifest")
+    parser.add_argument('--dedup', action='store_true',
+                        help=f"with --batch: draw each distinct card body once, stored in {SITE_ASSETS_DIR}/, and "
+                             f"only add the badge per post; recorded in the site index {SITE_INDEX_NAME}")
+    parser.add_argument('--index', nargs='?', const='', metavar='TEXT',
+                        help="list the cards the site index has in several posts, or every card whose "
+                             "title or post contains TEXT, then exit")
+    parser.add_argument('--format', choices=['jpeg', 'png', 'webp', 'avif', 'auto'], default=None,
+                        help="output format; auto = PNG for text-only cards, JPEG otherwise (default: jpeg)")
+    parser.add_argument('--quality', type=parse_quality, default=None,
+                        help="lossy quality (default: jpeg 95, webp 90, avif 75)")
+    parser.add_argument('--max-bytes', type=parse_size, default=None, metavar='SIZE',
+                        help="lower the quality until each card fits, e.g. 300k")
+    parser.add_argument('--optimize', action='store_true',
+                        help="extra encoder passes for smaller files (JPEG Huffman, PNG, WebP)")
+    parser.add_argument('--progressive', action='store_true', help="write progressive JPEGs")
+    parser.add_argument('--subsampling', choices=['4:4:4', '4:2:2', '4:2:0'], default=None,
+                        help="JPEG chroma subsampling (default: Pillow's choice)")
+    parser.add_argument('--sheet', action='store_true',
+                        help="also write sheet.jpg, a contact sheet of every card in a grid")
+    parser.add_argument('--strip', action='store_true',
+                        help="also write strip.jpg, every card stacked in one tall image")
+    parser.add_argument('--thumb-width', type=int, default=THUMB_WIDTH, metavar='PX',
+                        help=f"card width in the sheet and strip (default: {THUMB_WIDTH}; {CARD_SIZE} = full size)")
+    parser.add_argument('--image-cache', type=parse_size, default=None, metavar='SIZE',
+                        help=f"decoded images kept per process, e.g. 64m "
+                             f"(default: {IMAGE_CACHE_MAX_BYTES // (1024 * 1024)}m)")
+    parser.add_argument('--max-images', type=int, default=None, metavar='N',
+                        help=f"images decoded ahead of drawing (default: {PIPELINE_MAX_IMAGES})")
+    parser.add_argument('--watch', action='store_true',
+                        help="keep running and re-render changed cards whenever the post or its images change")
+    parser.add_argument('--poll', action='store_true',
+                        help="with --watch: poll file times instead of using inotify (e.g. network drives)")
+    parser.add_argument('--profile', action='store_true',
+                        help="print a per-stage timing breakdown at the end")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="with --profile: also write a Chrome trace JSON (chrome://tracing)")
+    args = parser.parse_args()
+
+    output_dir = args.output_root or args.output_dir or 'output'
+    if args.index is not None:
+        sys.exit(0 if print_site_index(output_dir, args.index or None) else 1)
+    if args.dedup and not args.batch:
+        print("❌ --dedup works with --batch (the index spans a whole site)")
+        sys.exit(1)
+    if args.parser and not _parser_installed(args.parser):
+        print(f"❌ Parser not installed: {args.parser}")
+        sys.exit(1)
+    if args.font:
+        if not os.path.exists(args.font):
+            print(f"❌ Font not found: {args.font}")
+            sys.exit(1)
+        configure_font(args.font, args.font_index)
+
+    if args.format in ('webp', 'avif') and not _can_write(args.format):
+        print(f"❌ This Pillow build cannot write {args.format.upper()}")
+        sys.exit(1)
+    encoder = encoder_options(format=args.format, quality=args.quality, optimize=args.optimize or None,
+                              progressive=args.progressive or None, subsampling=args.subsampling,
+                              max_bytes=args.max_bytes)
+
+    if args.thumb_width < 1:
+        print("❌ --thumb-width must be at least 1")
+        sys.exit(1)
+    previews = {kind: args.thumb_width for kind in PREVIEW_COLUMNS if getattr(args, kind)} or None
+    if args.max_images is not None and args.max_images < 1:
+        print("❌ --max-images must be at least 1")
+        sys.exit(1)
+    memory = (args.image_cache, args.max_images)
+    configure_memory(*memory)
+    sizes = args.size or {'square': CARD_SIZES['square']}
+
+    if args.profile or args.trace:
+        enable_profiling()
+        atexit.register(_finish_profile, time.perf_counter(), args.trace)
+
+    if args.batch:
+        html_files = expand_inputs(args.batch + ([args.html_file] if args.html_file else []))
+        if not html_files:
+            print(f"❌ No files match: {' '.join(args.batch)}")
+            sys.exit(1)
+        try:
+            post_output_dirs(html_files, output_dir)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"📚 Batch: {len(html_files)} posts, {args.workers or os.cpu_count()} workers")
+        print(f"{'─' * 40}")
+        font = (args.font, args.font_index) if args.font else None
+        failures = run_batch(html_files, output_dir, args.workers, force=args.force, font=font,
+                             cache_dir=args.cache_dir, parser=args.parser, encoder=encoder, previews=previews,
+                             sizes=sizes, dedup=args.dedup, memory=memory)
+        sys.exit(1 if failures else 0)
+
+    if not args.html_file:
+        parser.print_usage()
+        print("\nExample:")
+        print("  python generate.py ../blog/2025/llm/index.html")
+        sys.exit(1)
+
+    html_file = args.html_file
+    if not os.path.exists(html_file):
+        print(f"❌ File not found: {html_file}")
+        sys.exit(1)
+
+    output_dirs = size_dirs(output_dir, sizes)
+    if not args.force and not args.watch:
+        counts = [post_up_to_date(html_file, output_dirs[name], encoder, args.parser, args.cache_dir,
+                                  previews, size) for name, size in sizes.items()]
+        if None not in counts:
+            print(f"⏭️  Up to date: {sum(counts)} cards in {output_dir}/ (--force to re-render)")
+            return
+
+    for path in output_dirs.values():
+        Path(path).mkdir(parents=True, exist_ok=True)
+
+    if args.watch:
+        print(f"👀 Watch: {html_file} → {output_dir}/")
+        print(f"{'─' * 40}")
+        watch_post(html_file, output_dir, encoder, force=args.force, cache_dir=args.cache_dir,
+                   parser=args.parser, poll=args.poll, previews=previews, sizes=sizes)
+        return
+
+    print(f"📖 Parsing: {html_file}")
+    manifests = {name: load_manifest(path, args.force) for name, path in output_dirs.items()}
+    first = next(iter(sizes))
+    layouts = {}
+    bodies = None
+    if args.parser == STREAM_PARSER:
+        # Cards whose manifest entry is current are skipped, so only a fresh
+        # render is worth drawing ahead of the final card count
+        prerender = 0 if any(manifests[first].values()) else STREAM_PRERENDER_CARDS
+        sections, layouts[first], record, bodies = stream_post(
+            html_file, args.cache_dir, encoder, prerender=prerender, size=sizes[first])
+    else:
+        sections, record = parse_post(html_file, args.cache_dir, args.parser, encoder)
+    for name, size in sizes.items():
+        if name not in layouts:
+            layouts[name] = layout_cards(sections, size)
+    counts = ', '.join(f"{len(c)} {name}" if len(sizes) > 1 else str(len(c)) for name, c in layouts.items())
+    print(f"📊 Found {len(sections)} sections → {counts} cards\n")
+
+    if not layouts[first]:
+        print("❌ No H2/H3 headings found")
+        sys.exit(1)
+
+    print(f"🎨 Generating professional cards...")
+    print(f"{'─' * 40}")
+
+    for name, cards in layouts.items():
+        if len(sizes) > 1:
+            print(f"📐 {name} {sizes[name][0]}×{sizes[name][1]} → {output_dirs[name]}/")
+        write_cards(cards, output_dirs[name], manifests[name], encoder, bodies, sized_record(record, sizes[name]),
+                    keep_bodies=False, previews=previews)
+        bodies = None  # drawn ahead for the first size only
+
+    print(f"{'─' * 40}")
+    print(f"\n✨ Done! {sum(len(c) for c in layouts.values())} cards → {output_dir}/")
+    print(f"📂 open {output_dir}")
+
+if __name__ == '__main__':
+    main()
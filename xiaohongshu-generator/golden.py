@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+小红书图文生成器 - Golden Images
+Renders a fixed corpus (the repo's blog/ posts plus synthetic CJK and image
+posts) and compares every card with a stored golden copy, so a faster
+wrap_text, image paste or encoder cannot change the cards unnoticed.
+
+    python golden.py --update                # render the corpus into golden/
+    python golden.py                         # render again, compare, exit 1 on changes
+    python golden.py --format jpeg           # compare encoded-and-decoded cards instead
+    python golden.py --only cjk              # just the fixtures whose name contains cjk
+
+A local tool: golden/ holds pixels from this machine's font and FreeType, so
+it is not committed. Store it with --update before a change, check after.
+"""
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("❌ golden.py needs NumPy: pip install numpy")
+import PIL
+from PIL import Image, features
+
+import generate
+import benchmark
+
+GOLDEN_INFO = 'golden.json'
+GOLDEN_RE = re.compile(r'^(\d{3})\.png$')  # golden/<fixture>/001.png, one per card
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+CELL = 4                 # px; luma differences are averaged over CELL x CELL squares
+TOLERANCE = 24.0         # worst cell difference (0-255) that still passes: JPEG and WebP
+                         # noise stays below 15, one added period scores ~33
+HEAT_GAIN = 4            # heatmap brightness per unit of difference
+
+MIXED = ("混排 mixed text: 开源 open source 与 LLM 推理 inference，数字 2025 年 12 月，"
+         "英文 punctuation (brackets) and 中文标点「引号」。")
+URL = "https://example.com/a/very/long/path/without/any/break/opportunity/" * 3
+
+def write_golden_fixtures(root):
+    """Synthetic posts beyond the benchmark ones: mixed scripts and image modes.
+
+    Returns {name: html path}. All inputs are generated, so every run draws
+    the same pixels.
+    """
+    assets = os.path.join(root, 'assets', 'golden')
+    Path(assets).mkdir(parents=True, exist_ok=True)
+    gradient = Image.radial_gradient('L')
+    images = {
+        'rgba.png': Image.merge('RGBA', [gradient, gradient.transpose(Image.Transpose.ROTATE_90),
+                                         Image.linear_gradient('L'), gradient.point(lambda v: 255 - v)
+                                         ]).resize((1200, 800)),
+        'palette.png': Image.linear_gradient('L').resize((640, 960)).convert('RGB').convert('P'),
+        'gray.jpg': gradient.resize((1500, 1500)),
+        'tall.png': Image.linear_gradient('L').resize((200, 2400)),
+        'tiny.png': gradient.resize((48, 32)).convert('RGB'),
+    }
+    for name, img in images.items():
+        params = {'transparency': 0} if img.mode == 'P' else {}
+        img.save(os.path.join(assets, name), **params)
+    srcs = [f"/assets/golden/{name}" for name in images]
+
+    pages = {
+        'mixed': benchmark._page(
+            [benchmark._section(f"混排 Mixed {i}", [MIXED * (i + 1), URL], bullets=i) for i in range(4)]
+            + [benchmark._section("只有标题 Title only " * 6, [])]),
+        'image-modes': benchmark._page(
+            [benchmark._section(f"Image {name}", [MIXED], images=[src]) for name, src in zip(images, srcs)]
+            + [benchmark._section("All images", [], images=srcs)]),
+    }
+    fixtures = {}
+    for name, html in pages.items():
+        post_dir = os.path.join(root, 'blog', name)
+        Path(post_dir).mkdir(parents=True, exist_ok=True)
+        path = os.path.join(post_dir, 'index.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        fixtures[f"synthetic/{name}"] = path
+    return fixtures
+
+def font_info():
+    """The font cards are drawn with, pinned by the SHA-256 of its file"""
+    font = generate.resolve_font()
+    if not font:
+        return None
+    path, index = font
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    return {'path': path, 'index': index, 'sha256': digest}
+
+def _layout_fixture(path):
+    return generate.layout_cards(generate.parse_html(path))
+
+def render(card, card_index, total_cards, encoder=None):
+    """RGB array of one card; with an `encoder`, as decoded back from its file"""
+    img = generate.render_card(card, card_index, total_cards)
+    if encoder:
+        data = generate.encode_card(img, generate.card_format(card, encoder), encoder)
+        img = Image.open(io.BytesIO(data))
+    return np.asarray(img.convert('RGB'))
+
+def compare(golden, current, tolerance=TOLERANCE):
+    """Difference measures of two RGB arrays, and the per-pixel luma difference.
+
+    Luma differences are averaged over CELL x CELL squares before taking the
+    worst one ('cell'): encoder noise and antialiasing at text edges average
+    out, while a moved, added or missing glyph does not. 'over' counts the
+    cells past `tolerance`. Identical arrays return no difference.
+    """
+    if golden.shape != current.shape:
+        return {'size': [golden.shape[1], golden.shape[0]]}, None
+    if np.array_equal(golden, current):
+        return {'cell': 0.0, 'over': 0, 'at': None}, None
+    diff = np.abs(golden @ LUMA - current @ LUMA)
+    h, w = diff.shape
+    cells = diff[:h - h % CELL, :w - w % CELL].reshape(h // CELL, CELL, w // CELL, CELL).mean(axis=(1, 3))
+    worst = np.unravel_index(int(np.argmax(cells)), cells.shape)
+    return {
+        'cell': round(float(cells[worst]), 2),
+        'over': int((cells > tolerance).sum()),
+        'at': [int(worst[1]) * CELL, int(worst[0]) * CELL],
+    }, diff
+
+def heatmap(golden, current, diff):
+    """Golden | current | difference in red over the faded golden card"""
+    faded = (golden.mean(axis=2, dtype=np.float32) * 0.3 + 178).astype(np.uint8)
+    heat = np.minimum(diff * HEAT_GAIN, 255).astype(np.uint8)
+    overlay = np.stack([np.maximum(faded, heat), faded - (faded * (heat / 255.0)).astype(np.uint8),
+                        faded - (faded * (heat / 255.0)).astype(np.uint8)], axis=2)
+    return Image.fromarray(np.concatenate([golden, current, overlay], axis=1))
+
+def _card_path(root, fixture, card_index):
+    return os.path.join(root, fixture, f"{card_index + 1:03d}.png")
+
+def _update_chunk(jobs, golden_dir):
+    for fixture, card, i, total in jobs:
+        path = _card_path(golden_dir, fixture, i)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        Image.fromarray(render(card, i, total)).save(path)
+    return [None] * len(jobs)
+
+def _check_chunk(jobs, golden_dir, diff_dir, encoder, tolerance):
+    results = []
+    for fixture, card, i, total in jobs:
+        path = _card_path(golden_dir, fixture, i)
+        if not os.path.exists(path):
+            results.append({'status': 'new'})
+            continue
+        with Image.open(path) as img:
+            golden = np.asarray(img.convert('RGB'))
+        current = render(card, i, total, encoder)
+        result, diff = compare(golden, current, tolerance)
+        if 'size' in result:
+            result['status'] = 'size'
+        elif result['cell'] > tolerance:
+            result['status'] = 'changed'
+            result['heatmap'] = _card_path(diff_dir, fixture, i)
+            Path(os.path.dirname(result['heatmap'])).mkdir(parents=True, exist_ok=True)
+            heatmap(golden, current, diff).save(result['heatmap'])
+        else:
+            result['status'] = 'ok'
+        results.append(result)
+    return results
+
+def run_cards(pool, workers, layouts, chunk_fn, *args):
+    """Run `chunk_fn` over every card of `layouts`, in chunks across `pool`.
+
+    Returns {fixture: [result per card]}.
+    """
+    jobs = [(name, card, i, len(cards)) for name, cards in layouts.items() for i, card in enumerate(cards)]
+    size = max(1, min(16, len(jobs) // (workers * 4)))
+    chunks = [jobs[i:i + size] for i in range(0, len(jobs), size)]
+    results = {name: [] for name in layouts}
+    for chunk, chunk_results in zip(chunks, pool.map(chunk_fn, chunks, *[[a] * len(chunks) for a in args])):
+        for (name, *_), result in zip(chunk, chunk_results):
+            results[name].append(result)
+    return results
+
+def _removed(golden_dir, fixture, count):
+    """Golden cards of `fixture` past the current `count` (the post got shorter)"""
+    folder = os.path.join(golden_dir, fixture)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(name for name in os.listdir(folder)
+                  if GOLDEN_RE.match(name) and int(GOLDEN_RE.match(name).group(1)) > count)
+
+def report(results, golden_dir, info):
+    """Print changed cards per fixture; returns the number of failures"""
+    failures = 0
+    for fixture, cards in results.items():
+        bad = [(i, r) for i, r in enumerate(cards) if r['status'] != 'ok']
+        removed = _removed(golden_dir, fixture, len(cards))
+        expected = info['fixtures'].get(fixture)
+        worst = max((r.get('cell', 0) for r in cards), default=0)
+        failures += len(bad) + len(removed)
+        count = f"{len(cards)} cards" + (f" (golden: {expected})" if expected != len(cards) else '')
+        print(f"{'❌' if bad or removed else '✅'} {fixture}: {count}, worst cell {worst:.1f}")
+        for i, r in bad:
+            if r['status'] == 'new':
+                print(f"     {i + 1:03d} - no golden card")
+            elif r['status'] == 'size':
+                print(f"     {i + 1:03d} - size changed from {r['size'][0]}x{r['size'][1]}")
+            else:
+                print(f"     {i + 1:03d} - cell {r['cell']:.1f} at {tuple(r['at'])}, "
+                      f"{r['over']} cells over → {r['heatmap']}")
+        for name in removed:
+            print(f"     {name[:3]} - golden card no longer produced")
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare rendered cards against stored golden images.")
+    parser.add_argument('--update', action='store_true',
+                        help="render the corpus and store it as the new golden set")
+    parser.add_argument('--golden', default='golden', metavar='DIR',
+                        help="golden set folder (default: golden)")
+    parser.add_argument('--diff-dir', default='golden-diff', metavar='DIR',
+                        help="heatmaps of changed cards go here (default: golden-diff)")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help=f"luma difference (0-255) of the worst {CELL}x{CELL} cell that still passes; "
+                             f"0 = exact (default: {TOLERANCE:g})")
+    parser.add_argument('--format', choices=['jpeg', 'png', 'webp', 'avif'], default=None,
+                        help="encode each card and compare it as decoded (default: compare drawn pixels)")
+    parser.add_argument('--quality', type=int, default=None, help="lossy quality for --format")
+    parser.add_argument('--font', metavar='PATH', help="with --update: draw with this font file")
+    parser.add_argument('--font-index', type=int, default=0, metavar='N', help="face index in --font")
+    parser.add_argument('--only', metavar='TEXT', help="only fixtures whose name contains TEXT")
+    parser.add_argument('--no-blog', action='store_true', help="skip the real blog/ posts")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    info_path = os.path.join(args.golden, GOLDEN_INFO)
+    info = None
+    if not args.update:
+        if not os.path.exists(info_path):
+            print(f"❌ No golden set in {args.golden}/ (create one with --update)")
+            sys.exit(2)
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+
+    # The golden set pins its font: checks draw with the same file, by hash
+    font = (args.font, args.font_index) if args.font else None
+    if info and info['font']:
+        font = (info['font']['path'], info['font']['index'])
+    if font:
+        if not os.path.exists(font[0]):
+            print(f"❌ Font not found: {font[0]}")
+            sys.exit(2)
+        generate.configure_font(*font)
+    pinned = font_info()
+    if info and info['font'] != pinned:
+        print(f"❌ The golden set was drawn with {info['font']}, this machine has {pinned}. "
+              f"Re-create it with --update.")
+        sys.exit(2)
+    if info and (info['pillow'], info['freetype']) != (PIL.__version__, features.version('freetype2')):
+        print(f"⚠️  Golden set from Pillow {info['pillow']} / FreeType {info['freetype']}; "
+              f"text antialiasing may differ slightly")
+
+    encoder = None
+    if args.format:
+        if args.update:
+            print("❌ --format is for checks; the golden set stores drawn pixels")
+            sys.exit(2)
+        encoder = generate.encoder_options(format=args.format, quality=args.quality)
+
+    workers = args.workers or os.cpu_count() or 1
+    started = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp, \
+            ProcessPoolExecutor(max_workers=workers, initializer=generate._init_worker,
+                                initargs=(font,)) as pool:
+        fixtures = benchmark.write_synthetic_fixtures(tmp)
+        fixtures.update(write_golden_fixtures(tmp))
+        if not args.no_blog:
+            fixtures.update(benchmark.blog_fixtures())
+        if args.only:
+            fixtures = {k: v for k, v in fixtures.items() if args.only in k}
+        if not fixtures:
+            print("❌ No fixtures to render")
+            sys.exit(2)
+        layouts = dict(zip(fixtures, pool.map(_layout_fixture, fixtures.values())))
+        total = sum(len(cards) for cards in layouts.values())
+        print(f"📊 {len(fixtures)} fixtures, {total} cards, {workers} workers")
+        print(f"{'─' * 40}")
+
+        if args.update:
+            for name in layouts:
+                shutil.rmtree(os.path.join(args.golden, name), ignore_errors=True)
+            run_cards(pool, workers, layouts, _update_chunk, args.golden)
+            previous = {}
+            if os.path.exists(info_path):
+                with open(info_path, 'r', encoding='utf-8') as f:
+                    previous = json.load(f)['fixtures']
+            info = {
+                'font': pinned,
+                'pillow': PIL.__version__,
+                'freetype': features.version('freetype2'),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'fixtures': {**previous, **{name: len(cards) for name, cards in layouts.items()}},
+            }
+            with open(info_path, 'w', encoding='utf-8') as f:
+                json.dump(info, f, ensure_ascii=False, indent=1)
+            elapsed = time.perf_counter() - started
+            print(f"💾 {total} golden cards → {args.golden}/ in {elapsed:.2f} s")
+            return
+
+        for name in layouts:
+            shutil.rmtree(os.path.join(args.diff_dir, name), ignore_errors=True)
+        results = run_cards(pool, workers, layouts, _check_chunk, args.golden, args.diff_dir,
+                            encoder, args.tolerance)
+    failures = report(results, args.golden, info)
+    elapsed = time.perf_counter() - started
+    print(f"{'─' * 40}")
+    print(f"⏱️  {total} cards in {elapsed:.2f} s ({elapsed / total * 1000:.1f} ms per card)")
+    if failures:
+        print(f"\n❌ {failures} cards differ from {args.golden}/ (heatmaps in {args.diff_dir}/)")
+        sys.exit(1)
+    print(f"\n✨ All cards match {args.golden}/")
+
+if __name__ == '__main__':
+    main()
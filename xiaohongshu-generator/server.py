@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+小红书图文生成器 - Render server
+Keeps fonts, scheme templates, decoded images and post layouts warm in one
+long-running process, so editors can preview cards as they write.
+
+    python server.py                        # http://127.0.0.1:8765
+    python server.py --socket /tmp/xhs.sock -j 4
+
+    POST /render   {"path": "../blog/2025/llm/index.html"}
+                   {"html": "<html>...", "base_path": "..", "format": "webp"}
+                   add "card": N to get that card's image bytes instead of JSON,
+                   "size": "portrait" or [1080, 1440] for another canvas
+    GET  /stats    queue depth, cache sizes and latency percentiles
+    GET  /health
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import base64
+import hashlib
+import argparse
+import importlib.util
+import threading
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+
+from PIL import features
+
+import generate
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_SIZE = 32
+REQUEST_TIMEOUT = 30         # seconds a request may wait for its render
+MAX_BODY_BYTES = 16 * 1024 * 1024
+LAYOUT_CACHE_SIZE = 32       # parsed posts (and their layouts per size) kept for repeated previews
+LATENCY_WINDOW = 1000        # recent requests the percentiles are taken over
+ENCODER_FIELDS = ['format', 'quality', 'max_bytes', 'optimize', 'progressive', 'subsampling']
+PARSERS = ['lxml', 'html.parser', 'html5lib', generate.STREAM_PARSER]
+SUBSAMPLINGS = ['4:4:4', '4:2:2', '4:2:0']
+
+WARMUP_HTML = ('<html><body><h1 class="post-title">Warm up</h1><hr>'
+               '<h2>Warm up</h2><p>Fonts, templates and encoders. 预热字体与模板。</p>'
+               '<h2>A title long enough to wrap onto a second line of the card header</h2>'
+               '<ul><li>Bullet</li></ul></body></html>')
+
+class RenderError(Exception):
+    """A bad render request; carries the HTTP status to answer with"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Parsed posts keyed by their inputs, each with its layouts per card size, so
+# previewing card after card (or size after size) of the same draft parses it
+# once. An entry is reused only while the image files it references are
+# unchanged.
+_layout_lock = threading.Lock()
+_layout_cache = OrderedDict()
+
+def _image_signatures(sections):
+    return [generate.file_signature(c) for section in sections
+            for t, c in section['content_items'] if t == 'image']
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def validate_request(job):
+    """Check the types and ranges of a request's fields before any work, so
+    a bad value is answered with 400 instead of failing mid-render"""
+    for field in ('path', 'html', 'base_path', 'format', 'parser', 'subsampling'):
+        if job.get(field) is not None and not isinstance(job[field], str):
+            raise RenderError(400, f"'{field}' must be a string")
+    for field in ('fetch_remote', 'optimize', 'progressive'):
+        if job.get(field) is not None and not isinstance(job[field], bool):
+            raise RenderError(400, f"'{field}' must be true or false")
+    parser = job.get('parser')
+    if parser is not None:
+        if parser not in PARSERS:
+            raise RenderError(400, f"Unknown parser: {parser} (one of {', '.join(PARSERS)})")
+        if parser in ('lxml', 'html5lib') and not importlib.util.find_spec(parser):
+            raise RenderError(400, f"Parser {parser} is not installed")
+    if job.get('subsampling') is not None and job['subsampling'] not in SUBSAMPLINGS:
+        raise RenderError(400, f"Subsampling must be one of {', '.join(SUBSAMPLINGS)}")
+    quality = job.get('quality')
+    if quality is not None and not (_is_int(quality) and 1 <= quality <= 100):
+        raise RenderError(400, "'quality' must be an integer from 1 to 100")
+    max_bytes = job.get('max_bytes')
+    if max_bytes is not None and not (_is_int(max_bytes) and max_bytes > 0):
+        raise RenderError(400, "'max_bytes' must be a positive integer")
+    if job.get('card') is not None and not _is_int(job['card']):
+        raise RenderError(400, "'card' must be an integer")
+
+def request_size(job):
+    """Card canvas of a request, (width, height); square by default"""
+    size = job.get('size') or 'square'
+    if isinstance(size, str):
+        try:
+            size, = generate.parse_card_sizes(size).values()
+        except (argparse.ArgumentTypeError, ValueError):
+            raise RenderError(400, f"Unknown size: {size}")
+    elif not (isinstance(size, list) and len(size) == 2 and all(isinstance(n, int) for n in size)
+              and all(generate.MIN_CARD_SIDE <= n <= generate.MAX_CARD_SIDE for n in size)):
+        raise RenderError(400, f"Size must be [width, height], {generate.MIN_CARD_SIDE} to "
+                               f"{generate.MAX_CARD_SIDE} px")
+    return tuple(size)
+
+def layout_post(job):
+    """Cards for a request's post, from the layout cache when possible"""
+    parser = job.get('parser')
+    size = request_size(job)
+    if job.get('path') is not None:
+        path = os.path.abspath(job['path'])
+        signature = generate.file_signature(path)
+        if signature is None:
+            raise RenderError(404, f"File not found: {job['path']}")
+        key = ('path', tuple(signature), parser)
+    elif job.get('html') is not None:
+        digest = hashlib.sha256(job['html'].encode('utf-8')).hexdigest()
+        key = ('html', digest, job.get('base_path'), bool(job.get('fetch_remote')), parser)
+    else:
+        raise RenderError(400, "Request needs 'html' or 'path'")
+
+    with _layout_lock:
+        entry = _layout_cache.get(key)
+        if entry is not None:
+            _layout_cache.move_to_end(key)
+    if entry is None or _image_signatures(entry[0]) != entry[1]:
+        if job.get('path') is not None:
+            sections = generate.parse_html(path, parser=parser)
+        else:
+            sections = generate.parse_html_string(job['html'], job.get('base_path'), parser=parser,
+                                                  fetch_remote=bool(job.get('fetch_remote')))
+        entry = (sections, _image_signatures(sections), {})
+        with _layout_lock:
+            _layout_cache[key] = entry
+            while len(_layout_cache) > LAYOUT_CACHE_SIZE:
+                _layout_cache.popitem(last=False)
+
+    sections, _, layouts = entry
+    cards = layouts.get(size)
+    if cards is None:
+        cards = layouts.setdefault(size, generate.layout_cards(sections, size))
+    return cards
+
+def request_encoder(job):
+    """Encoder options of a request, validated"""
+    encoder = generate.encoder_options(**{k: job.get(k) for k in ENCODER_FIELDS})
+    fmt = encoder['format']
+    if fmt not in ('jpeg', 'png', 'webp', 'avif', 'auto'):
+        raise RenderError(400, f"Unknown format: {fmt}")
+    if fmt in ('webp', 'avif') and not features.check(fmt):
+        raise RenderError(400, f"This Pillow build cannot write {fmt.upper()}")
+    return encoder
+
+def _card_result(card, index, total, encoder):
+    img = generate.render_card(card, index, total)
+    fmt = generate.card_format(card, encoder)
+    return {
+        'data': generate.encode_card(img, fmt, encoder),
+        'format': fmt,
+        'mime_type': f"image/{fmt}",
+        'filename': generate.card_filename(card, index, encoder),
+        'index': index,
+        'total': total,
+        'title': card['title'],
+        'scheme': generate.COLOR_SCHEMES[index % len(generate.COLOR_SCHEMES)]['name'],
+        'size': card['size'],
+        'title_lines': card['title_lines'],
+        'blocks': card['blocks'],
+    }
+
+def render_job(job):
+    """Run one render request; returns (content type, body, extra headers)"""
+    validate_request(job)
+    encoder = request_encoder(job)
+    cards = layout_post(job)
+    if not cards:
+        raise RenderError(422, "No H2/H3 headings found")
+
+    if job.get('card') is not None:
+        index = job['card']
+        if not 0 <= index < len(cards):
+            raise RenderError(404, f"No card {index}; the post has {len(cards)} cards")
+        result = _card_result(cards[index], index, len(cards), encoder)
+        headers = {'X-Card-Index': index, 'X-Card-Total': len(cards),
+                   'Content-Disposition': f"inline; filename=\"{result['filename']}\""}
+        return result['mime_type'], result['data'], headers
+
+    results = []
+    for i, card in enumerate(cards):
+        result = _card_result(card, i, len(cards), encoder)
+        result['data'] = base64.b64encode(result['data']).decode('ascii')
+        results.append(result)
+    body = json.dumps({'cards': results}, ensure_ascii=False).encode('utf-8')
+    return 'application/json', body, {}
+
+def percentiles(values):
+    """p50/p90/p99/max of `values` (nearest rank), in milliseconds"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+    return {'p50': round(pick(0.50), 2), 'p90': round(pick(0.90), 2),
+            'p99': round(pick(0.99), 2), 'max': round(ordered[-1], 2)}
+
+class Job:
+    def __init__(self, request):
+        self.request = request
+        self.queued = time.perf_counter()
+        self.started = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+class RenderPool:
+    """Fixed worker threads fed from a bounded queue.
+
+    Requests beyond the queue's capacity are refused right away rather than
+    piling up, so a burst of previews can't push latency past usefulness.
+    """
+    def __init__(self, workers=DEFAULT_WORKERS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.latency = deque(maxlen=LATENCY_WINDOW)
+        self.wait = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"render-{i}", daemon=True).start()
+
+    def submit(self, request):
+        """Queue a request; returns its Job, or None if the queue is full"""
+        job = Job(request)
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return None
+        return job
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            job.started = time.perf_counter()
+            with self.lock:
+                self.busy += 1
+            try:
+                job.result = render_job(job.request)
+            except Exception as e:
+                job.error = e
+            finished = time.perf_counter()
+            with self.lock:
+                self.busy -= 1
+                if job.error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.latency.append((finished - job.queued) * 1000)
+                self.wait.append((job.started - job.queued) * 1000)
+            job.done.set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'workers': self.workers,
+                'busy': self.busy,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'latency_ms': percentiles(self.latency),
+                'queue_wait_ms': percentiles(self.wait),
+                'uptime_s': round(time.time() - self.started, 1),
+                'cache': {
+                    'layouts': len(_layout_cache),
+                    'templates': len(generate._template_cache),
+                    'images': len(generate._image_cache),
+                    'image_bytes': generate._image_cache_bytes[0],
+                    'source_bytes': generate._source_cache_bytes[0],
+                },
+            }
+
+class RenderHandler(BaseHTTPRequestHandler):
+    server_version = 'xiaohongshu-generator'
+    protocol_version = 'HTTP/1.1'   # keep-alive between previews
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self._send(status, 'application/json', body, headers)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'ok': True})
+        elif self.path == '/stats':
+            self._send_json(200, self.server.pool.stats())
+        else:
+            self._send_json(404, {'error': f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self._send_json(404, {'error': f"Unknown path: {self.path}"})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # The body's end is unknown, so the connection can't be reused
+            self.close_connection = True
+            self._send_json(400, {'error': "Invalid Content-Length"})
+            return
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_json(413, {'error': f"Request body over {MAX_BODY_BYTES} bytes"})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError as e:
+            self._send_json(400, {'error': f"Invalid JSON: {e}"})
+            return
+        if not isinstance(request, dict):
+            self._send_json(400, {'error': "Request must be a JSON object"})
+            return
+
+        job = self.server.pool.submit(request)
+        if job is None:
+            self._send_json(503, {'error': "Render queue is full"}, {'Retry-After': 1})
+            return
+        if not job.done.wait(REQUEST_TIMEOUT):
+            self._send_json(504, {'error': f"Render took over {REQUEST_TIMEOUT}s"})
+            return
+
+        elapsed = f"{(time.perf_counter() - job.queued) * 1000:.1f}"
+        if isinstance(job.error, RenderError):
+            self._send_json(job.error.status, {'error': str(job.error)})
+        elif job.error is not None:
+            self._send_json(500, {'error': f"{type(job.error).__name__}: {job.error}"})
+        else:
+            content_type, body, headers = job.result
+            self._send(200, content_type, body, dict(headers, **{'X-Render-Ms': elapsed}))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            print(f"🌐 {format % args}")
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+def warm_up():
+    """Load fonts, build every scheme template and prime the encoders"""
+    started = time.perf_counter()
+    for size in (generate.TITLE_FONT_SIZE, generate.BODY_FONT_SIZE, generate.LABEL_FONT_SIZE):
+        generate.get_font(size)
+    for lines in range(1, generate.TITLE_MAX_LINES + 1):
+        underline_y = generate.PADDING + 80 + lines * generate.TITLE_LINE_HEIGHT + 20
+        for i in range(len(generate.COLOR_SCHEMES)):
+            generate.card_template(i, underline_y)
+    for _ in generate.render_post(WARMUP_HTML):
+        pass
+    return time.perf_counter() - started
+
+def make_server(pool, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None, verbose=False):
+    """An HTTP server on host:port, or on a Unix socket when socket_path is set"""
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, RenderHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RenderHandler)
+    server.pool = pool
+    server.verbose = verbose
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve card renders from a warm process.")
+    parser.add_argument('--host', default=DEFAULT_HOST, help=f"bind address (default: {DEFAULT_HOST})")
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT,
+                        help=f"TCP port (default: {DEFAULT_PORT})")
+    parser.add_argument('--socket', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('-j', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"render threads (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help=f"requests waiting beyond which new ones get 503 (default: {DEFAULT_QUEUE_SIZE})")
+    parser.add_argument('--font', metavar='PATH',
+                        help="font file to draw with (default: search system fonts; env XHS_FONT)")
+    parser.add_argument('--font-index', type=int, default=0, metavar='N',
+                        help="face index inside a .ttc font collection (default: 0)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="log every request")
+    args = parser.parse_args()
+
+    if args.font:
+        if not os.path.exists(args.font):
+            print(f"❌ Font not found: {args.font}")
+            sys.exit(1)
+        generate.configure_font(args.font, args.font_index)
+
+    print(f"🔥 Warmed up in {warm_up() * 1000:.0f} ms (font: {generate.resolve_font()})")
+    pool = RenderPool(args.workers, args.queue_size)
+    try:
+        server = make_server(pool, args.host, args.port, args.socket, args.verbose)
+    except OSError as e:
+        print(f"❌ Cannot listen: {e}")
+        sys.exit(1)
+    where = args.socket or f"http://{args.host}:{server.server_address[1]}"
+    print(f"🚀 Serving on {where} ({args.workers} workers, queue {args.queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Stopped")
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+小红书图文生成器 - Tests
+Regression tests for generate.py; standard library unittest, no extra packages.
+
+    python -m unittest -v          # or: python -m pytest -q
+"""
+
+import io
+import argparse
+import os
+import json
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+import generate
+
+class TempDirTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def image(self, name, size):
+        path = os.path.join(self.tmp, name)
+        Image.new('RGB', size, (200, 80, 40)).save(path)
+        return path
+
+class LayoutTest(TempDirTestCase):
+    def test_focus_image_near_page_bottom_moves_to_next_page(self):
+        # An image-focused section (little text) with two tall images: the
+        # first fills most of the page, so the second must start a new card
+        # at full height instead of shrinking into the space left.
+        images = [self.image(f"{i}.png", (1000, 1000)) for i in range(2)]
+        for size in generate.CARD_SIZES.values():
+            cards = generate.layout_cards([{'title': 'Figures',
+                                            'content_items': [('image', p) for p in images]}], size)
+            blocks = [b for card in cards for b in card['blocks']]
+            self.assertEqual(len(cards), 2)
+            focus_max = generate.IMAGE_FOCUS_MAX_HEIGHT + size[1] - generate.CARD_SIZE
+            content_bottom = size[1] - (generate.CARD_SIZE - generate.CONTENT_BOTTOM)
+            for block in blocks:
+                self.assertGreaterEqual(block['height'], focus_max * generate.IMAGE_FOCUS_MIN_SHARE)
+                self.assertLessEqual(block['y'] + block['height'], content_bottom)
+
+    def test_focus_image_shrinks_into_a_fair_amount_of_room(self):
+        # A short line of text leaves most of the page: the image stays on it
+        path = self.image('wide.png', (1600, 1000))
+        cards = generate.layout_cards([{'title': 'Figure', 'content_items': [
+            ('text', 'Caption. ' * 3), ('image', path)]}])
+        self.assertEqual(len(cards), 1)
+
+class ImageCacheTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        for name in ('_image_cache', '_source_cache'):
+            patcher = mock.patch.object(generate, name, type(getattr(generate, name))())
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for name in ('_image_cache_bytes', '_source_cache_bytes'):
+            patcher = mock.patch.object(generate, name, [0])
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_sources_have_their_own_small_cap(self):
+        # Four 3 MB sources against a 4 MB source cap: the resized copies all
+        # stay, the sources don't pile up in the (much larger) image budget
+        paths = [self.image(f"{i}.png", (1000, 1000)) for i in range(4)]
+        with mock.patch.object(generate, 'IMAGE_SOURCE_CACHE_MAX_BYTES', 4 * 1024 * 1024):
+            for path in paths:
+                generate.load_image(path, (100, 100))
+            generate.load_image(paths[-1], (200, 200))  # same source, other size
+        self.assertEqual(len(generate._image_cache), 5)
+        self.assertEqual(len(generate._source_cache), 1)
+        self.assertEqual(generate._source_cache_bytes[0], 1000 * 1000 * 3)
+
+class SaveTest(TempDirTestCase):
+    def test_saved_files_get_the_umask_mode(self):
+        # Like open(): 0666 minus the umask, not mkstemp's 0600
+        umask = os.umask(0o022)
+        os.umask(umask)
+        path = os.path.join(self.tmp, 'out', '1_card.jpg')
+        generate.save_card(Image.new('RGB', (64, 64), 'white'), path)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~umask)
+        with mock.patch.object(generate, '_UMASK', 0o077):
+            generate.save_card(Image.new('RGB', (64, 64), 'white'), path)
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+
+    def test_budget_never_raises_a_low_quality(self):
+        # An unreachable budget at --quality 20 keeps quality 20, not MIN_QUALITY
+        img = Image.frombytes('RGB', (256, 256), os.urandom(256 * 256 * 3))
+        encoder = {**generate.ENCODER_DEFAULTS, 'quality': 20}
+        plain = generate.encode_card(img, 'jpeg', encoder)
+        with mock.patch('sys.stdout', io.StringIO()):
+            budgeted = generate.encode_card(img, 'jpeg', {**encoder, 'max_bytes': 1000})
+        self.assertEqual(budgeted, plain)
+
+    def test_quality_is_range_checked(self):
+        self.assertEqual(generate.parse_quality('85'), 85)
+        for text in ('0', '101', '250', 'high'):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                generate.parse_quality(text)
+
+class BatchTest(TempDirTestCase):
+    def write(self, name, html='<h2>Intro</h2><p>Hello.</p>'):
+        path = os.path.join(self.tmp, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(html)
+        return path
+
+    def test_every_input_gets_its_own_folder(self):
+        # Two files in one folder, and same-named post folders under two years
+        posts = [self.write('posts/a.html'), self.write('posts/b.html'),
+                 self.write('blog/2024/llm/index.html'), self.write('blog/2025/llm/index.html'),
+                 self.write('blog/2025/rag/index.html')]
+        out = os.path.join(self.tmp, 'out')
+        dirs = generate.post_output_dirs(posts, out)
+        self.assertEqual([os.path.relpath(dirs[p], out) for p in posts],
+                         ['posts-a', 'posts-b', '2024-llm', '2025-llm', 'rag'])
+        with mock.patch('sys.stdout', io.StringIO()):
+            self.assertEqual(generate.run_batch(posts, out, workers=1), 0)
+        for name in ('posts-a', 'posts-b', '2024-llm', '2025-llm', 'rag'):
+            self.assertTrue(os.path.exists(os.path.join(out, name, generate.MANIFEST_NAME)), name)
+
+    def test_force_still_removes_stale_cards(self):
+        post = self.write('blog/llm/index.html')
+        out = os.path.join(self.tmp, 'out')
+        with mock.patch('sys.stdout', io.StringIO()):
+            generate.run_batch([post], out, workers=1)
+            self.write('blog/llm/index.html', '<h2>Renamed</h2><p>Hello.</p>')
+            generate.run_batch([post], out, workers=1, force=True)
+        self.assertEqual(sorted(os.listdir(os.path.join(out, 'llm'))),
+                         [generate.MANIFEST_NAME, '1_Renamed.jpg'])
+
+    def test_inputs_sharing_a_folder_are_rejected(self):
+        post = self.write('posts/a.html')
+        with self.assertRaises(ValueError):
+            generate.post_output_dirs([post, os.path.join(self.tmp, 'posts', '..', 'posts', 'a.html')],
+                                      os.path.join(self.tmp, 'out'))
+
+class WatchTest(TempDirTestCase):
+    def test_save_during_a_rebuild_is_seen(self):
+        # The snapshot is taken before the rebuild reads the file, so a save
+        # made before wait() is called still counts as a change
+        path = os.path.join(self.tmp, 'index.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<h2>One</h2>')
+        for poll in (False, True):
+            watcher = generate.FileWatcher(debounce=0.01, poll_interval=0.01, poll=poll)
+            before = watcher.snapshot([path])
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('<p>Saved mid-build.</p>')
+            self.assertEqual(watcher.wait(before), {path}, watcher.method)
+
+class DedupTest(TempDirTestCase):
+    ABOUT = '<h2>About me</h2><p>I write about open source infrastructure here.</p>'
+
+    def post(self, name, before, after=0):
+        sections = [f'<h2>{name} {i}</h2><p>Body {i}.</p>' for i in range(before)] + [self.ABOUT]
+        sections += [f'<h2>Tail {i}</h2><p>More.</p>' for i in range(after)]
+        path = os.path.join(self.tmp, 'blog', name, 'index.html')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<html><body>' + ''.join(sections) + '</body></html>')
+        return path
+
+    def test_same_section_with_another_badge_shares_the_body(self):
+        # "About me" is card 2/2 in one post and 2/3 in the other: same color
+        # scheme, different badge. One body is stored, and both files match
+        # what a run without --dedup writes.
+        posts = [self.post('a', 1), self.post('b', 1, 1)]
+        out, plain = os.path.join(self.tmp, 'out'), os.path.join(self.tmp, 'plain')
+        with mock.patch('sys.stdout', io.StringIO()):
+            self.assertEqual(generate.run_batch(posts, out, workers=1, dedup=True), 0)
+            self.assertEqual(generate.run_batch(posts, plain, workers=1), 0)
+        with open(os.path.join(out, generate.SITE_INDEX_NAME), encoding='utf-8') as f:
+            cards = json.load(f)['cards']
+        about, = [card for card in cards.values() if card['title'] == 'About me']
+        self.assertEqual(list(about['assets'].values()), [['a/2_About_me.jpg', 'b/2_About_me.jpg']])
+        for name in ('a/2_About_me.jpg', 'b/2_About_me.jpg', 'b/3_Tail_0.jpg'):
+            with open(os.path.join(out, name), 'rb') as f, open(os.path.join(plain, name), 'rb') as g:
+                self.assertEqual(f.read(), g.read(), name)
+
+    def test_skipped_cards_list_no_stored_body(self):
+        # Cards already up to date draw nothing, so nothing is in the store
+        posts = [self.post('a', 1), self.post('b', 1, 1)]
+        out = os.path.join(self.tmp, 'out')
+        with mock.patch('sys.stdout', io.StringIO()):
+            generate.run_batch(posts, out, workers=1)
+            generate.run_batch(posts, out, workers=1, dedup=True)
+        with open(os.path.join(out, generate.SITE_INDEX_NAME), encoding='utf-8') as f:
+            cards = json.load(f)['cards']
+        about, = [card for card in cards.values() if card['title'] == 'About me']
+        self.assertEqual(about['files'], ['a/2_About_me.jpg', 'b/2_About_me.jpg'])
+        self.assertEqual([card['assets'] for card in cards.values()], [{}] * len(cards))
+
+class StreamParserTest(TempDirTestCase):
+    NESTED = [
+        '<h2>A</h2><p>one</p><ul><li><h3>In a list</h3><p>two</p></li></ul><p>three</p>',
+        '<h2>Outer <h3>inner</h3> rest</h2><p>one</p><h2>B</h2><p>two</p>',
+        '<div><h2>A</h2><p>one</p><table><tr><td><h2>cell</h2><p>two</p></td></tr></table></div>',
+        '<h2>A</h2><p>one</p><h3>never closed<p>two</p><h2>B</h2><p>three</p>',
+    ]
+
+    def test_nested_headings_match_the_tree_parse(self):
+        for body in self.NESTED:
+            html = f'<html><body><div id="markdown-content">{body}</div></body></html>'
+            stream = generate.SectionStream()
+            stream.feed(html)
+            stream.close()
+            self.assertTrue(stream.nested, body)
+            self.assertEqual(generate.parse_html_string(html, parser=generate.STREAM_PARSER),
+                             generate.parse_html_string(html, parser='html.parser'), body)
+
+    def test_cards_before_the_nesting_are_streamed(self):
+        # Sections that end before the nested heading come out as they are
+        # read; the rest from the tree parse, without repeats
+        flat = ''.join(f'<h2>S{i}</h2><p>text</p>' for i in range(20))
+        html = f'<html><body><div id="markdown-content">{flat}</div>{self.NESTED[0]}</body></html>'
+        stream = generate.SectionStream()
+        early = stream.feed(html[:html.index('<ul>')])
+        self.assertEqual(len(early), 20)
+        self.assertEqual(stream.feed(html[html.index('<ul>'):]) + stream.close(), [])
+        self.assertTrue(stream.nested)
+        self.assertEqual(early + stream.fallback(html),
+                         generate.parse_html_string(html, parser='html.parser'))
+
+class ImageServer:
+    """A local HTTP server with one image (ETag and Last-Modified validators),
+    a missing path and a failing one. Records every request it gets."""
+    LAST_MODIFIED = 'Wed, 01 Jan 2025 00:00:00 GMT'
+
+    def __init__(self):
+        self.body = self.png((8, 8))
+        self.etag = '"v1"'
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                if self.path == '/missing.png':
+                    self.send_error(404)
+                elif self.path == '/broken.png':
+                    self.send_error(500)
+                elif self.headers.get('If-None-Match') == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'image/png')
+                    self.send_header('Content-Length', str(len(server.body)))
+                    self.send_header('ETag', server.etag)
+                    self.send_header('Last-Modified', server.LAST_MODIFIED)
+                    self.end_headers()
+                    self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def png(size):
+        buf = io.BytesIO()
+        Image.new('RGB', size, (10, 120, 200)).save(buf, 'PNG')
+        return buf.getvalue()
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+class FetchTest(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = ImageServer()
+        self.addCleanup(self.server.close)
+        self.cache = os.path.join(self.tmp, 'cache')
+        retries = mock.patch.object(generate, 'FETCH_RETRIES', 0)
+        retries.start()
+        self.addCleanup(retries.stop)
+
+    def expire(self, url):
+        """Make the cached record of `url` due for revalidation"""
+        path = generate._url_entry_path(url, self.cache)
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+        entry['checked'] = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+
+    def test_download_then_cache_hit(self):
+        url = self.server.url('/a.png')
+        path = generate.fetch_image(url, self.cache)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.server.body)
+        self.assertEqual(generate.fetch_image(url, self.cache), path)
+        self.assertEqual(len(self.server.requests), 1)  # fresh entry: no request at all
+
+    def test_revalidation_304_keeps_the_cached_copy(self):
+        url = self.server.url('/a.png')
+        path = generate.fetch_image(url, self.cache)
+        self.expire(url)
+        self.assertEqual(generate.fetch_image(url, self.cache), path)
+        _, headers = self.server.requests[-1]
+        self.assertEqual(headers.get('If-None-Match'), '"v1"')
+        self.assertEqual(headers.get('If-Modified-Since'), ImageServer.LAST_MODIFIED)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(generate.fetch_image(url, self.cache), path)  # checked again just now
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_revalidation_picks_up_a_changed_image(self):
+        url = self.server.url('/a.png')
+        old = generate.fetch_image(url, self.cache)
+        self.server.body, self.server.etag = ImageServer.png((16, 16)), '"v2"'
+        self.expire(url)
+        new = generate.fetch_image(url, self.cache)
+        self.assertNotEqual(new, old)
+        with open(new, 'rb') as f:
+            self.assertEqual(f.read(), self.server.body)
+
+    def test_errors(self):
+        with self.assertRaises(OSError):
+            generate.fetch_image(self.server.url('/missing.png'), self.cache)
+        paths = generate.fetch_images([self.server.url('/broken.png'), self.server.url('/a.png')], self.cache)
+        self.assertIsNone(paths[self.server.url('/broken.png')])
+        self.assertTrue(os.path.exists(paths[self.server.url('/a.png')]))
+        self.assertFalse(any(name.startswith('.tmp-') for _, _, files in os.walk(self.cache) for name in files))
+
+    def test_origin_error_falls_back_to_the_cached_copy(self):
+        url = self.server.url('/a.png')
+        path = generate.fetch_image(url, self.cache)
+        self.expire(url)
+        self.server.close()  # offline
+        self.assertEqual(generate.fetch_image(url, self.cache), path)
+
+    def test_parse_html_fetches_remote_images_into_the_cache(self):
+        url = self.server.url('/a.png')
+        html_file = os.path.join(self.tmp, 'post', 'index.html')
+        os.makedirs(os.path.dirname(html_file))
+        with open(html_file, 'w', encoding='utf-8') as f:
+            f.write(f'<h2>Figure</h2><p>Caption</p><img src="{url}">')
+        output_dir = os.path.join(self.tmp, 'output')
+        sections = generate.parse_html(html_file, output_dir, cache_dir=self.cache)
+        images = [c for t, c in sections[0]['content_items'] if t == 'image']
+        self.assertEqual(len(images), 1)
+        self.assertTrue(images[0].startswith(self.cache))
+        self.assertFalse(os.path.exists(output_dir))  # legacy positional output_dir is not the cache
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+小红书图文生成器 - Server tests
+Request validation in server.py, through render_job() and over HTTP.
+
+    python -m unittest -v          # or: python -m pytest -q
+"""
+
+import json
+import threading
+import unittest
+import http.client
+
+import server
+
+HTML = '<h2>Draft</h2><p>A paragraph.</p>'
+
+class ValidationTest(unittest.TestCase):
+    def assertBadRequest(self, job, message):
+        with self.assertRaises(server.RenderError) as raised:
+            server.render_job(job)
+        self.assertEqual(raised.exception.status, 400)
+        self.assertIn(message, str(raised.exception))
+
+    def test_types(self):
+        self.assertBadRequest({'html': 42}, "'html' must be a string")
+        self.assertBadRequest({'html': ['<h2>x</h2>']}, "'html' must be a string")
+        self.assertBadRequest({'path': {'a': 1}}, "'path' must be a string")
+        self.assertBadRequest({'html': HTML, 'base_path': 1}, "'base_path' must be a string")
+        self.assertBadRequest({'html': HTML, 'fetch_remote': 'yes'}, "'fetch_remote' must be true or false")
+        self.assertBadRequest({'html': HTML, 'optimize': 1}, "'optimize' must be true or false")
+        self.assertBadRequest({'html': HTML, 'card': '0'}, "'card' must be an integer")
+
+    def test_quality_and_max_bytes(self):
+        for quality in (0, 101, -5, 90.5, '90', True):
+            self.assertBadRequest({'html': HTML, 'quality': quality}, "'quality'")
+        for max_bytes in (0, -1, 1.5, '300k', False):
+            self.assertBadRequest({'html': HTML, 'max_bytes': max_bytes}, "'max_bytes'")
+
+    def test_parser_and_subsampling(self):
+        self.assertBadRequest({'html': HTML, 'parser': 'regex'}, "Unknown parser")
+        self.assertBadRequest({'html': HTML, 'subsampling': '4:1:1'}, "Subsampling")
+
+    def test_valid_request_renders(self):
+        content_type, body, headers = server.render_job(
+            {'html': HTML, 'quality': 80, 'max_bytes': 200000, 'card': 0, 'path': None})
+        self.assertEqual(content_type, 'image/jpeg')
+        self.assertEqual(headers['X-Card-Total'], 1)
+        self.assertLessEqual(len(body), 200000)
+
+class HTTPTest(unittest.TestCase):
+    def setUp(self):
+        self.httpd = server.make_server(server.RenderPool(workers=1), port=0)
+        thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+        thread.start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+
+    def post(self, payload):
+        conn = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=10)
+        self.addCleanup(conn.close)
+        conn.request('POST', '/render', json.dumps(payload))
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+
+    def test_bad_fields_are_400_not_500(self):
+        self.assertEqual(self.post({'html': 42}), (400, {'error': "'html' must be a string"}))
+        status, body = self.post({'html': HTML, 'quality': 500})
+        self.assertEqual(status, 400)
+        self.assertIn('quality', body['error'])
+
+    def test_bad_content_length_is_400(self):
+        for length in ('-1', 'abc'):
+            conn = http.client.HTTPConnection('127.0.0.1', self.httpd.server_address[1], timeout=10)
+            self.addCleanup(conn.close)
+            conn.putrequest('POST', '/render')
+            conn.putheader('Content-Length', length)
+            conn.endheaders(json.dumps({'html': HTML}).encode('utf-8'))
+            response = conn.getresponse()
+            self.assertEqual((response.status, json.loads(response.read())),
+                             (400, {'error': "Invalid Content-Length"}), length)
+
+if __name__ == '__main__':
+    unittest.main()